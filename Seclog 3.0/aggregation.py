@@ -0,0 +1,135 @@
+import threading
+from collections import Counter
+
+from event_batch import from_epoch, to_epoch, to_int
+from metrics import METRICS
+from templates import LITERAL, TEMPLATES, pattern_counts
+
+# This file contains the aggregation engine behind the dashboard cards, the
+# Summary tab and the hourly graph. Counts are updated incrementally from
+# delta batches, so a refresh costs O(new events) rather than O(all events).
+#
+# Message templates are counted per Template object (see templates.py) and
+# rolled up into patterns only when read, so removing an event always
+# subtracts from the count it was added to.
+
+
+def template_keys(records):
+    """
+    The keys record dicts are counted under in EventAggregator.templates:
+    (EventID, Template), or (EventID, text) for messages kept literally.
+    """
+    keys = []
+    templates = TEMPLATES.templates
+    for r in records:
+        event_id = to_int(r["EventID"])
+        template_id, inserts = TEMPLATES.encode(r["SourceName"], event_id, r["Message"])
+        keys.append((event_id, templates[template_id] if template_id != LITERAL else inserts))
+    return keys
+
+
+def hour_label(hour):
+    """Hour number (wall-clock seconds // 3600) -> '2024-01-02 13:00'."""
+    return from_epoch(hour * 3600)[:13] + ":00"
+
+
+class EventAggregator:
+    """
+    Running per-EventID, per-source, per-type, per-log-type, per-hour and
+    per-message-template counts. Safe to update from a worker thread while
+    the UI reads it.
+    """
+    def __init__(self, batch=None):
+        self._lock = threading.Lock()
+        self.reset()
+        if batch:
+            self.add_batch(batch)
+
+    def reset(self):
+        with self._lock:
+            self.total = 0
+            self.event_ids = Counter()
+            self.sources = Counter()
+            self.event_types = Counter()
+            self.log_types = Counter()
+            self.hours = Counter()
+            self.templates = Counter()  # (EventID, Template or literal text) -> count, see template_keys()
+
+    def add(self, records, log_type=None, keys=None):
+        """Counts a batch of new record dicts; 'keys' are their template_keys(), if already known."""
+        self._apply(self._count_records(records, log_type, keys), 1)
+
+    def remove(self, records, log_type=None, keys=None):
+        """
+        Un-counts record dicts that dropped out of a window. 'keys' should be
+        the template keys they were added with: by now their messages may
+        encode to a more general template.
+        """
+        self._apply(self._count_records(records, log_type, keys), -1)
+
+    def add_batch(self, batch):
+        """Counts an EventBatch straight from its columns."""
+        with METRICS.stage("aggregate"):
+            self._add_batch(batch)
+
+    def _add_batch(self, batch):
+        sources = Counter()
+        for code, count in Counter(batch.sources).items():
+            sources[batch.source_names[code]] = count
+        times = batch.times
+        deltas = {
+            "event_ids": Counter(batch.event_ids),
+            "sources": sources,
+            "event_types": Counter(batch.event_types),
+            "hours": Counter(t // 3600 for t in times),
+            "log_types": Counter(batch.log_type_counts()),
+            "templates": (Counter(zip(batch.event_ids, batch.messages)) if batch.templates is None
+                          else batch.templates.count_templates(batch.event_ids, batch.template_ids, batch.messages)),
+        }
+        self._apply(deltas, 1, len(batch))
+
+    @staticmethod
+    def _count_records(records, log_type, keys=None):
+        return {
+            "event_ids": Counter(to_int(r["EventID"]) for r in records),
+            "sources": Counter(r["SourceName"] for r in records),
+            "event_types": Counter(to_int(r["EventType"]) for r in records),
+            "hours": Counter(to_epoch(r["TimeGenerated"]) // 3600 for r in records),
+            "log_types": Counter({log_type: len(records)}) if log_type is not None else Counter(),
+            "templates": Counter(keys if keys is not None else template_keys(records)),
+        }
+
+    def _apply(self, deltas, sign, count=None):
+        if count is None:
+            count = sum(deltas["event_ids"].values())
+        with self._lock:
+            for name, delta in deltas.items():
+                target = getattr(self, name)
+                if sign > 0:
+                    target.update(delta)
+                else:
+                    target.subtract(delta)
+                    for key in delta:
+                        if target[key] <= 0:
+                            del target[key]
+            self.total += sign * count
+
+    def top(self, name, k=20):
+        """
+        Top-k (key, count) pairs of 'event_ids', 'sources', 'event_types' or
+        'templates' (whose keys are (EventID, pattern) pairs).
+        """
+        with self._lock:
+            if name == "templates":
+                return pattern_counts(self.templates).most_common(k)
+            return getattr(self, name).most_common(k)
+
+    def hourly(self, last=24):
+        """(hour label, count) pairs for the most recent 'last' hours that have events."""
+        with self._lock:
+            hours = sorted(self.hours)[-last:]
+            return [(hour_label(hour), self.hours[hour]) for hour in hours]
+
+    def log_type_counts(self):
+        with self._lock:
+            return dict(self.log_types)
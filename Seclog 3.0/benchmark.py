@@ -0,0 +1,621 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:  # Optional: peak RSS on Windows
+    psutil = None
+
+from event_sources import LOG_TYPES, JsonlFileSource, SyntheticEventSource
+
+# This file contains the benchmark suite. It runs on any OS without a real
+# event log: a realistic synthetic dataset is written to JSON Lines files once
+# and every benchmark then runs in a fresh process, so each one reports its
+# own peak RSS.
+#
+#   python benchmark.py --events 100000 1000000 --save baseline.json
+#   python benchmark.py --events 100000 1000000 --compare baseline.json
+#   python benchmark.py --bench cache_sync cache_keyword --events 100000
+#
+# --compare exits with status 1 when a benchmark lost more than --threshold
+# of its throughput, or grew its peak RSS by more than that, against the
+# baseline run.
+
+DATASET_END = datetime(2024, 6, 30, 23, 59, 59)
+DATASET_DAYS = 30
+CHANNEL_SHARE = {"Security": 0.5, "System": 0.3, "Application": 0.2}
+DEFAULT_THRESHOLD = 0.15
+
+_USERS = ["administrator", "svc_backup", "svc_sql", "jsmith", "akumar", "mgarcia", "lchen", "operator",
+          "helpdesk", "guest"] + [f"user{i:04d}" for i in range(490)]
+_HOSTS = [f"WKS-{i:04d}" for i in range(300)] + ["DC01", "DC02", "FS01", "SQL01"]
+_PROCESSES = ["C:\\Windows\\System32\\svchost.exe", "C:\\Windows\\System32\\conhost.exe",
+              "C:\\Windows\\System32\\cmd.exe", "C:\\Windows\\System32\\WindowsPowerShell\\v1.0\\powershell.exe",
+              "C:\\Program Files\\Google\\Chrome\\Application\\chrome.exe", "C:\\Windows\\explorer.exe",
+              "C:\\Windows\\System32\\taskhostw.exe", "C:\\Windows\\System32\\wbem\\WmiPrvSE.exe"]
+_SERVICES = ["Windows Update", "Background Intelligent Transfer Service", "Windows Defender Antivirus Service",
+             "Print Spooler", "Windows Modules Installer", "Remote Registry", "WinHTTP Web Proxy Auto-Discovery"]
+_APPS = ["outlook.exe", "excel.exe", "chrome.exe", "teams.exe", "java.exe", "w3wp.exe", "sqlservr.exe"]
+_MODULES = ["ntdll.dll", "KERNELBASE.dll", "ucrtbase.dll", "clr.dll", "coreclr.dll", "mso20win32client.dll"]
+
+
+def _skewed(rng, items):
+    """Picks from 'items' with a heavy head, like real user/host activity."""
+    return items[min(len(items) - 1, int(rng.paretovariate(1.2)) - 1)]
+
+
+def _ip(rng):
+    return f"10.{rng.randint(0, 3)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+
+
+def _command_line(rng, process):
+    if process.endswith("powershell.exe") and rng.random() < 0.3:
+        # Encoded PowerShell: the long messages analysts actually search through
+        payload = "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/")
+                          for _ in range(rng.randint(400, 4000)))
+        return f"\"{process}\" -NoProfile -ExecutionPolicy Bypass -EncodedCommand {payload}"
+    return f"\"{process}\" " + " ".join(f"-arg{i}" for i in range(rng.randint(0, 6)))
+
+
+def _stack_trace(rng):
+    frames = rng.randint(10, 40)
+    return " ".join(f"at Contoso.App.Module{rng.randint(1, 50)}.Method{rng.randint(1, 200)}() in "
+                    f"C:\\src\\Module{rng.randint(1, 50)}.cs:line {rng.randint(1, 900)}" for _ in range(frames))
+
+
+# (SourceName, EventID, EventType, Category, weight, inserts(rng)) per channel.
+# Weights are skewed the way a busy domain member's logs are.
+_PROFILES = {
+    "Security": [
+        ("Microsoft-Windows-Security-Auditing", 4624, 8, 12544, 35.0,
+         lambda rng: ["S-1-5-21-1004", _skewed(rng, _USERS), "CONTOSO", hex(rng.randint(0x10000, 0xfffff)),
+                      str(rng.choice((2, 3, 3, 3, 5, 10))), _skewed(rng, _HOSTS), _ip(rng)]),
+        ("Microsoft-Windows-Security-Auditing", 4634, 8, 12545, 15.0,
+         lambda rng: ["S-1-5-21-1004", _skewed(rng, _USERS), "CONTOSO", hex(rng.randint(0x10000, 0xfffff)), "3"]),
+        ("Microsoft-Windows-Security-Auditing", 4688, 8, 13312, 25.0,
+         lambda rng: ["S-1-5-18", _skewed(rng, _USERS), hex(rng.randint(0x100, 0xffff)),
+                      _command_line(rng, _skewed(rng, _PROCESSES))]),
+        ("Microsoft-Windows-Security-Auditing", 4672, 8, 12548, 12.0,
+         lambda rng: ["S-1-5-18", _skewed(rng, _USERS), "SeDebugPrivilege SeBackupPrivilege SeSecurityPrivilege"]),
+        ("Microsoft-Windows-Security-Auditing", 4776, 8, 14336, 6.0,
+         lambda rng: ["MICROSOFT_AUTHENTICATION_PACKAGE_V1_0", _skewed(rng, _USERS), _skewed(rng, _HOSTS), "0x0"]),
+        ("Microsoft-Windows-Security-Auditing", 4625, 16, 12544, 3.0,
+         lambda rng: ["S-1-0-0", _skewed(rng, _USERS), "CONTOSO", "0xc000006d", "0xc000006a", "3", _ip(rng)]),
+        ("Microsoft-Windows-Security-Auditing", 4648, 8, 12544, 3.0,
+         lambda rng: [_skewed(rng, _USERS), _skewed(rng, _HOSTS), _skewed(rng, _PROCESSES)]),
+        ("Microsoft-Windows-Security-Auditing", 4732, 8, 13826, 0.1,
+         lambda rng: [_skewed(rng, _USERS), "Administrators", "S-1-5-32-544"]),
+        ("Microsoft-Windows-Security-Auditing", 4720, 8, 13824, 0.05,
+         lambda rng: [f"user{rng.randint(500, 999):04d}", "CONTOSO", _skewed(rng, _USERS)]),
+        ("Microsoft-Windows-Eventlog", 1102, 4, 104, 0.01,
+         lambda rng: [_skewed(rng, _USERS), "CONTOSO"]),
+    ],
+    "System": [
+        ("Service Control Manager", 7036, 4, 0, 50.0,
+         lambda rng: [_skewed(rng, _SERVICES), rng.choice(("running", "stopped"))]),
+        ("Microsoft-Windows-DistributedCOM", 10016, 2, 0, 15.0,
+         lambda rng: ["application-specific", "Local", "Activation", "{D63B10C5-BB46-4990-A94F-E40B9D520160}",
+                      "{9CA88EE3-ACB7-47C8-AFC4-AB702511C244}", "NT AUTHORITY", "SYSTEM", "S-1-5-18"]),
+        ("Microsoft-Windows-DNS-Client", 1014, 2, 1014, 8.0,
+         lambda rng: [f"{rng.choice(('wpad', 'telemetry', 'cdn', 'update'))}.contoso.com", _ip(rng)]),
+        ("Service Control Manager", 7040, 4, 0, 5.0,
+         lambda rng: [_skewed(rng, _SERVICES), "demand start", "auto start", _skewed(rng, _SERVICES)]),
+        ("Service Control Manager", 7031, 1, 0, 2.0,
+         lambda rng: [_skewed(rng, _SERVICES), "1", "60000", "1", "Restart the service"]),
+        ("EventLog", 6013, 4, 0, 2.0, lambda rng: [str(rng.randint(60, 9000000)), "60", "Pacific Standard Time"]),
+        ("Microsoft-Windows-Kernel-General", 12, 4, 1, 1.0, lambda rng: ["10", "0", "19041", "1645"]),
+        ("EventLog", 6005, 4, 0, 1.0, lambda rng: []),
+        ("Service Control Manager", 7045, 4, 0, 0.05,
+         lambda rng: [f"svc{rng.randint(100, 999)}", f"C:\\Users\\Public\\svc{rng.randint(100, 999)}.exe",
+                      "user mode service", "auto start", "LocalSystem"]),
+        ("Microsoft-Windows-Kernel-Power", 41, 1, 63, 0.1, lambda rng: ["0", "0x0", "0x0", "false"]),
+    ],
+    "Application": [
+        ("Microsoft-Windows-Security-SPP", 16384, 4, 0, 20.0, lambda rng: ["2124-06-30T00:00:00Z", "RulesEngine"]),
+        ("Microsoft-Windows-User Profiles Service", 1531, 4, 0, 15.0, lambda rng: []),
+        ("VSS", 8224, 4, 0, 5.0, lambda rng: []),
+        ("Application Error", 1000, 1, 100, 5.0,
+         lambda rng: [_skewed(rng, _APPS), "16.0.17328.20162", hex(rng.randint(0x60000000, 0x6fffffff)),
+                      _skewed(rng, _MODULES), "10.0.19041.3636", "0xc0000005", hex(rng.randint(0, 0xfffff))]),
+        ("Windows Error Reporting", 1001, 4, 0, 5.0,
+         lambda rng: ["APPCRASH", "Not available", "0", _skewed(rng, _APPS)]
+         + [f"P{i}: {hex(rng.randint(0, 0xffffffff))}" for i in range(1, 11)]
+         + ["\\\\?\\C:\\ProgramData\\Microsoft\\Windows\\WER\\ReportArchive\\AppCrash_" + _skewed(rng, _APPS)]),
+        (".NET Runtime", 1026, 1, 0, 2.0,
+         lambda rng: [f"Application: {_skewed(rng, _APPS)}", "Framework Version: v4.0.30319",
+                      "Description: The process was terminated due to an unhandled exception.",
+                      "Exception Info: System.NullReferenceException", _stack_trace(rng)]),
+        ("MsiInstaller", 11707, 4, 0, 1.0, lambda rng: ["Product: Contoso Agent -- Installation completed successfully."]),
+    ],
+}
+
+
+class RealisticEventSource(SyntheticEventSource):
+    """
+    SyntheticEventSource with realistic shape: skewed EventID, user and host
+    distributions, bursts of 4625 failures (brute force, sometimes ending in
+    a 4624) and 4624 logon storms, and a share of multi-kilobyte messages.
+    'count' events are spread over 'days' days ending at 'end'.
+    """
+    BURST_RATE = 0.0005
+
+    def __init__(self, channel, count=10000, end=None, days=DATASET_DAYS, seed=0):
+        interval = max(1, days * 86400 // max(count, 1))
+        super().__init__(channel, count, end or DATASET_END, interval, seed)
+        profiles = _PROFILES.get(channel, _PROFILES["Application"])
+        self.profiles = [(source, eid, etype, cat, inserts) for source, eid, etype, cat, _, inserts in profiles]
+        self.cum_weights = []
+        total = 0
+        for profile in profiles:
+            total += profile[4]
+            self.cum_weights.append(total)
+
+    def _iter_raw(self):
+        rng = random.Random(f"{self.seed}:{self.channel}")
+        current = self.end
+        produced = 0
+        while produced < self.count:
+            if self.channel == "Security" and rng.random() < self.BURST_RATE:
+                events = self._burst(rng)
+            else:
+                source, eid, etype, cat, inserts = rng.choices(self.profiles, cum_weights=self.cum_weights)[0]
+                events = [(0, (source, eid, etype, cat, inserts(rng)))]
+            for gap, event in events[:self.count - produced]:
+                current -= timedelta(seconds=gap)
+                yield current, (current, event)
+            produced += len(events)
+            current -= timedelta(seconds=rng.random() * 2 * self.interval)
+
+    @staticmethod
+    def _burst(rng):
+        """A run of (seconds since the previous event, event) pairs, newest first."""
+        auditing = "Microsoft-Windows-Security-Auditing"
+        ip = _ip(rng)
+        if rng.random() < 0.5:
+            # Logon storm, e.g. a scheduled job fanning out to every host
+            user = _skewed(rng, _USERS)
+            return [(rng.randint(0, 1), (auditing, 4624, 8, 12544, ["S-1-5-21-1004", user, "CONTOSO",
+                                                                   hex(rng.randint(0x10000, 0xfffff)), "3",
+                                                                   _skewed(rng, _HOSTS), ip]))
+                    for _ in range(rng.randint(50, 500))]
+        # Password guessing from one address; sometimes it succeeds
+        events = []
+        if rng.random() < 0.3:
+            events.append((0, (auditing, 4624, 8, 12544, ["S-1-5-21-1004", "administrator", "CONTOSO",
+                                                          "0x3e7", "3", "UNKNOWN", ip])))
+        targets = [rng.choice(_USERS) for _ in range(rng.randint(1, 20))]
+        for _ in range(rng.randint(30, 300)):
+            events.append((rng.randint(0, 2), (auditing, 4625, 16, 12544, ["S-1-0-0", rng.choice(targets), "CONTOSO",
+                                                                          "0xc000006d", "0xc000006a", "3", ip])))
+        return events
+
+
+def write_dataset(directory, events, seed=0):
+    """Writes 'events' realistic events as one newest-first JSONL file per channel."""
+    meta_path = os.path.join(directory, "dataset.json")
+    meta = {"events": events, "seed": seed, "end": DATASET_END.isoformat(), "channels": {}}
+    if os.path.exists(meta_path):
+        with open(meta_path, encoding="utf-8") as f:
+            existing = json.load(f)
+        if {k: existing.get(k) for k in ("events", "seed", "end")} == {k: meta[k] for k in ("events", "seed", "end")}:
+            return existing  # Reuse the files from an earlier run
+    os.makedirs(directory, exist_ok=True)
+    for log_type in LOG_TYPES:
+        count = int(events * CHANNEL_SHARE[log_type])
+        path = os.path.join(directory, f"{log_type}.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for record in RealisticEventSource(log_type, count, seed=seed).read():
+                f.write(json.dumps(record) + "\n")
+        meta["channels"][log_type] = {"path": path, "events": count}
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None if unknown."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KB elsewhere
+    if psutil is not None:
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+    return None
+
+
+class SkipBenchmark(Exception):
+    """Raised when a benchmark cannot run here, e.g. the GUI ones without a display."""
+
+
+class BenchmarkContext:
+    """The dataset and shared setup for one benchmark process."""
+    def __init__(self, meta, workdir, repeat):
+        self.meta = meta
+        self.workdir = workdir
+        self.repeat = repeat
+        self.total = sum(channel["events"] for channel in meta["channels"].values())
+        self._batch = None
+
+    def sources(self):
+        return {log_type: JsonlFileSource(channel["path"], log_type, order="desc")
+                for log_type, channel in self.meta["channels"].items()}
+
+    def handler(self, store=None):
+        from log_handler import LogHandler
+        return LogHandler(self.sources(), store=store)
+
+    def batch(self):
+        """All events as an EventBatch; built once, outside the timed code."""
+        if self._batch is None:
+            self._batch = self.handler().fetch_logs(LOG_TYPES, "", "", "")[0]
+        return self._batch
+
+    def timeit(self, func, events=None):
+        """
+        Runs 'func' 'repeat' times and keeps the fastest run. 'func' returns
+        the number of events it processed unless 'events' is given.
+        """
+        best = None
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            processed = func()
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        return (events if events is not None else processed), best
+
+
+def bench_fetch_all(ctx):
+    """fetch_logs over every channel with no filter."""
+    handler = ctx.handler()
+    return ctx.timeit(lambda: len(handler.fetch_logs(LOG_TYPES, "", "", "")[0]))
+
+
+def bench_fetch_range(ctx):
+    """fetch_logs for the most recent week; throughput counts every stored event."""
+    handler = ctx.handler()
+    start = (DATASET_END - timedelta(days=7)).strftime("%Y-%m-%d")
+    return ctx.timeit(lambda: len(handler.fetch_logs(LOG_TYPES, start, "", "")[0]), events=ctx.total)
+
+
+def bench_keyword(ctx):
+    """Keyword search latency: EventID, user name and phrase terms over all channels."""
+    handler = ctx.handler()
+    query = '4625 administrator OR "EncodedCommand" OR 7045'
+    return ctx.timeit(lambda: len(handler.fetch_logs(LOG_TYPES, "", "", query)[0]), events=ctx.total)
+
+
+def bench_query(ctx):
+    """A selective query: EventID set, last week and a Message term; throughput counts every stored event."""
+    handler = ctx.handler()
+    start = (DATASET_END - timedelta(days=7)).strftime("%Y-%m-%d")
+    query = f'EventID in (4624, 4625) and time >= "{start}" and Message ~ "administrator"'
+    return ctx.timeit(lambda: len(handler.query_logs(query)[0]), events=ctx.total)
+
+
+def bench_aggregate(ctx):
+    """The aggregation behind update_summary_tab and draw_event_graph, without the widgets."""
+    from aggregation import EventAggregator
+    batch = ctx.batch()
+
+    def run():
+        aggregator = EventAggregator(batch)
+        for name in ("event_ids", "sources", "event_types"):
+            aggregator.top(name)
+        aggregator.hourly(24)
+        return len(batch)
+    return ctx.timeit(run)
+
+
+def bench_rules(ctx):
+    """The built-in detection rules over every event, as run after a fetch."""
+    from rules import DEFAULT_RULES, RuleEngine
+    batch = ctx.batch()
+    return ctx.timeit(lambda: RuleEngine(DEFAULT_RULES).process_batch(batch), events=len(batch))
+
+
+def bench_export_csv(ctx):
+    """CSV export of every event through ExportJob, run on this thread."""
+    from exporter import ExportJob
+    batch = ctx.batch()
+    path = os.path.join(ctx.workdir, "export.csv")
+
+    def run():
+        job = ExportJob(batch, path, "csv")
+        job.run()
+        return job.written
+    return ctx.timeit(run)
+
+
+def _gui_root():
+    try:
+        import customtkinter as ctk
+        root = ctk.CTk()
+    except Exception as e:  # ImportError, or TclError without a display
+        raise SkipBenchmark(f"needs customtkinter and a display ({e})")
+    root.withdraw()
+    return root
+
+
+def bench_summary_ui(ctx):
+    """update_summary_tab and draw_event_graph on real (hidden) widgets."""
+    root = _gui_root()
+    import customtkinter as ctk
+    from aggregation import EventAggregator
+    from ui_components import draw_event_graph, update_summary_tab
+    try:
+        import matplotlib  # noqa: F401
+    except ImportError:
+        raise SkipBenchmark("needs matplotlib")
+
+    class Dashboard:
+        """The widgets the summary functions draw into."""
+        def __init__(self, master):
+            self.event_id_summary_frame = ctk.CTkScrollableFrame(master)
+            self.source_summary_frame = ctk.CTkScrollableFrame(master)
+            self.event_type_summary_frame = ctk.CTkScrollableFrame(master)
+            self.template_summary_frame = ctk.CTkScrollableFrame(master)
+            self.graph_frame = ctk.CTkFrame(master)
+            self.summary_label_pools = {}  # Filled per frame by _update_label_list
+
+    dashboard = Dashboard(root)
+    batch = ctx.batch()
+
+    def run():
+        aggregator = EventAggregator(batch)
+        update_summary_tab(dashboard, aggregator)
+        draw_event_graph(dashboard, aggregator)
+        root.update_idletasks()
+        return len(batch)
+    try:
+        return ctx.timeit(run)
+    finally:
+        root.destroy()
+
+
+def bench_render(ctx):
+    """display_logs into the virtual log table, then a sort and 100 scroll steps."""
+    root = _gui_root()
+    from log_table import VirtualLogTable
+    from ui_components import display_logs
+    table = VirtualLogTable(root)
+    table.pack(fill="both", expand=True)
+    root.update_idletasks()
+    batch = ctx.batch()
+
+    def run():
+        display_logs(table, batch)
+        table.sort_by("EventID")
+        for _ in range(100):
+            table.scroll_rows(40)
+        root.update_idletasks()
+        return len(batch)
+    try:
+        return ctx.timeit(run)
+    finally:
+        root.destroy()
+
+
+def bench_collector(ctx):
+    """Every event forwarded over loopback TCP by 200 concurrent shippers to one collector."""
+    import asyncio
+    from collector import Collector, Shipper
+    batch = ctx.batch()
+    hosts = 200
+    pairs = [(record["LogType"], record) for record in batch]
+    shares = [pairs[i::hosts] for i in range(hosts)]
+
+    async def forward(address, host_name, share):
+        shipper = await Shipper(address, host_name).connect()
+        try:
+            for start in range(0, len(share), 1000):
+                await shipper.send(share[start:start + 1000])
+            await shipper.flush()
+        finally:
+            await shipper.close()
+
+    async def run():
+        received = []
+        collector = await Collector(lambda items: received.append(len(items)), "127.0.0.1", 0).start()
+        try:
+            address = ("127.0.0.1", collector.port)
+            await asyncio.gather(*(forward(address, f"host-{i}", share) for i, share in enumerate(shares)))
+        finally:
+            await collector.close()
+        return sum(received)
+    return ctx.timeit(lambda: asyncio.run(run()))
+
+
+def bench_cache_sync(ctx):
+    """Ingesting every event into a fresh event cache."""
+    from event_store import EventStore
+
+    def run():
+        path = os.path.join(ctx.workdir, "events.db")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        store = EventStore(path)
+        try:
+            return store.sync(ctx.sources())
+        finally:
+            store.close()
+    return ctx.timeit(run)
+
+
+def bench_cache_keyword(ctx):
+    """The keyword benchmark answered from the event cache's indexes."""
+    from event_store import EventStore
+    store = EventStore(os.path.join(ctx.workdir, "events.db"))
+    handler = ctx.handler(store)
+    handler.fetch_logs(LOG_TYPES, "", "", "")  # Fills the cache outside the timed runs
+    query = '4625 administrator OR "EncodedCommand" OR 7045'
+    try:
+        return ctx.timeit(lambda: len(handler.fetch_logs(LOG_TYPES, "", "", query)[0]), events=ctx.total)
+    finally:
+        store.close()
+
+
+BENCHMARKS = {
+    "fetch_all": bench_fetch_all,
+    "fetch_range": bench_fetch_range,
+    "keyword": bench_keyword,
+    "query": bench_query,
+    "aggregate": bench_aggregate,
+    "rules": bench_rules,
+    "summary_ui": bench_summary_ui,
+    "render": bench_render,
+    "export_csv": bench_export_csv,
+    "collector": bench_collector,
+    "cache_sync": bench_cache_sync,
+    "cache_keyword": bench_cache_keyword,
+}
+# The cache benchmarks take minutes at 1M events, so they only run when asked for
+DEFAULT_BENCHMARKS = [name for name in BENCHMARKS if not name.startswith("cache_")]
+
+
+def run_child(name, data_dir, repeat):
+    """Runs one benchmark in this process and prints its result as JSON."""
+    with open(os.path.join(data_dir, "dataset.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    workdir = tempfile.mkdtemp(prefix="seclog-bench-")
+    try:
+        ctx = BenchmarkContext(meta, workdir, repeat)
+        result = {"name": name, "dataset": ctx.total}
+        try:
+            events, seconds = BENCHMARKS[name](ctx)
+        except SkipBenchmark as e:
+            result["skipped"] = str(e)
+        else:
+            result.update(events=events, seconds=round(seconds, 4),
+                          events_per_sec=round(events / seconds) if seconds else None)
+        peak = peak_rss_mb()
+        result["peak_rss_mb"] = round(peak, 1) if peak is not None else None
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(result))
+    return 0
+
+
+def run_benchmark(name, data_dir, repeat):
+    """Runs one benchmark in a fresh interpreter so that its peak RSS is its own."""
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", name, "--data-dir", data_dir,
+                           "--repeat", str(repeat)], stdout=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        return {"name": name, "error": f"exit status {proc.returncode}"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline, threshold):
+    """Returns the regressions of 'results' against a baseline run, as printable lines."""
+    previous = {(r["name"], r["dataset"]): r for r in baseline["results"] if "events_per_sec" in r}
+    regressions = []
+    for result in results:
+        old = previous.get((result["name"], result.get("dataset")))
+        if old is None or "events_per_sec" not in result:
+            continue
+        label = f"{result['name']} @ {result['dataset']}"
+        if result["events_per_sec"] < old["events_per_sec"] * (1 - threshold):
+            regressions.append(f"{label}: {result['events_per_sec']} events/s, "
+                               f"baseline {old['events_per_sec']} events/s")
+        if result.get("peak_rss_mb") and old.get("peak_rss_mb") and \
+                result["peak_rss_mb"] > old["peak_rss_mb"] * (1 + threshold):
+            regressions.append(f"{label}: peak RSS {result['peak_rss_mb']} MB, baseline {old['peak_rss_mb']} MB")
+    return regressions
+
+
+def format_result(result, baseline=None):
+    if "error" in result:
+        return f"{result['name']:<14} failed: {result['error']}"
+    if "skipped" in result:
+        return f"{result['name']:<14} skipped: {result['skipped']}"
+    line = (f"{result['name']:<14} {result['dataset']:>10} events  {result['seconds']:>9.3f} s  "
+            f"{result['events_per_sec']:>12,} events/s  peak RSS {result['peak_rss_mb']} MB")
+    if baseline:
+        old = next((r for r in baseline["results"] if r["name"] == result["name"]
+                    and r.get("dataset") == result["dataset"] and "events_per_sec" in r), None)
+        if old:
+            line += f"  ({result['events_per_sec'] / old['events_per_sec'] - 1:+.1%})"
+    return line
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="SecLog benchmark suite")
+    parser.add_argument("--events", type=int, nargs="+", default=[100000],
+                        help="dataset sizes to run (default: 100000)")
+    parser.add_argument("--bench", nargs="+", choices=list(BENCHMARKS), default=DEFAULT_BENCHMARKS,
+                        help="benchmarks to run (default: all but the cache_* ones)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark; the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="where to keep the generated datasets (default: a temporary directory)")
+    parser.add_argument("--save", metavar="PATH", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="flag regressions against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed throughput loss / RSS growth before --compare fails (default: 0.15)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.child:
+        return run_child(args.child, args.data_dir, args.repeat)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    data_root = args.data_dir or tempfile.mkdtemp(prefix="seclog-data-")
+    results = []
+    try:
+        for events in args.events:
+            data_dir = os.path.join(data_root, f"{events}-{args.seed}")
+            print(f"Generating {events} events in {data_dir}...", file=sys.stderr)
+            write_dataset(data_dir, events, args.seed)
+            for name in args.bench:
+                result = run_benchmark(name, data_dir, args.repeat)
+                results.append(result)
+                print(format_result(result, baseline))
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_root, ignore_errors=True)
+
+    if args.save:
+        report = {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "results": results,
+        }
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.save}", file=sys.stderr)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nRegressions beyond {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\nNo regressions beyond {args.threshold:.0%}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,434 @@
+import argparse
+import csv
+import json
+import sys
+import threading
+import time
+from itertools import islice
+
+from event_sources import LOCAL_HOST, LOG_TYPES, SyntheticEventSource, default_sources, source_from_path
+from exporter import FIELDNAMES
+from log_handler import LogHandler, parse_date_range
+from metrics import METRICS, SamplingProfiler
+from query import Query
+from rules import format_alert, load_rules
+
+# This file contains the headless command-line interface. It only depends on
+# LogHandler and the backend modules; no GUI or plotting library is imported,
+# so it runs on server-core hosts and from cron.
+#
+#   python run.py query -c Security --start 2024-01-01 --keyword 4625
+#   python run.py query -q 'EventID in (4624,4625) and time > now-2h and Message ~ admin'
+#   python run.py tail --format jsonl
+#   python run.py export --output security.jsonl.gz -c Security
+#   python run.py stats --json
+#   python run.py --rules my_rules.json alerts --follow
+#   python run.py --metrics prometheus --metrics-file seclog.prom tail
+#   python run.py --cache collect --listen 0.0.0.0:8515 --token-file ~/.seclog/token
+#   python run.py ship --to collector:8515 --token-file ~/.seclog/token --cursor-file ~/.seclog/ship.json
+#   python run.py --cache query --host web01 -q 'EventID = 4625'
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="seclog", description="SecLog - Windows event log viewer (headless mode)")
+    parser.add_argument("--source", action="append", default=[], metavar="CHANNEL=PATH",
+                        help="read CHANNEL from an exported .evtx/.jsonl/.csv file (repeatable)")
+    parser.add_argument("--synthetic", type=int, metavar="N",
+                        help="use N synthetic events per channel instead of the system logs")
+    parser.add_argument("--cache", nargs="?", const="", metavar="PATH",
+                        help="serve queries from the indexed event cache (default ~/.seclog/events.db)")
+    parser.add_argument("--workers", type=int, help="maximum concurrent channel/chunk readers")
+    parser.add_argument("--rules", action="append", metavar="PATH",
+                        help="detection rules file, JSON or YAML (repeatable; default: ~/.seclog/rules.json if present)")
+    parser.add_argument("--no-default-rules", action="store_true", help="only use the rules given with --rules")
+    parser.add_argument("--metrics", choices=["prometheus", "json"],
+                        help="write stage timings and counters in this format when the command ends")
+    parser.add_argument("--metrics-file", default="-", metavar="PATH",
+                        help="where --metrics goes (default: stderr); 'tail' rewrites it every 10 seconds")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="write a sampling profile (collapsed stacks, for flamegraph.pl/speedscope) to PATH; "
+                             "'tail' profiles its first monitoring interval")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add_filters(p):
+        p.add_argument("-c", "--channel", action="append", help="channel to read (repeatable, default: all)")
+        p.add_argument("--start", help="start date, YYYY-MM-DD")
+        p.add_argument("--end", help="end date, YYYY-MM-DD")
+        p.add_argument("-k", "--keyword", default="", help="keyword query (AND/OR/\"phrase\")")
+        p.add_argument("--host", action="append", help="only events from this host (repeatable, default: all)")
+        p.add_argument("-q", "--query", default="",
+                       help="query expression, e.g. 'EventID in (4624,4625) and time > now-2h'; "
+                            "combined with the other filters")
+
+    query = sub.add_parser("query", help="print matching events, newest first")
+    add_filters(query)
+    query.add_argument("-n", "--limit", type=int, help="stop after N events")
+    query.add_argument("-f", "--format", choices=["text", "jsonl", "csv"], default="text")
+
+    tail = sub.add_parser("tail", help="follow new events until interrupted")
+    tail.add_argument("-c", "--channel", action="append", help="channel to follow (repeatable, default: all)")
+    tail.add_argument("-f", "--format", choices=["text", "jsonl", "csv"], default="text")
+    tail.add_argument("--cursor-file", help="where to keep the per-channel cursors")
+
+    export = sub.add_parser("export", help="export matching events to a file")
+    add_filters(export)
+    export.add_argument("-o", "--output", required=True, help="output file; the extension picks the format")
+
+    stats = sub.add_parser("stats", help="print event counts and top EventIDs/sources/types/message templates")
+    add_filters(stats)
+    stats.add_argument("--top", type=int, default=10)
+    stats.add_argument("--json", action="store_true", help="print the statistics as JSON")
+
+    alerts = sub.add_parser("alerts", help="run the detection rules over matching events")
+    add_filters(alerts)
+    alerts.add_argument("--follow", action="store_true", help="keep watching new events until interrupted")
+    alerts.add_argument("-f", "--format", choices=["text", "jsonl"], default="text")
+
+    cache = sub.add_parser("cache", help="maintain the event cache")
+    cache.add_argument("action", choices=["sync", "rebuild", "compact"])
+
+    collect = sub.add_parser("collect", help="receive events forwarded by 'ship' from other hosts")
+    collect.add_argument("--listen", default="127.0.0.1:8515", metavar="HOST:PORT",
+                         help="address to accept shippers on (default: this machine only)")
+    collect.add_argument("--token-file", help="file holding a token every shipper must present")
+    collect.add_argument("-f", "--format", choices=["text", "jsonl", "csv"],
+                         help="also print every received event in this format")
+    collect.add_argument("--stats-interval", type=float, default=10.0, metavar="SECONDS",
+                         help="how often to report connections and events/s on stderr")
+
+    ship = sub.add_parser("ship", help="forward new events to a collector")
+    ship.add_argument("--to", required=True, metavar="HOST:PORT", help="address of the collector")
+    ship.add_argument("-c", "--channel", action="append", help="channel to forward (repeatable, default: all)")
+    ship.add_argument("--host-name", default=LOCAL_HOST, help="name the events are tagged with (default: this host)")
+    ship.add_argument("--token-file", help="file holding the token the collector requires")
+    ship.add_argument("--cursor-file", help="where to keep the per-channel cursors; forwarding resumes from them")
+    ship.add_argument("--from-start", action="store_true",
+                      help="forward each channel's history first when there is no saved cursor")
+    ship.add_argument("--no-compress", action="store_true", help="send plain JSON Lines frames")
+    ship.add_argument("--fleet", type=int, default=1, metavar="N",
+                      help="simulate N hosts (HOST-NAME-1..N) shipping the same sources, for load tests")
+
+    return parser
+
+
+def build_log_handler(args):
+    """
+    Creates a LogHandler for the sources and cache chosen on the command line.
+    Raises ValueError if 'query', 'tail' or 'export' has no events to read.
+    """
+    if args.synthetic is not None:
+        sources = {log_type: SyntheticEventSource(log_type, count=args.synthetic) for log_type in LOG_TYPES}
+    elif args.source:
+        sources = {}
+        for spec in args.source:
+            channel, sep, path = spec.partition("=")
+            if not sep:
+                path, channel = channel, None
+            source = source_from_path(path, channel)
+            sources[source.channel] = source
+    else:
+        sources = default_sources()
+
+    store = None
+    if args.cache is not None or args.command == "cache":
+        from event_store import EventStore  # sqlite3 is only needed with the cache
+        store = EventStore(args.cache or None)
+    if not sources and args.command != "collect":
+        message = "no event sources; use --source CHANNEL=PATH or --synthetic N"
+        # Without sources these commands would print nothing and look successful
+        if args.command == "tail" or (args.command in ("query", "export") and (store is None or not store.count())):
+            raise ValueError(message if store is None else message + ", or fill the cache with 'cache sync'")
+        print(f"seclog: {message}", file=sys.stderr)
+    rules = load_rules(args.rules, include_defaults=not args.no_default_rules)
+    return LogHandler(sources, store=store, max_workers=args.workers, rules=rules)
+
+
+class RecordWriter:
+    """Writes records to a stream as text lines, JSON Lines or CSV."""
+    def __init__(self, stream, fmt):
+        self.stream = stream
+        self.fmt = fmt
+        if fmt == "csv":
+            self.writer = csv.DictWriter(stream, fieldnames=FIELDNAMES, restval="", extrasaction="ignore")
+            self.writer.writeheader()
+
+    def write(self, log_type, record):
+        if self.fmt == "text":
+            host = record.get("Host")
+            prefix = f"{host} " if host and host != LOCAL_HOST else ""
+            self.stream.write(f"{prefix}[{record['TimeGenerated']}] {record['SourceName']} (ID {record['EventID']}): "
+                              f"{record['Message']}\n")
+            return
+        record = dict(record, LogType=log_type)
+        if self.fmt == "jsonl":
+            self.stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+        else:
+            self.writer.writerow(record)
+
+
+def build_query(args):
+    """The --query expression and the -c/--start/--end/-k/--host shortcuts as one Query; raises ValueError."""
+    start_dt, end_dt = parse_date_range(args.start, args.end)
+    query = Query.from_filters(args.channel, start_dt, end_dt, args.keyword, args.host)
+    if args.query:
+        query = query & Query.parse(args.query)
+    return query
+
+
+def cmd_query(handler, args):
+    query = build_query(args)
+    writer = RecordWriter(sys.stdout, args.format)
+    stream = handler.iter_records(query)
+    try:
+        for log_type, record in islice(stream, args.limit):
+            writer.write(log_type, record)
+    finally:
+        stream.close()  # Stops the background readers when --limit cut the stream short
+    return 0
+
+
+def cmd_tail(handler, args):
+    if args.cursor_file:
+        from tailing import CursorStore
+        handler.cursor_store = CursorStore(args.cursor_file)
+    writer = RecordWriter(sys.stdout, args.format)
+    channels = args.channel or list(handler.sources)
+
+    def on_new_logs(new_logs, counts):
+        for log_type, record in new_logs:
+            writer.write(log_type, record)
+        sys.stdout.flush()
+
+    if args.profile:
+        handler.request_profile(args.profile)
+    handler.start_monitoring(on_new_logs, channels)
+    last_metrics = time.monotonic()
+    try:
+        while handler.monitoring:
+            time.sleep(0.5)
+            if args.metrics and args.metrics_file != "-" and time.monotonic() - last_metrics >= 10:
+                METRICS.write(args.metrics_file, args.metrics)
+                last_metrics = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        handler.stop_monitoring()
+    return 0
+
+
+def cmd_export(handler, args):
+    # Stream straight from the reader so memory stays flat
+    rows = (dict(record, LogType=log_type) for log_type, record in handler.iter_records(build_query(args)))
+    result = {}
+
+    def on_progress(written, total):
+        sys.stderr.write(f"\rExported {written} events")
+        sys.stderr.flush()
+
+    def on_done(written, error, cancelled):
+        result.update(written=written, error=error, cancelled=cancelled)
+
+    job = handler.export_logs(rows, args.output, progress_callback=on_progress, done_callback=on_done)
+    try:
+        while job.is_alive():
+            job.join(0.2)
+    except KeyboardInterrupt:
+        job.cancel()
+        job.join()
+    sys.stderr.write("\n")
+    if result.get("error") is not None:
+        print(f"Export failed: {result['error']}", file=sys.stderr)
+        return 1
+    if result.get("cancelled"):
+        print("Export cancelled.", file=sys.stderr)
+        return 130
+    print(f"{result.get('written', 0)} events saved to {args.output}", file=sys.stderr)
+    return 0
+
+
+def cmd_stats(handler, args):
+    from aggregation import EventAggregator
+    logs, counts = handler.query_logs(build_query(args))
+    aggregator = EventAggregator(logs)
+    stats = {
+        "total": len(logs),
+        "by_log_type": {k: v for k, v in counts.items() if v},
+        "top_event_ids": aggregator.top("event_ids", args.top),
+        "top_sources": aggregator.top("sources", args.top),
+        "top_event_types": aggregator.top("event_types", args.top),
+        "top_templates": aggregator.top("templates", args.top),
+        "hourly": aggregator.hourly(24),
+    }
+    if args.json:
+        json.dump(stats, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return 0
+    print(f"Total events: {stats['total']}")
+    for log_type, count in stats["by_log_type"].items():
+        print(f"  {log_type}: {count}")
+    for title, key in (("Top Event IDs", "top_event_ids"), ("Top sources", "top_sources"),
+                       ("Top event types", "top_event_types"), ("Events per hour", "hourly")):
+        print(f"\n{title}:")
+        for value, count in stats[key]:
+            print(f"  {value}: {count}")
+    print("\nTop message templates:")
+    for (event_id, pattern), count in stats["top_templates"]:
+        print(f"  [{event_id}] {pattern}: {count}")
+    return 0
+
+
+def write_alerts(alerts, fmt):
+    for alert in alerts:
+        sys.stdout.write((json.dumps(alert, ensure_ascii=False) if fmt == "jsonl" else format_alert(alert)) + "\n")
+    sys.stdout.flush()
+
+
+def cmd_alerts(handler, args):
+    if args.follow:
+        channels = args.channel or list(handler.sources)
+        handler.start_monitoring(lambda new_logs, counts: None, channels,
+                                 alert_callback=lambda alerts: write_alerts(alerts, args.format))
+        try:
+            while handler.monitoring:
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            handler.stop_monitoring()
+        return 0
+    logs, _ = handler.query_logs(build_query(args))
+    alerts = handler.detect(logs)
+    write_alerts(alerts, args.format)
+    print(f"{len(alerts)} alerts in {len(logs)} events", file=sys.stderr)
+    return 0
+
+
+def cmd_cache(handler, args):
+    if args.action == "sync":
+        count = handler.store.sync(handler.sources, handler.max_workers)
+        print(f"{count} new events cached", file=sys.stderr)
+    elif args.action == "rebuild":
+        count = handler.rebuild_cache()
+        print(f"Event cache rebuilt: {count} events", file=sys.stderr)
+    else:
+        handler.store.compact()
+        print("Event cache compacted", file=sys.stderr)
+    return 0
+
+
+def read_token(path):
+    """The shared collector token kept in 'path', or None when no file is given."""
+    if not path:
+        return None
+    with open(path, encoding="utf-8") as f:
+        token = f.read().strip()
+    if not token:
+        raise ValueError(f"{path} is empty")
+    return token
+
+
+def cmd_collect(handler, args):
+    from collector import parse_address, run_collector
+    host, port = parse_address(args.listen)
+    try:
+        token = read_token(args.token_file)
+    except (OSError, ValueError) as e:
+        print(f"seclog: cannot read the token: {e}", file=sys.stderr)
+        return 1
+    if token is None and host not in ("127.0.0.1", "::1", "localhost"):
+        print(f"seclog: warning: any host that can reach {host}:{port} can send events; "
+              "consider --token-file", file=sys.stderr)
+    writer = RecordWriter(sys.stdout, args.format) if args.format else None
+    lock = threading.Lock()
+
+    def sink(pairs):
+        handler.receive(pairs)
+        if writer is not None:
+            with lock:
+                for log_type, record in pairs:
+                    writer.write(log_type, record)
+                sys.stdout.flush()
+
+    def report(connections, rate):
+        print(f"{connections} hosts connected, {rate:,.0f} events/s", file=sys.stderr)
+        if args.metrics and args.metrics_file != "-":
+            METRICS.write(args.metrics_file, args.metrics)
+
+    try:
+        run_collector(sink, host, port, report, args.stats_interval, token)
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"seclog: cannot listen on {host}:{port}: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def cmd_ship(handler, args):
+    import asyncio
+    from collector import parse_address, ship
+    from tailing import CursorStore
+    address = parse_address(args.to)
+    try:
+        token = read_token(args.token_file)
+    except (OSError, ValueError) as e:
+        print(f"seclog: cannot read the token: {e}", file=sys.stderr)
+        return 1
+    sources = {channel: source for channel, source in handler.sources.items()
+               if not args.channel or channel in args.channel}
+    if not any(source.supports_tail for source in sources.values()):
+        print("seclog: none of the selected channels can be followed", file=sys.stderr)
+        return 1
+
+    async def main():
+        if args.fleet > 1:
+            # Simulated hosts share the sources but not the cursors
+            await asyncio.gather(*(ship(sources, address, None, f"{args.host_name}-{i}", not args.no_compress,
+                                        from_start=args.from_start, token=token)
+                                   for i in range(1, args.fleet + 1)))
+        else:
+            cursor_store = CursorStore(args.cursor_file) if args.cursor_file else None
+            await ship(sources, address, cursor_store, args.host_name, not args.no_compress,
+                       from_start=args.from_start, token=token)
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+COMMANDS = {
+    "query": cmd_query,
+    "tail": cmd_tail,
+    "export": cmd_export,
+    "stats": cmd_stats,
+    "alerts": cmd_alerts,
+    "cache": cmd_cache,
+    "collect": cmd_collect,
+    "ship": cmd_ship,
+}
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # 'tail' runs until interrupted, so it profiles one monitoring interval instead
+    profiler = SamplingProfiler().start() if args.profile and args.command != "tail" else None
+    try:
+        handler = build_log_handler(args)
+        return COMMANDS[args.command](handler, args)
+    except ValueError as e:
+        print(f"seclog: {e}", file=sys.stderr)
+        return 2
+    except BrokenPipeError:
+        return 0  # e.g. piped into 'head'
+    finally:
+        if profiler is not None:
+            profiler.stop().dump(args.profile)
+            print(f"Profile written to {args.profile} ({profiler.samples} samples)", file=sys.stderr)
+        if args.metrics:
+            METRICS.write(args.metrics_file, args.metrics)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
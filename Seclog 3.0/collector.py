@@ -0,0 +1,480 @@
+import asyncio
+import hmac
+import json
+import re
+import struct
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from event_sources import LOCAL_HOST
+from metrics import METRICS
+
+# This file contains the multi-host collector and the shipper that feeds it.
+# Shippers tail their local event sources and forward new events over TCP;
+# the collector accepts hundreds of such connections on one asyncio loop and
+# hands the events, tagged with the sending host, to a sink (normally
+# LogHandler.receive, i.e. the same store/live window/rules pipeline local
+# events go through).
+#
+# Every message is a frame: a 4-byte big-endian payload length, a 1-byte kind
+# and the payload. A connection opens with a HELLO frame naming the host,
+# followed by EVENTS frames (JSON Lines, one {"LogType": ..., record} object
+# per line) or EVENTS_Z frames (the same, zlib-compressed). The collector
+# answers with ACK frames carrying the number of the last EVENTS frame that
+# reached the sink, so shippers only advance their cursors once their events
+# are safe (at-least-once delivery).
+#
+# Backpressure: each connection may have CONNECTION_WINDOW frames waiting for
+# the sink and the shared queue holds at most queue_size frames. A full window
+# stops the collector reading that socket, which fills the TCP buffers and
+# eventually blocks the shipper's writes; one busy host never starves others.
+#
+# The collector listens on 127.0.0.1 unless told otherwise. Anyone who can
+# connect can inject events under any host name, so when listening on other
+# interfaces give the collector and its shippers a shared token, which the
+# HELLO frame must carry.
+#
+#   python run.py --cache collect --listen 0.0.0.0:8515 --token-file token.txt
+#   python run.py ship --to collector.example.com:8515 --token-file token.txt --cursor-file ship.json
+
+DEFAULT_PORT = 8515
+PROTOCOL_VERSION = 1
+MAX_FRAME = 16 * 1024 * 1024  # Larger frames are a protocol error
+CONNECTION_WINDOW = 8  # Frames per connection waiting for the sink
+RECORD_FIELDS = ("TimeGenerated", "SourceName", "EventID", "EventType", "Category", "Message")
+MAX_HOST_NAME = 255
+TIME_PATTERN = re.compile(r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d")
+
+HELLO = 1
+EVENTS = 2
+EVENTS_Z = 3
+ACK = 4
+
+_HEADER = struct.Struct(">IB")
+_ACK = struct.Struct(">Q")
+
+
+class ProtocolError(Exception):
+    """Raised when a peer sends something that is not a valid frame."""
+
+
+def parse_address(text, default_host="127.0.0.1"):
+    """Parses "host:port", ":port" or "host" into a (host, port) pair."""
+    host, sep, port = text.rpartition(":")
+    if not sep:
+        host, port = text, ""
+    try:
+        return host.strip("[]") or default_host, int(port) if port else DEFAULT_PORT
+    except ValueError:
+        raise ValueError(f"Invalid address {text!r}; expected HOST:PORT") from None
+
+
+def encode_frame(kind, payload):
+    return _HEADER.pack(len(payload), kind) + payload
+
+
+def encode_events(pairs, compress=True):
+    """Encodes (log_type, record) pairs as one EVENTS or EVENTS_Z frame."""
+    payload = "".join(json.dumps(dict(record, LogType=log_type), ensure_ascii=False, separators=(",", ":")) + "\n"
+                      for log_type, record in pairs).encode("utf-8")
+    if compress:
+        return encode_frame(EVENTS_Z, zlib.compress(payload, 1))
+    return encode_frame(EVENTS, payload)
+
+
+def decode_events(kind, payload, host):
+    """
+    Decodes an EVENTS/EVENTS_Z payload into (log_type, record) pairs tagged
+    with 'host'. Rows that are not objects with a TimeGenerated in
+    TIME_FORMAT and a string LogType are skipped; a payload that is not
+    JSON Lines at all raises ValueError.
+    """
+    if kind == EVENTS_Z:
+        payload = zlib.decompress(payload)
+    pairs = []
+    for line in payload.splitlines():
+        if not line:
+            continue
+        row = json.loads(line)
+        if (not isinstance(row, dict) or not isinstance(row.get("TimeGenerated"), str)
+                or not TIME_PATTERN.fullmatch(row["TimeGenerated"])
+                or not isinstance(row.get("LogType", "Application"), str)):
+            METRICS.inc("collector_invalid_events")
+            continue
+        record = {field: str(row.get(field, "")) for field in RECORD_FIELDS}
+        record["SourceName"] = sys.intern(record["SourceName"])
+        record["Host"] = host
+        pairs.append((sys.intern(row.get("LogType") or "Application"), record))
+    return pairs
+
+
+def decode_hello(payload, token=None):
+    """
+    Checks a HELLO payload and returns the host name it gives (None if it
+    gives none). Raises ProtocolError for anything other than a JSON object
+    with an integer version we speak, a string host and, if 'token' is set,
+    the same token.
+    """
+    try:
+        hello = json.loads(payload)
+    except (ValueError, RecursionError):
+        raise ProtocolError("HELLO is not valid JSON") from None
+    if not isinstance(hello, dict):
+        raise ProtocolError("HELLO is not a JSON object")
+    version = hello.get("version", PROTOCOL_VERSION)
+    if not isinstance(version, int) or isinstance(version, bool):
+        raise ProtocolError(f"invalid protocol version {version!r}")
+    if version > PROTOCOL_VERSION:
+        raise ProtocolError(f"unsupported protocol version {version}")
+    host = hello.get("host")
+    if host is not None and (not isinstance(host, str) or len(host) > MAX_HOST_NAME):
+        raise ProtocolError("invalid host name")
+    if token is not None:
+        sent = hello.get("token")
+        if not isinstance(sent, str) or not hmac.compare_digest(sent.encode(), token.encode()):
+            raise ProtocolError("wrong or missing token")
+    return host or None
+
+
+async def read_frame(reader):
+    """Reads one frame; returns (kind, payload), or None at a clean end of stream."""
+    try:
+        header = await reader.readexactly(_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ProtocolError("connection closed inside a frame header") from None
+        return None
+    length, kind = _HEADER.unpack(header)
+    if length > MAX_FRAME:
+        raise ProtocolError(f"frame of {length} bytes exceeds the {MAX_FRAME} byte limit")
+    try:
+        return kind, await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise ProtocolError("connection closed inside a frame") from None
+
+
+class _Connection:
+    """Per-connection state on the collector side."""
+    __slots__ = ("host", "peer", "writer", "window", "received")
+
+    def __init__(self, host, peer, writer):
+        self.host = host
+        self.peer = peer
+        self.writer = writer
+        self.window = asyncio.Semaphore(CONNECTION_WINDOW)
+        self.received = 0  # Number of the last EVENTS frame read
+
+
+class Collector:
+    """
+    Accepts event streams from many shippers and passes them to 'sink', a
+    function called with a list of (log_type, record) pairs. The sink runs
+    on one worker thread, so it is never called concurrently and may block
+    (e.g. on a database write) without stalling the network loop. Frames
+    that arrive while the sink is busy are coalesced into one call of up to
+    'batch_size' frames. With a 'token', only shippers that send the same
+    token in their HELLO are accepted.
+    """
+    def __init__(self, sink, host="127.0.0.1", port=DEFAULT_PORT, batch_size=64, queue_size=1024, token=None):
+        self.sink = sink
+        self.host = host
+        self.port = port
+        self.token = token
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.connections = set()
+        self._handlers = set()
+        self._server = None
+        self._queue = None
+        self._consumer = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="seclog-collector")
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._consumer = asyncio.create_task(self._consume())
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]  # The real port when 0 was asked for
+        print(f"Collector listening on {self.host}:{self.port}", file=sys.stderr)
+        return self
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        """Stops accepting connections, delivers what has been received and closes the rest."""
+        self._server.close()
+        for connection in list(self.connections):
+            connection.writer.close()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self._queue.join()
+        self._consumer.cancel()
+        await self._server.wait_closed()
+        self._executor.shutdown(wait=True)
+
+    async def _handle(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        peer = f"{peer[0]}:{peer[1]}" if isinstance(peer, tuple) else str(peer)
+        connection = None
+        self._handlers.add(asyncio.current_task())
+        try:
+            frame = await read_frame(reader)
+            if frame is None:
+                return
+            kind, payload = frame
+            if kind != HELLO:
+                raise ProtocolError("expected a HELLO frame")
+            host = decode_hello(payload, self.token) or peer.rpartition(":")[0]
+            connection = _Connection(sys.intern(host), peer, writer)
+            self.connections.add(connection)
+            METRICS.inc("collector_connections")
+            METRICS.set_gauge("collector_active_connections", len(self.connections))
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                kind, payload = frame
+                if kind not in (EVENTS, EVENTS_Z):
+                    raise ProtocolError(f"unexpected frame kind {kind}")
+                await connection.window.acquire()  # Stops reading this socket while its window is full
+                connection.received += 1
+                await self._queue.put((connection, connection.received, kind, payload))
+                METRICS.inc("collector_bytes", len(payload) + _HEADER.size)
+                METRICS.set_gauge("collector_queue_depth", self._queue.qsize())
+        except (ProtocolError, ValueError) as e:
+            print(f"Collector: dropping {peer}: {e}", file=sys.stderr)
+            METRICS.inc("collector_protocol_errors")
+        except ConnectionError:
+            pass  # The shipper went away; it resends whatever was not acknowledged
+        finally:
+            if connection is not None:
+                self.connections.discard(connection)
+                METRICS.set_gauge("collector_active_connections", len(self.connections))
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self._queue.get()]
+            while len(items) < self.batch_size and not self._queue.empty():
+                items.append(self._queue.get_nowait())
+            try:
+                count = await loop.run_in_executor(self._executor, self._deliver, items)
+            except Exception as e:
+                # Nothing is acknowledged, so the shippers resend after reconnecting
+                print(f"Collector: sink failed: {e}", file=sys.stderr)
+                for connection in {item[0] for item in items}:
+                    connection.writer.close()
+            else:
+                METRICS.inc("collector_events", count)
+                self._acknowledge(items)
+            finally:
+                for item in items:
+                    item[0].window.release()
+                    self._queue.task_done()
+                METRICS.set_gauge("collector_queue_depth", self._queue.qsize())
+
+    def _deliver(self, items):
+        """Worker thread: decodes the frames and calls the sink once for all of them."""
+        with METRICS.stage("collector_decode"):
+            pairs = []
+            for connection, _, kind, payload in items:
+                try:
+                    pairs.extend(decode_events(kind, payload, connection.host))
+                except (zlib.error, ValueError) as e:
+                    # Dropped and still acknowledged, or the shipper would resend it forever
+                    print(f"Collector: bad frame from {connection.peer}: {e}", file=sys.stderr)
+                    METRICS.inc("collector_protocol_errors")
+        if pairs:
+            with METRICS.stage("collector_sink"):
+                self.sink(pairs)
+        return len(pairs)
+
+    @staticmethod
+    def _acknowledge(items):
+        last = {}
+        for connection, number, _, _ in items:
+            last[connection] = max(number, last.get(connection, 0))
+        for connection, number in last.items():
+            if not connection.writer.is_closing():
+                connection.writer.write(encode_frame(ACK, _ACK.pack(number)))
+
+
+class Shipper:
+    """
+    One connection to a collector. send() queues a batch of events and
+    waits while 'window' batches are unacknowledged; 'on_ack' is called
+    with the token of each batch once the collector has delivered it.
+    """
+    def __init__(self, address, host_name=LOCAL_HOST, compress=True, window=CONNECTION_WINDOW, on_ack=None,
+                 token=None):
+        self.address = address
+        self.host_name = host_name
+        self.token = token
+        self.compress = compress
+        self.window = window
+        self.on_ack = on_ack
+        self._reader = None
+        self._writer = None
+        self._slots = None
+        self._pending = []  # (frame number, token), oldest first
+        self._sent = 0
+        self._acks = None
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_connection(*self.address)
+        hello = {"host": self.host_name, "version": PROTOCOL_VERSION}
+        if self.token is not None:
+            hello["token"] = self.token
+        self._writer.write(encode_frame(HELLO, json.dumps(hello).encode()))
+        self._slots = asyncio.Semaphore(self.window)
+        self._pending = []
+        self._sent = 0
+        self._acks = asyncio.create_task(self._read_acks())
+        return self
+
+    async def send(self, pairs, token=None):
+        """Sends (log_type, record) pairs as one frame; raises ConnectionError if the collector went away."""
+        await self._slots.acquire()
+        if self._acks.done():
+            self._slots.release()
+            raise ConnectionError("collector closed the connection")
+        self._sent += 1
+        self._pending.append((self._sent, token))
+        self._writer.write(encode_events(pairs, self.compress))
+        await self._writer.drain()  # Blocks while the collector is not reading
+        METRICS.inc("events_shipped", len(pairs))
+
+    async def flush(self):
+        """Waits until every batch sent so far has been acknowledged."""
+        for _ in range(self.window):
+            await self._slots.acquire()
+            if self._acks.done() and self._pending:
+                raise ConnectionError("collector closed the connection")
+        for _ in range(self.window):
+            self._slots.release()
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except ConnectionError:
+                pass
+        if self._acks is not None:
+            self._acks.cancel()
+
+    async def _read_acks(self):
+        try:
+            while True:
+                frame = await read_frame(self._reader)
+                if frame is None:
+                    return
+                kind, payload = frame
+                if kind != ACK:
+                    raise ProtocolError(f"unexpected frame kind {kind}")
+                number, = _ACK.unpack(payload)
+                while self._pending and self._pending[0][0] <= number:
+                    _, token = self._pending.pop(0)
+                    if self.on_ack is not None:
+                        self.on_ack(token)
+                    self._slots.release()
+        except (ProtocolError, ConnectionError) as e:
+            print(f"Shipper: {e}", file=sys.stderr)
+        finally:
+            # Wake up senders blocked on the window so they see the closed connection
+            for _ in range(self.window):
+                self._slots.release()
+
+
+def _read_new(sources, cursors, batch_size):
+    """Worker thread: reads up to 'batch_size' new events per channel after 'cursors'."""
+    pairs = []
+    moved = {}
+    for channel, source in sources.items():
+        cursor = cursors.get(channel)
+        for cursor, record in islice(source.read_since(cursor), batch_size):
+            pairs.append((channel, record))
+            moved[channel] = cursor
+    return pairs, moved
+
+
+async def ship(sources, address, cursor_store=None, host_name=LOCAL_HOST, compress=True, batch_size=2000,
+               poll_interval=1.0, from_start=False, stop=None, token=None):
+    """
+    Tails 'sources' ({channel: EventSource}) and forwards new events to the
+    collector at 'address' until 'stop' (an asyncio.Event) is set.
+    Cursors are kept in 'cursor_store' and only advanced when the collector
+    has acknowledged the events, so a restart or a dropped connection
+    resends rather than loses events. Without a saved cursor a channel
+    starts at the current end of the log, or at its beginning if
+    'from_start' is set. 'token' is sent to a collector that requires one.
+    """
+    loop = asyncio.get_running_loop()
+    sources = {channel: source for channel, source in sources.items() if source.supports_tail}
+    acked = {}
+    for channel, source in sources.items():
+        cursor = cursor_store.get(channel) if cursor_store is not None else None
+        acked[channel] = cursor if cursor is not None or from_start else source.latest_cursor()
+    stop = stop or asyncio.Event()
+
+    def on_ack(token):
+        acked.update(token)
+        if cursor_store is not None:
+            for channel, cursor in token.items():
+                cursor_store.set(channel, cursor)
+            cursor_store.save()
+
+    backoff = 0.5
+    while not stop.is_set():
+        shipper = Shipper(address, host_name, compress, on_ack=on_ack, token=token)
+        try:
+            await shipper.connect()
+            backoff = 0.5
+            cursors = dict(acked)  # Anything read but not acknowledged is read again
+            while not stop.is_set():
+                pairs, moved = await loop.run_in_executor(None, _read_new, sources, cursors, batch_size)
+                if pairs:
+                    cursors.update(moved)
+                    await shipper.send(pairs, dict(moved))
+                if len(pairs) < batch_size:
+                    # Caught up with every channel
+                    try:
+                        await asyncio.wait_for(stop.wait(), poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+            await shipper.flush()
+        except (OSError, ConnectionError) as e:
+            print(f"Shipper: cannot reach {address[0]}:{address[1]}: {e}; retrying in {backoff:.0f} s", file=sys.stderr)
+            METRICS.inc("shipper_reconnects")
+            try:
+                await asyncio.wait_for(stop.wait(), backoff)
+            except asyncio.TimeoutError:
+                pass
+            backoff = min(backoff * 2, 30)
+        finally:
+            await shipper.close()
+
+
+def run_collector(sink, host="127.0.0.1", port=DEFAULT_PORT, report=None, report_interval=10.0, token=None):
+    """
+    Runs a collector until interrupted. 'report', if given, is called every
+    'report_interval' seconds with the events received per second.
+    """
+    async def main():
+        collector = await Collector(sink, host, port, token=token).start()
+        try:
+            last_count, last_time = 0, time.monotonic()
+            while True:
+                await asyncio.sleep(report_interval)
+                count = METRICS.snapshot()["counters"].get("collector_events", 0)
+                now = time.monotonic()
+                if report is not None:
+                    report(len(collector.connections), (count - last_count) / (now - last_time))
+                last_count, last_time = count, now
+        finally:
+            await collector.close()
+    asyncio.run(main())
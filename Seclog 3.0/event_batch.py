@@ -0,0 +1,265 @@
+from array import array
+from datetime import datetime, timedelta
+from itertools import compress
+
+from event_sources import LOCAL_HOST, TIME_FORMAT
+from templates import LITERAL
+
+# This file contains EventBatch, the columnar container passed between
+# LogHandler, SecurityLogApp and ui_components. Timestamps are int64 seconds,
+# numeric fields live in small typed arrays, SourceName and channel are
+# dictionary-encoded and messages are kept as a template id plus the
+# joined inserts (see templates.py), their text only built when a row is
+# shown.
+# The host column says which machine an event came from (see collector.py).
+#
+# Timestamps count wall-clock seconds since 1970-01-01 in the same (local)
+# time as TimeGenerated, so converting back never depends on the time zone.
+
+EPOCH = datetime(1970, 1, 1)
+_DAYS_CACHE = {}
+
+
+def to_epoch(time_generated):
+    """'YYYY-MM-DD HH:MM:SS' (or a datetime) -> wall-clock seconds since 1970-01-01."""
+    if isinstance(time_generated, datetime):
+        return int((time_generated - EPOCH).total_seconds())
+    date_part = time_generated[:10]
+    days = _DAYS_CACHE.get(date_part)
+    if days is None:
+        days = (datetime.strptime(date_part, "%Y-%m-%d") - EPOCH).days
+        _DAYS_CACHE[date_part] = days
+    return (days * 86400 + int(time_generated[11:13]) * 3600
+            + int(time_generated[14:16]) * 60 + int(time_generated[17:19]))
+
+
+def from_epoch(seconds):
+    """Wall-clock seconds -> 'YYYY-MM-DD HH:MM:SS'."""
+    return (EPOCH + timedelta(seconds=seconds)).strftime(TIME_FORMAT)
+
+
+def to_int(value):
+    """EventID/EventType/Category as int; non-numeric values map to 0."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class EventBatch:
+    """
+    Columnar batch of events. Indexing returns a record dict (with extra
+    "LogType" and "Host" keys), built on demand, so the batch can be used
+    wherever a list of records was used before. With a TemplateMiner,
+    appended messages are encoded with it; without one they are kept as text.
+    """
+    def __init__(self, templates=None):
+        self.times = array("q")
+        self.event_ids = array("H")
+        self.event_types = array("H")
+        self.categories = array("H")
+        self.sources = array("I")   # Codes into source_names
+        self.channels = array("H")  # Codes into channel_names
+        self.hosts = array("H")     # Codes into host_names
+        self.template_ids = array("i")  # Into 'templates'; LITERAL when the message is kept as text
+        self.messages = []              # The inserts of each message (or its text, see above)
+        self.templates = templates
+        self.source_names = []
+        self.channel_names = []
+        self.host_names = []
+        self._source_codes = {}
+        self._channel_codes = {}
+        self._host_codes = {}
+
+    # --- Building ---
+
+    @classmethod
+    def from_records(cls, pairs, templates=None):
+        """Builds a batch from an iterable of (log_type, record) pairs."""
+        batch = cls(templates)
+        for log_type, record in pairs:
+            batch.append(log_type, record)
+        return batch
+
+    @classmethod
+    def concat(cls, batches):
+        """Joins batches (each with its own dictionaries) into one."""
+        batches = list(batches)
+        result = cls(batches[0].templates if batches else None)
+        for batch in batches:
+            result.extend(batch)
+        return result
+
+    def extend(self, other):
+        """Appends the rows of another batch, re-coding its SourceName, channel and host codes."""
+        sources = [self.source_code(name) for name in other.source_names]
+        channels = [self.channel_code(name) for name in other.channel_names]
+        hosts = [self.host_code(name) for name in other.host_names]
+        self.times.extend(other.times)
+        self.event_ids.extend(other.event_ids)
+        self.event_types.extend(other.event_types)
+        self.categories.extend(other.categories)
+        self.sources.extend(array("I", map(sources.__getitem__, other.sources)))
+        self.channels.extend(array("H", map(channels.__getitem__, other.channels)))
+        self.hosts.extend(array("H", map(hosts.__getitem__, other.hosts)))
+        if other.templates is self.templates or other.templates is None:
+            self.template_ids.extend(other.template_ids)
+            self.messages.extend(other.messages)
+        elif self.templates is None:
+            self.template_ids.extend(array("i", [LITERAL]) * len(other))
+            self.messages.extend(map(other.templates.text, other.template_ids, other.messages))
+        else:
+            encode = self.templates.encode
+            names = other.source_names
+            for i, (code, event_id) in enumerate(zip(other.sources, other.event_ids)):
+                template_id, inserts = encode(names[code], event_id, other.message(i))
+                self.template_ids.append(template_id)
+                self.messages.append(inserts)
+
+    def append(self, log_type, record):
+        source_name = record["SourceName"]
+        event_id = to_int(record["EventID"])
+        template_id, message = LITERAL, record["Message"]
+        if self.templates is not None:
+            template_id, message = self.templates.encode(source_name, event_id, message)
+        self.append_values(log_type, to_epoch(record["TimeGenerated"]), source_name, event_id,
+                           to_int(record["EventType"]), to_int(record["Category"]), message,
+                           record.get("Host") or LOCAL_HOST, template_id)
+
+    def append_values(self, log_type, time_seconds, source_name, event_id, event_type, category, message,
+                      host=LOCAL_HOST, template_id=LITERAL):
+        """
+        Appends one event given as already-typed values. 'message' is the
+        text, or the inserts when 'template_id' (from self.templates) is given.
+        """
+        self.times.append(time_seconds)
+        self.event_ids.append(event_id & 0xFFFF)
+        self.event_types.append(event_type & 0xFFFF)
+        self.categories.append(category & 0xFFFF)
+        self.sources.append(self.source_code(source_name))
+        self.channels.append(self.channel_code(log_type))
+        self.hosts.append(self.host_code(host))
+        self.template_ids.append(template_id)
+        self.messages.append(message)
+
+    def source_code(self, source_name):
+        code = self._source_codes.get(source_name)
+        if code is None:
+            code = self._source_codes[source_name] = len(self.source_names)
+            self.source_names.append(source_name)
+        return code
+
+    def channel_code(self, log_type):
+        code = self._channel_codes.get(log_type)
+        if code is None:
+            code = self._channel_codes[log_type] = len(self.channel_names)
+            self.channel_names.append(log_type)
+        return code
+
+    def host_code(self, host):
+        code = self._host_codes.get(host)
+        if code is None:
+            code = self._host_codes[host] = len(self.host_names)
+            self.host_names.append(host)
+        return code
+
+    # --- Row access ---
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.times)
+        return {
+            "TimeGenerated": from_epoch(self.times[index]),
+            "SourceName": self.source_names[self.sources[index]],
+            "EventID": str(self.event_ids[index]),
+            "EventType": str(self.event_types[index]),
+            "Category": str(self.categories[index]),
+            "Message": self.message(index),
+            "LogType": self.channel_names[self.channels[index]],
+            "Host": self.host_names[self.hosts[index]],
+        }
+
+    def __iter__(self):
+        for index in range(len(self.times)):
+            yield self[index]
+
+    def message(self, index):
+        template_id = self.template_ids[index]
+        if template_id < 0:
+            return self.messages[index]
+        return self.templates.text(template_id, self.messages[index])
+
+    def log_type_counts(self):
+        counts = [0] * len(self.channel_names)
+        for code in self.channels:
+            counts[code] += 1
+        return dict(zip(self.channel_names, counts))
+
+    # --- Selecting rows ---
+
+    def filter(self, mask):
+        """Returns a new batch with the rows where 'mask' is set (one value per row)."""
+        result = self._empty_like()
+        result.times = array("q", compress(self.times, mask))
+        result.event_ids = array("H", compress(self.event_ids, mask))
+        result.event_types = array("H", compress(self.event_types, mask))
+        result.categories = array("H", compress(self.categories, mask))
+        result.sources = array("I", compress(self.sources, mask))
+        result.channels = array("H", compress(self.channels, mask))
+        result.hosts = array("H", compress(self.hosts, mask))
+        result.template_ids = array("i", compress(self.template_ids, mask))
+        result.messages = list(compress(self.messages, mask))
+        return result
+
+    def take(self, indexes):
+        """Returns a new batch with the given rows, in the given order."""
+        result = self._empty_like()
+        result.times = array("q", (self.times[i] for i in indexes))
+        result.event_ids = array("H", (self.event_ids[i] for i in indexes))
+        result.event_types = array("H", (self.event_types[i] for i in indexes))
+        result.categories = array("H", (self.categories[i] for i in indexes))
+        result.sources = array("I", (self.sources[i] for i in indexes))
+        result.channels = array("H", (self.channels[i] for i in indexes))
+        result.hosts = array("H", (self.hosts[i] for i in indexes))
+        result.template_ids = array("i", (self.template_ids[i] for i in indexes))
+        result.messages = [self.messages[i] for i in indexes]
+        return result
+
+    def _empty_like(self):
+        """A batch with copies of this one's dictionaries, so appending to either never re-codes the other."""
+        result = EventBatch(self.templates)
+        result.source_names = self.source_names.copy()
+        result.channel_names = self.channel_names.copy()
+        result.host_names = self.host_names.copy()
+        result._source_codes = self._source_codes.copy()
+        result._channel_codes = self._channel_codes.copy()
+        result._host_codes = self._host_codes.copy()
+        return result
+
+    def sort_order(self, key, reverse=False):
+        """Row indexes sorted by a record key, computed on the columns."""
+        column = self.sort_column(key)
+        return sorted(range(len(column)), key=column.__getitem__, reverse=reverse)
+
+    def sort_column(self, key, start=0):
+        """The values rows are sorted by for a record key, from row 'start' on."""
+        if key == "TimeGenerated":
+            return self.times[start:]
+        if key == "EventID":
+            return self.event_ids[start:]
+        if key == "EventType":
+            return self.event_types[start:]
+        if key == "Category":
+            return self.categories[start:]
+        if key == "SourceName":
+            names, codes = self.source_names, self.sources
+        elif key == "LogType":
+            names, codes = self.channel_names, self.channels
+        elif key == "Host":
+            names, codes = self.host_names, self.hosts
+        else:
+            return [self.message(i) for i in range(start, len(self.times))]
+        return [names[code] for code in codes[start:]]
@@ -0,0 +1,534 @@
+import csv
+import json
+import os
+import platform
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+
+try:
+    import win32evtlog
+    import win32event
+except ImportError:  # Not on Windows / pywin32 not installed
+    win32evtlog = None
+    win32event = None
+
+from metrics import timed_map
+
+# This file contains the event sources LogHandler reads from.
+# Every source yields records lazily and pushes the date range down into
+# the reader, so a narrow query stops as soon as it has passed the range.
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+LOG_TYPES = ["Security", "System", "Application"]
+# Host name given to events read on this machine; forwarded events carry a "Host" key
+LOCAL_HOST = platform.node() or "localhost"
+EVENT_TYPE_LABELS = {"1": "Error", "2": "Warning", "4": "Information", "8": "Success Audit", "16": "Failure Audit"}
+
+
+def make_record(time_generated, source_name, event_id, event_type, category, inserts):
+    """Builds the record dict used throughout the app. SourceName is interned: a few names repeat across all records."""
+    return {
+        "TimeGenerated": time_generated.strftime(TIME_FORMAT),
+        "SourceName": sys.intern(source_name),
+        "EventID": str(event_id),
+        "EventType": str(event_type),
+        "Category": str(category),
+        "Message": ' '.join(str(s).strip() for s in inserts) if inserts else ""
+    }
+
+
+def clip_to_range(items, start_dt, end_dt, order):
+    """
+    Filters (time, raw) pairs to [start_dt, end_dt] and stops reading as soon
+    as the stream has moved past the range.
+
+    'order' is "desc" for newest-first streams, "asc" for oldest-first ones
+    and None when the order is unknown (no early cutoff is possible).
+    """
+    for time_generated, raw in items:
+        if start_dt and time_generated < start_dt:
+            if order == "desc":
+                return
+            continue
+        if end_dt and time_generated > end_dt:
+            if order == "asc":
+                return
+            continue
+        yield time_generated, raw
+
+
+class EventSource:
+    """
+    Base class for a single channel of events.
+
+    Subclasses implement _iter_raw(), which yields (datetime, raw) pairs in
+    'order', and _to_record(), which turns a raw item into a record dict.
+    Records are only built for items that fall inside the requested range.
+    Subclasses that can see the EventID of a raw item cheaply set
+    _raw_event_id, so reads for a set of EventIDs skip the others early.
+    """
+    order = "desc"
+    _raw_event_id = None
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def read(self, start_dt=None, end_dt=None, event_ids=None):
+        """
+        Yields record dicts between start_dt and end_dt (both optional).
+        'event_ids' is a hint: sources with _raw_event_id drop other EventIDs
+        before building records, the rest return everything.
+        """
+        raws = (raw for _, raw in clip_to_range(self._iter_raw(), start_dt, end_dt, self.order))
+        if event_ids is not None and self._raw_event_id is not None:
+            raw_event_id = self._raw_event_id
+            raws = (raw for raw in raws if raw_event_id(raw) in event_ids)
+        # Time spent in the OS/file reader counts as "read", building the dicts as "construct"
+        return timed_map(self._to_record, raws, "read", "construct", "events_read")
+
+    def _iter_raw(self):
+        raise NotImplementedError
+
+    def _to_record(self, raw):
+        return raw
+
+    # --- Tailing (used by real-time monitoring and the event store) ---
+    # A cursor is a dict {"position": ..., "time": ...} pointing at the last
+    # record that was read; read_since(None) starts from the oldest record.
+    # Sources that cannot grow set supports_tail = False and never yield.
+    supports_tail = False
+
+    def latest_cursor(self):
+        """Returns a cursor pointing at the newest record currently available."""
+        return None
+
+    def read_since(self, cursor):
+        """Yields (cursor, record) pairs for records after 'cursor', oldest first."""
+        return iter(())
+
+    def change_handle(self):
+        """
+        Returns a waitable OS handle that is signalled when new records arrive,
+        or None if the source can only be polled.
+        """
+        return None
+
+    def close(self):
+        """Releases any handles kept open between reads."""
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.channel!r})"
+
+
+class Win32EventSource(EventSource):
+    """Reads a live channel through the legacy win32evtlog API, newest first."""
+    order = "desc"
+    supports_tail = True
+
+    def __init__(self, channel, server=None, chunk_size=1024):
+        if win32evtlog is None:
+            raise RuntimeError("win32evtlog is not available on this system.")
+        super().__init__(channel)
+        self.server = server
+        self.chunk_size = chunk_size
+
+    def _iter_raw(self):
+        handle = win32evtlog.OpenEventLog(self.server, self.channel)
+        flags = win32evtlog.EVENTLOG_BACKWARDS_READ | win32evtlog.EVENTLOG_SEQUENTIAL_READ
+        try:
+            while True:
+                events = win32evtlog.ReadEventLog(handle, flags, 0, self.chunk_size)  # Read in chunks
+                if not events:
+                    break
+                for ev_obj in events:
+                    yield ev_obj.TimeGenerated, ev_obj
+        finally:
+            win32evtlog.CloseEventLog(handle)
+
+    def _to_record(self, ev_obj):
+        return make_record(ev_obj.TimeGenerated, ev_obj.SourceName, ev_obj.EventID & 0xFFFF,
+                           ev_obj.EventType, ev_obj.EventCategory, ev_obj.StringInserts)
+
+    @staticmethod
+    def _raw_event_id(ev_obj):
+        return ev_obj.EventID & 0xFFFF
+
+    def _record_range(self, handle):
+        oldest = win32evtlog.GetOldestEventLogRecord(handle)
+        total = win32evtlog.GetNumberOfEventLogRecords(handle)
+        return oldest, oldest + total - 1
+
+    def latest_cursor(self):
+        handle = win32evtlog.OpenEventLog(self.server, self.channel)
+        try:
+            _, newest = self._record_range(handle)
+        finally:
+            win32evtlog.CloseEventLog(handle)
+        return {"position": newest, "time": None}
+
+    def read_since(self, cursor):
+        handle = win32evtlog.OpenEventLog(self.server, self.channel)
+        try:
+            oldest, newest = self._record_range(handle)
+            start = cursor["position"] + 1 if cursor else oldest
+            if start > newest + 1 or start < oldest:
+                # The log was cleared or has wrapped past our cursor
+                start = oldest
+            if start > newest:
+                return
+            flags = win32evtlog.EVENTLOG_FORWARDS_READ | win32evtlog.EVENTLOG_SEEK_READ
+            offset = start
+            while True:
+                events = win32evtlog.ReadEventLog(handle, flags, offset, self.chunk_size)
+                if not events:
+                    break
+                for ev_obj in events:
+                    record = self._to_record(ev_obj)
+                    yield {"position": ev_obj.RecordNumber, "time": record["TimeGenerated"]}, record
+                flags = win32evtlog.EVENTLOG_FORWARDS_READ | win32evtlog.EVENTLOG_SEQUENTIAL_READ
+                offset = 0
+        finally:
+            win32evtlog.CloseEventLog(handle)
+
+    def change_handle(self):
+        if getattr(self, "_notify_event", None) is None:
+            self._notify_log = win32evtlog.OpenEventLog(self.server, self.channel)
+            self._notify_event = win32event.CreateEvent(None, False, False, None)
+            win32evtlog.NotifyChangeEventLog(self._notify_log, self._notify_event)
+        return self._notify_event
+
+    def close(self):
+        if getattr(self, "_notify_log", None) is not None:
+            win32evtlog.CloseEventLog(self._notify_log)
+            self._notify_log = None
+            self._notify_event = None
+
+
+class EvtxFileSource(EventSource):
+    """
+    Reads an exported .evtx file. Uses the Windows Evt* API when available
+    and falls back to the python-evtx package elsewhere.
+    """
+
+    # Legacy EventType values derived from the XML Level/Keywords fields
+    _AUDIT_SUCCESS = 0x0020000000000000
+    _AUDIT_FAILURE = 0x0010000000000000
+    _LEVEL_TO_TYPE = {1: 1, 2: 1, 3: 2}
+
+    def __init__(self, path, channel=None):
+        super().__init__(channel or os.path.splitext(os.path.basename(path))[0])
+        self.path = path
+        # EvtQuery can read the file newest-first; python-evtx reads in file order
+        self.order = "desc" if win32evtlog is not None else "asc"
+
+    def _iter_raw(self):
+        for xml_text in self._iter_xml():
+            event = self._parse_xml(xml_text)
+            if event is not None:
+                yield event[0], event
+
+    def _iter_xml(self):
+        if win32evtlog is not None:
+            flags = win32evtlog.EvtQueryFilePath | win32evtlog.EvtQueryReverseDirection
+            query = win32evtlog.EvtQuery(self.path, flags)
+            while True:
+                handles = win32evtlog.EvtNext(query, 256)
+                if not handles:
+                    break
+                for ev in handles:
+                    yield win32evtlog.EvtRender(ev, win32evtlog.EvtRenderEventXml)
+            return
+        try:
+            from Evtx.Evtx import Evtx
+        except ImportError:
+            raise RuntimeError("Reading .evtx files needs pywin32 or the python-evtx package.")
+        with Evtx(self.path) as log:
+            for rec in log.records():
+                yield rec.xml()
+
+    def _parse_xml(self, xml_text):
+        import xml.etree.ElementTree as ET  # Only needed for .evtx files
+        root = ET.fromstring(xml_text)
+        ns = {"e": root.tag[1:].split("}")[0]} if root.tag.startswith("{") else {"e": ""}
+        prefix = "e:" if ns["e"] else ""
+
+        system = root.find(f"{prefix}System", ns)
+        if system is None:
+            return None
+        created = system.find(f"{prefix}TimeCreated", ns)
+        if created is None:
+            return None
+        time_generated = self._parse_system_time(created.get("SystemTime"))
+
+        provider = system.find(f"{prefix}Provider", ns)
+        source_name = provider.get("Name", "") if provider is not None else ""
+        event_id = int(self._text(system, f"{prefix}EventID", ns) or 0) & 0xFFFF
+        level = int(self._text(system, f"{prefix}Level", ns) or 0)
+        keywords = int(self._text(system, f"{prefix}Keywords", ns) or "0", 16)
+        if keywords & self._AUDIT_SUCCESS:
+            event_type = 8
+        elif keywords & self._AUDIT_FAILURE:
+            event_type = 16
+        else:
+            event_type = self._LEVEL_TO_TYPE.get(level, 4)
+        category = int(self._text(system, f"{prefix}Task", ns) or 0)
+
+        inserts = []
+        for data_parent in (f"{prefix}EventData", f"{prefix}UserData"):
+            node = root.find(data_parent, ns)
+            if node is not None:
+                inserts.extend(el.text for el in node.iter() if el is not node and el.text and el.text.strip())
+        return time_generated, source_name, event_id, event_type, category, inserts
+
+    @staticmethod
+    def _text(parent, path, ns):
+        node = parent.find(path, ns)
+        return node.text if node is not None and node.text else None
+
+    @staticmethod
+    def _parse_system_time(value):
+        """Converts an XML SystemTime (UTC) into a naive local datetime like TimeGenerated."""
+        value = value.rstrip("Z")
+        if "." in value:
+            head, frac = value.split(".", 1)
+            value = f"{head}.{frac[:6]}"
+        utc = datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+        return utc.astimezone().replace(tzinfo=None)
+
+    def _to_record(self, event):
+        return make_record(*event)
+
+
+class _ReplayFileSource(EventSource):
+    """
+    Common code for replaying records that were exported by SecLog.
+    The file order is unknown unless given ("asc"/"desc"); exports written by
+    the app are newest-first.
+    """
+
+    def __init__(self, path, channel=None, order=None):
+        super().__init__(channel or os.path.splitext(os.path.basename(path))[0])
+        self.path = path
+        self.order = order
+
+    def _iter_raw(self):
+        for row in self._iter_rows():
+            try:
+                time_generated = datetime.strptime(row["TimeGenerated"], TIME_FORMAT)
+            except (KeyError, TypeError, ValueError):
+                continue
+            yield time_generated, row
+
+    def _iter_rows(self):
+        raise NotImplementedError
+
+    def _to_record(self, row):
+        return {
+            "TimeGenerated": row["TimeGenerated"],
+            "SourceName": sys.intern(str(row.get("SourceName", ""))),
+            "EventID": str(row.get("EventID", "")),
+            "EventType": str(row.get("EventType", "")),
+            "Category": str(row.get("Category", "")),
+            "Message": row.get("Message") or ""
+        }
+
+    @staticmethod
+    def _raw_event_id(row):
+        try:
+            return int(row.get("EventID"))
+        except (TypeError, ValueError):
+            return 0
+
+
+class JsonlFileSource(_ReplayFileSource):
+    """
+    Replays records from a JSON Lines file (one record object per line).
+    Can also follow a file that is still being appended to.
+    """
+    supports_tail = True
+
+    def __init__(self, path, channel=None, order=None, byte_range=None):
+        super().__init__(path, channel, order)
+        # (start, end) byte offsets when this source reads one chunk of the file;
+        # a line belongs to the chunk in which it starts
+        self.byte_range = byte_range
+
+    def _iter_rows(self):
+        if self.byte_range is None:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        yield json.loads(line)
+            return
+        start, end = self.byte_range
+        with open(self.path, "rb") as f:
+            if start > 0:
+                f.seek(start - 1)
+                f.readline()  # Skip the line that started in the previous chunk
+            while f.tell() < end:
+                line = f.readline()
+                if not line:
+                    break
+                line = line.strip()
+                if line:
+                    yield json.loads(line.decode("utf-8"))
+
+    def latest_cursor(self):
+        return {"position": os.path.getsize(self.path), "time": None}
+
+    def read_since(self, cursor):
+        position = cursor["position"] if cursor else 0
+        if os.path.getsize(self.path) < position:
+            position = 0  # The file was truncated or replaced
+        with open(self.path, "rb") as f:
+            f.seek(position)
+            while True:
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    break  # Partial line still being written
+                position = f.tell()
+                line = line.strip()
+                if not line:
+                    continue
+                row = json.loads(line.decode("utf-8"))
+                record = self._to_record(row)
+                yield {"position": position, "time": record["TimeGenerated"]}, record
+
+
+class CsvFileSource(_ReplayFileSource):
+    """Replays records from a CSV file written by 'Export to CSV'."""
+
+    def _iter_rows(self):
+        with open(self.path, "r", newline='', encoding="utf-8") as f:
+            yield from csv.DictReader(f)
+
+
+class SyntheticEventSource(EventSource):
+    """
+    Generates plausible events without touching the OS, newest first.
+    Deterministic for a given seed, so it is usable for demos and on Linux.
+    When tailing, at most max_catch_up events are generated per call; a
+    cursor older than max_catch_up intervals skips ahead, as if the log had
+    wrapped while nobody was reading it.
+    """
+    order = "desc"
+    supports_tail = True
+
+    _PROFILES = {
+        "Security": [
+            ("Microsoft-Windows-Security-Auditing", 4624, 8, 12544, ["S-1-5-18", "SYSTEM", "NT AUTHORITY", "0x3e7", "5"]),
+            ("Microsoft-Windows-Security-Auditing", 4625, 16, 12544, ["S-1-0-0", "administrator", "WORKSTATION", "0xc000006d", "3"]),
+            ("Microsoft-Windows-Security-Auditing", 4672, 8, 12548, ["S-1-5-18", "SYSTEM", "SeDebugPrivilege"]),
+            ("Microsoft-Windows-Security-Auditing", 4688, 8, 13312, ["C:\\Windows\\System32\\svchost.exe", "0x1f4"]),
+        ],
+        "System": [
+            ("Service Control Manager", 7036, 4, 0, ["Windows Update", "running"]),
+            ("Service Control Manager", 7045, 4, 0, ["NewService", "C:\\Temp\\svc.exe", "user mode service"]),
+            ("Microsoft-Windows-Kernel-General", 12, 4, 1, ["10", "0", "19041"]),
+            ("EventLog", 6005, 4, 0, []),
+        ],
+        "Application": [
+            ("Application Error", 1000, 1, 100, ["app.exe", "1.0.0.0", "ntdll.dll", "0xc0000005"]),
+            ("MsiInstaller", 11707, 4, 0, ["Product: Example -- Installation completed successfully."]),
+            ("Windows Error Reporting", 1001, 4, 0, ["APPCRASH", "Not available"]),
+        ],
+    }
+
+    def __init__(self, channel, count=10000, end=None, interval=30, seed=0, max_catch_up=1000):
+        super().__init__(channel)
+        self.count = count
+        self.end = end or datetime.now().replace(microsecond=0)
+        self.interval = interval
+        self.seed = seed
+        self.max_catch_up = max_catch_up
+
+    def _iter_raw(self):
+        rng = random.Random(f"{self.seed}:{self.channel}")
+        profiles = self._PROFILES.get(self.channel, self._PROFILES["Application"])
+        current = self.end
+        for _ in range(self.count):
+            yield current, (current, rng.choice(profiles))
+            current -= timedelta(seconds=rng.randint(1, 2 * self.interval))
+
+    def _to_record(self, raw):
+        time_generated, (source_name, event_id, event_type, category, inserts) = raw
+        return make_record(time_generated, source_name, event_id, event_type, category, inserts)
+
+    @staticmethod
+    def _raw_event_id(raw):
+        return raw[1][1]
+
+    def latest_cursor(self):
+        return {"position": 0, "time": datetime.now().strftime(TIME_FORMAT)}
+
+    def read_since(self, cursor):
+        """Simulates events that 'arrived' between the cursor and now."""
+        if cursor is None:
+            # Replay the generated history first, oldest first
+            history = list(self.read())
+            history.reverse()
+            for position, record in enumerate(history, 1):
+                cursor = {"position": position, "time": record["TimeGenerated"]}
+                yield cursor, record
+            if cursor is None:
+                return
+        position = cursor["position"]
+        now = datetime.now()
+        current = max(datetime.strptime(cursor["time"], TIME_FORMAT),
+                      now - timedelta(seconds=self.max_catch_up * self.interval))
+        profiles = self._PROFILES.get(self.channel, self._PROFILES["Application"])
+        rng = random.Random(f"{self.seed}:{self.channel}:{position}")
+        for _ in range(self.max_catch_up):
+            current += timedelta(seconds=rng.randint(1, 2 * self.interval))
+            if current > now:
+                break
+            position += 1
+            record = self._to_record((current, rng.choice(profiles)))
+            yield {"position": position, "time": record["TimeGenerated"]}, record
+
+
+def source_from_path(path, channel=None):
+    """Creates the matching offline source for an exported file."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".evtx":
+        return EvtxFileSource(path, channel)
+    if ext in (".jsonl", ".json", ".ndjson"):
+        return JsonlFileSource(path, channel)
+    if ext == ".csv":
+        return CsvFileSource(path, channel)
+    raise ValueError(f"Unsupported event file type: {path}")
+
+
+def default_sources():
+    """
+    Returns the live Win32 sources for the standard channels, or no sources
+    when the win32 API is not available (e.g. on Linux). Synthetic events
+    are opt-in (SyntheticEventSource, the CLI's --synthetic), never a
+    silent substitute for the real logs.
+    """
+    if win32evtlog is None:
+        print("win32evtlog not available; the Windows event logs cannot be read.", file=sys.stderr)
+        return {}
+    return {log_type: Win32EventSource(log_type) for log_type in LOG_TYPES}
+
+
+def wait_for_new_events(sources, timeout, stop_event):
+    """
+    Blocks until one of the sources signals new records, 'timeout' seconds
+    pass or 'stop_event' is set. Uses NotifyChangeEventLog when every source
+    supports it and falls back to plain polling otherwise.
+    """
+    handles = [source.change_handle() for source in sources] if win32event is not None else []
+    if not handles or any(handle is None for handle in handles):
+        stop_event.wait(timeout)
+        return
+    # Wait in short slices so that stop_event is still honoured promptly
+    remaining = timeout
+    while remaining > 0 and not stop_event.is_set():
+        wait_ms = int(min(remaining, 0.5) * 1000)
+        result = win32event.WaitForMultipleObjects(handles, False, wait_ms)
+        if result != win32event.WAIT_TIMEOUT:
+            return
+        remaining -= 0.5
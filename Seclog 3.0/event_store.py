@@ -0,0 +1,454 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from event_batch import EventBatch, to_epoch, to_int
+from event_sources import LOCAL_HOST, TIME_FORMAT
+from metrics import METRICS
+from tailing import DEFAULT_STATE_DIR
+from templates import LITERAL, TemplateMiner
+
+# This file contains the on-disk event cache. LogHandler ingests new records
+# into it incrementally, and queries by date range, channel, EventID or
+# source are answered from its indexes instead of re-reading the event log.
+# Events forwarded by other machines (collector.py) are stored alongside the
+# local ones with their host name; local rows have an empty host.
+#
+# Messages are stored as a template (see templates.py) plus their joined
+# inserts in the message column; template_id is NULL for messages kept
+# literally. Only the inserts go into the keyword index, the templates'
+# fixed words are searched in memory.
+#
+# Retention counts from when an event was cached, not from its TimeGenerated:
+# an imported .evtx file full of year-old events is kept as long as one
+# that was read today. ingest_log records, per minute, the highest event id
+# stored by then; ids only grow, so "cached before the cutoff" is an id range.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    channel TEXT NOT NULL,
+    time TEXT NOT NULL,
+    source TEXT NOT NULL,
+    event_id INTEGER,
+    event_type INTEGER,
+    category INTEGER,
+    message TEXT,
+    host TEXT NOT NULL DEFAULT '',
+    template_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_events_time ON events (time);
+CREATE INDEX IF NOT EXISTS idx_events_channel_time ON events (channel, time);
+CREATE INDEX IF NOT EXISTS idx_events_event_id_time ON events (event_id, time);
+CREATE INDEX IF NOT EXISTS idx_events_source_time ON events (source, time);
+CREATE INDEX IF NOT EXISTS idx_events_host_time ON events (host, time);
+CREATE INDEX IF NOT EXISTS idx_events_template_time ON events (template_id, time);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    channel TEXT PRIMARY KEY,
+    cursor TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS templates (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    event_id INTEGER,
+    pattern TEXT NOT NULL,
+    merged_into INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS ingest_log (
+    minute TEXT PRIMARY KEY,
+    last_id INTEGER NOT NULL
+);
+"""
+
+# Keyword index: a trigram FTS5 table over Message, kept in step with 'events'
+# by triggers. Trigrams give case-insensitive substring search, and FTS5
+# stores its posting lists delta-compressed. SourceName and EventID have few
+# distinct values, so keywords are matched against the 'vocabulary' table and
+# answered through their b-tree indexes instead.
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5(
+    message, content='events', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS events_fts_insert AFTER INSERT ON events BEGIN
+    INSERT INTO events_fts (rowid, message) VALUES (new.id, new.message);
+END;
+CREATE TRIGGER IF NOT EXISTS events_fts_delete AFTER DELETE ON events BEGIN
+    INSERT INTO events_fts (events_fts, rowid, message) VALUES ('delete', old.id, old.message);
+END;
+
+CREATE TABLE IF NOT EXISTS vocabulary (
+    field TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (field, value)
+) WITHOUT ROWID;
+"""
+
+
+class EventStore:
+    """
+    SQLite-backed cache of events, indexed on time, channel, EventID and
+    SourceName. Events are evicted max_age_days after they were cached, and
+    the earliest cached first once there are more than max_events.
+    """
+    def __init__(self, path=None, max_events=5000000, max_age_days=90, batch_size=5000):
+        self.path = path or os.path.join(DEFAULT_STATE_DIR, "events.db")
+        self.max_events = max_events
+        self.max_age_days = max_age_days
+        self.batch_size = batch_size
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # The store is used from the fetch thread and the UI thread
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+        self.templates = self._load_templates()
+        self._lock = threading.RLock()
+
+    def _create_schema(self):
+        has_fts = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'events_fts'").fetchone() is not None
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(events)")]
+        add_host = bool(columns) and "host" not in columns
+        if add_host:
+            # Caches created before forwarded events existed only hold local rows
+            self._conn.execute("ALTER TABLE events ADD COLUMN host TEXT NOT NULL DEFAULT ''")
+        if columns and "template_id" not in columns:
+            # Older rows keep their full text; they read back as literal messages
+            self._conn.execute("ALTER TABLE events ADD COLUMN template_id INTEGER")
+        has_ingest_log = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'ingest_log'").fetchone() is not None
+        self._conn.executescript(SCHEMA)
+        if columns and not has_ingest_log:
+            # Events cached before ingest times were kept count as cached now
+            with self._conn:
+                self._conn.execute("INSERT INTO ingest_log (minute, last_id) SELECT ?, MAX(id) FROM events "
+                                   "WHERE EXISTS (SELECT 1 FROM events)", (_minute(datetime.now()),))
+        self._conn.executescript(FTS_SCHEMA)
+        if not has_fts:
+            # Index events cached before the keyword index existed
+            with self._conn:
+                self._conn.execute("INSERT INTO events_fts (events_fts) VALUES ('rebuild')")
+                self._conn.execute("INSERT OR IGNORE INTO vocabulary SELECT DISTINCT 'source', source FROM events")
+                self._conn.execute("INSERT OR IGNORE INTO vocabulary SELECT DISTINCT 'event_id', event_id FROM events")
+        if not has_fts or add_host:
+            with self._conn:
+                self._conn.execute("INSERT OR IGNORE INTO vocabulary SELECT DISTINCT 'channel', channel FROM events")
+                self._conn.execute("INSERT OR IGNORE INTO vocabulary SELECT DISTINCT 'host', host FROM events")
+
+    def _load_templates(self):
+        templates = TemplateMiner()
+        templates.load(self._conn.execute(
+            "SELECT id, source, event_id, pattern, merged_into FROM templates ORDER BY id"))
+        return templates
+
+    # --- Ingestion ---
+
+    def sync(self, sources, max_workers=None, cancel=None):
+        """
+        Ingests everything each source has added since the last sync.
+
+        'sources' maps a log type to its EventSource. The sources are read
+        concurrently; writes are serialised by the store's lock. Once
+        'cancel' (a threading.Event) is set, tailing sources stop reading and
+        leave the rest for the next sync. Returns the number of new events
+        stored.
+        """
+        if not sources:
+            return 0
+        with METRICS.stage("store_sync"):
+            with ThreadPoolExecutor(max_workers=max_workers or len(sources)) as executor:
+                added = sum(executor.map(lambda item: self._sync_source_safely(*item, cancel), sources.items()))
+            if added:
+                self.evict()
+        METRICS.inc("events_cached", added)
+        return added
+
+    def _sync_source_safely(self, log_type, source, cancel=None):
+        try:
+            return self._sync_source(log_type, source, cancel)
+        except Exception as e:
+            print(f"Error caching {log_type} log: {e}", file=sys.stderr)
+            return 0
+
+    def _sync_source(self, log_type, source, cancel=None):
+        cursor = self._get_cursor(log_type)
+        if source.supports_tail:
+            stream = source.read_since(cursor)
+        elif cursor is None:
+            # Static sources (e.g. exported .evtx files) are ingested once
+            stream = ((None, record) for record in source.read())
+        else:
+            return 0
+
+        added = 0
+        batch = []
+        # Static sources must finish to record their cursor; tailing ones save it with every batch
+        cancellable = cancel is not None and source.supports_tail
+        for cursor, record in stream:
+            if cancellable and cancel.is_set():
+                return added  # Records after the saved cursor are read again by the next sync
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                added += self.ingest(log_type, batch, cursor)
+                batch = []
+        if not source.supports_tail:
+            cursor = {"position": None, "time": None}
+        if batch or not source.supports_tail:
+            added += self.ingest(log_type, batch, cursor)
+        return added
+
+    def ingest(self, log_type, records, cursor=None):
+        """
+        Stores a batch of records and, optionally, the channel's new cursor in
+        one transaction. Records with a "Host" key are stored under that host.
+        """
+        with self._lock, self._conn:
+            # Encoded under the lock so that every template a row refers to is written with it
+            rows = [(log_type, r["TimeGenerated"], r["SourceName"], r["EventID"], r["EventType"], r["Category"])
+                    + self._encode(r["SourceName"], r["EventID"], r["Message"]) + (r.get("Host", ""),)
+                    for r in records]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO templates (id, source, event_id, pattern, merged_into) VALUES (?, ?, ?, ?, ?)",
+                self.templates.pop_changes())
+            self._conn.executemany(
+                "INSERT INTO events (channel, time, source, event_id, event_type, category, template_id, message, host) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            if rows:
+                self._conn.execute("INSERT OR REPLACE INTO ingest_log (minute, last_id) "
+                                   "SELECT ?, MAX(id) FROM events", (_minute(datetime.now()),))
+            vocabulary = ({("source", row[2]) for row in rows} | {("event_id", str(row[3])) for row in rows}
+                          | {("host", row[8]) for row in rows} | {("channel", log_type)})
+            self._conn.executemany("INSERT OR IGNORE INTO vocabulary (field, value) VALUES (?, ?)", vocabulary)
+            if cursor is not None:
+                self._conn.execute("INSERT OR REPLACE INTO sync_state (channel, cursor) VALUES (?, ?)",
+                                   (log_type, json.dumps(cursor)))
+        return len(rows)
+
+    def _encode(self, source, event_id, message):
+        """(template_id, message column) for one message."""
+        template_id, message = self.templates.encode(source, to_int(event_id), message)
+        return (None if template_id == LITERAL else template_id), message
+
+    def _get_cursor(self, log_type):
+        with self._lock:
+            row = self._conn.execute("SELECT cursor FROM sync_state WHERE channel = ?", (log_type,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # --- Queries ---
+
+    def query(self, log_types, start_dt=None, end_dt=None, event_ids=None, source_names=None, keyword=None,
+              host_names=None):
+        """
+        Yields (log_type, record) pairs, newest first, using the indexes for
+        the channel, date range, EventID, SourceName and host filters.
+
+        'keyword' is a KeywordQuery; it is answered from the trigram index
+        when all of its terms are long enough, and checked per row otherwise.
+        """
+        text = self.templates.text
+        for chunk in self._select(log_types, start_dt, end_dt, event_ids, source_names, keyword, host_names):
+            for channel, time_generated, source, event_id, event_type, category, template_id, message, host in chunk:
+                yield channel, {
+                    "TimeGenerated": time_generated,
+                    "SourceName": source,
+                    "EventID": str(event_id),
+                    "EventType": str(event_type),
+                    "Category": str(category),
+                    "Message": text(template_id, message),
+                    "Host": host or LOCAL_HOST
+                }
+
+    def query_batches(self, log_types, start_dt=None, end_dt=None, event_ids=None, source_names=None, keyword=None,
+                      host_names=None, cancel=None):
+        """
+        Same as query(), but yields one EventBatch per chunk of rows, with
+        messages still encoded. Stops early once 'cancel' (a threading.Event) is set.
+        """
+        for chunk in self._select(log_types, start_dt, end_dt, event_ids, source_names, keyword, host_names, cancel):
+            batch = EventBatch(self.templates)
+            append = batch.append_values
+            for channel, time_generated, source, event_id, event_type, category, template_id, message, host in chunk:
+                append(channel, to_epoch(time_generated), source, to_int(event_id),
+                       to_int(event_type), to_int(category), message, host or LOCAL_HOST, template_id)
+            yield batch
+
+    def _select(self, log_types, start_dt, end_dt, event_ids, source_names, keyword, host_names=None, cancel=None):
+        """
+        Runs the query and yields lists of rows, with the message still
+        encoded (template_id is LITERAL for literal messages, see
+        templates.py). SourceName and host filters are case-insensitive;
+        they are resolved to stored names first.
+        """
+        if source_names:
+            source_names = self._stored_values("source", source_names)
+            if not source_names:
+                return
+        if host_names:
+            host_names = self._stored_values("host", host_names)
+            if not host_names:
+                return
+        clauses = [f"channel IN ({','.join('?' * len(log_types))})"]
+        params = list(log_types)
+        if start_dt:
+            clauses.append("time >= ?")
+            params.append(start_dt.strftime(TIME_FORMAT))
+        if end_dt:
+            clauses.append("time <= ?")
+            params.append(end_dt.strftime(TIME_FORMAT))
+        if event_ids:
+            clauses.append(f"event_id IN ({','.join('?' * len(event_ids))})")
+            params.extend(int(eid) for eid in event_ids)
+        if source_names:
+            clauses.append(f"source IN ({','.join('?' * len(source_names))})")
+            params.extend(source_names)
+        if host_names:
+            clauses.append(f"host IN ({','.join('?' * len(host_names))})")
+            params.extend(host_names)
+        keyword_clause = self._keyword_clause(keyword) if keyword else None
+        if keyword_clause:
+            clauses.append(keyword_clause[0])
+            params.extend(keyword_clause[1])
+        check_keyword = bool(keyword) and not keyword_clause
+        sql = ("SELECT channel, time, source, event_id, event_type, category, template_id, message, host "
+               f"FROM events WHERE {' AND '.join(clauses)} ORDER BY time DESC, id DESC")
+        text = self.templates.text
+
+        # Only the SQLite work is timed, not the consumer of the chunks
+        clock = time.perf_counter
+        elapsed = 0.0
+        start = clock()
+        try:
+            with self._lock:
+                rows = self._conn.execute(sql, params)
+            while cancel is None or not cancel.is_set():
+                with self._lock:
+                    chunk = rows.fetchmany(self.batch_size)
+                if not chunk:
+                    break
+                chunk = [row if row[6] is not None else row[:6] + (LITERAL,) + row[7:] for row in chunk]
+                if check_keyword:
+                    chunk = [row for row in chunk if keyword.matches(
+                        {"SourceName": row[2], "EventID": row[3], "Message": text(row[6], row[7])})]
+                elapsed += clock() - start
+                start = None
+                yield chunk
+                start = clock()
+        finally:
+            if start is not None:
+                elapsed += clock() - start
+            METRICS.observe("store_query", elapsed)
+
+    def _stored_values(self, field, names):
+        """The stored spellings of the given names; local rows are stored with an empty host."""
+        wanted = {name.lower() for name in names}
+        return [value for value in self.values(field)
+                if (value or (LOCAL_HOST if field == "host" else "")).lower() in wanted]
+
+    def values(self, field):
+        """Distinct stored values of 'source', 'event_id', 'channel' or 'host'."""
+        with self._lock:
+            rows = self._conn.execute("SELECT value FROM vocabulary WHERE field = ?", (field,)).fetchall()
+        return [value for (value,) in rows]
+
+    def _keyword_clause(self, keyword):
+        """
+        Translates a KeywordQuery into an SQL condition served by the indexes,
+        or returns None if some term is too short for the trigram index or
+        is a phrase, which could span a template's fixed words and inserts.
+        Each term is matched against the templates first; the trigram index
+        only holds the inserts and literal messages.
+        """
+        if not keyword.indexable() or any(" " in term for group in keyword.groups for term in group):
+            return None
+        with self._lock:
+            vocabulary = self._conn.execute("SELECT field, value FROM vocabulary").fetchall()
+        group_sql = []
+        params = []
+        for group in keyword.groups:
+            term_sql = []
+            for term in group:
+                alternatives = ["id IN (SELECT rowid FROM events_fts WHERE events_fts MATCH ?)"]
+                params.append(keyword.fts_phrase(term))
+                template_ids = self.templates.containing(term)
+                if template_ids:
+                    alternatives.insert(0, "template_id IN (SELECT value FROM json_each(?))")
+                    params.insert(len(params) - 1, json.dumps(template_ids))
+                for field in ("source", "event_id"):
+                    values = [value for f, value in vocabulary if f == field and term in value.lower()]
+                    if values:
+                        alternatives.append(f"{field} IN ({','.join('?' * len(values))})")
+                        params.extend(values)
+                term_sql.append("(" + " OR ".join(alternatives) + ")")
+            group_sql.append("(" + " AND ".join(term_sql) + ")")
+        return "(" + " OR ".join(group_sql) + ")", params
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+
+    # --- Maintenance ---
+
+    def evict(self, now=None):
+        """Removes events cached more than max_age_days ago and trims the store to max_events."""
+        with self._lock, self._conn:
+            if self.max_age_days:
+                cutoff = _minute((now or datetime.now()) - timedelta(days=self.max_age_days))
+                last_id = self._conn.execute(
+                    "SELECT MAX(last_id) FROM ingest_log WHERE minute < ?", (cutoff,)).fetchone()[0]
+                if last_id is not None:
+                    self._conn.execute("DELETE FROM events WHERE id <= ?", (last_id,))
+                    self._conn.execute("DELETE FROM ingest_log WHERE minute < ?", (cutoff,))
+            if self.max_events:
+                excess = self._conn.execute("SELECT COUNT(*) FROM events").fetchone()[0] - self.max_events
+                if excess > 0:
+                    last_id = self._conn.execute(
+                        "SELECT id FROM events ORDER BY id LIMIT 1 OFFSET ?", (excess - 1,)).fetchone()[0]
+                    self._conn.execute("DELETE FROM events WHERE id <= ?", (last_id,))
+                    # Entries for fully evicted minutes; ids may be reused once the table is empty
+                    self._conn.execute("DELETE FROM ingest_log WHERE last_id <= ?", (last_id,))
+
+    def compact(self):
+        """Reclaims space left by evicted events and refreshes index statistics."""
+        with self._lock:
+            with self._conn:
+                self._conn.execute("INSERT INTO events_fts (events_fts) VALUES ('optimize')")
+            self._conn.execute("VACUUM")
+            self._conn.execute("ANALYZE")
+
+    def rebuild(self, sources):
+        """
+        Drops the cached events and cursors and re-ingests everything from
+        'sources'. Events forwarded from other hosts cannot be re-read and
+        are lost.
+        """
+        with self._lock:
+            # Dropping the tables is much faster than deleting row by row through the triggers
+            with self._conn:
+                self._conn.execute("DROP TABLE IF EXISTS events_fts")
+                self._conn.execute("DROP TABLE IF EXISTS events")
+                self._conn.execute("DROP TABLE IF EXISTS sync_state")
+                self._conn.execute("DROP TABLE IF EXISTS vocabulary")
+                self._conn.execute("DROP TABLE IF EXISTS templates")
+                self._conn.execute("DROP TABLE IF EXISTS ingest_log")
+            self._create_schema()
+            self.templates = self._load_templates()
+            self.compact()
+        return self.sync(sources)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _minute(dt):
+    """The ingest_log key for a time: its minute, which sorts as text."""
+    return dt.strftime("%Y-%m-%d %H:%M")
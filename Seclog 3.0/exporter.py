@@ -0,0 +1,184 @@
+import csv
+import io
+import json
+import os
+import threading
+
+from metrics import METRICS
+
+try:
+    import zstandard
+except ImportError:  # Optional: .zst exports
+    zstandard = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Optional: Parquet / Arrow IPC exports
+    pa = None
+    pq = None
+
+# This file contains the export pipeline. Rows are streamed to disk in
+# fixed-size chunks on a worker thread, so memory stays constant and the UI
+# keeps running however many rows are exported.
+
+FIELDNAMES = ["TimeGenerated", "SourceName", "EventID", "EventType", "Category", "Message", "LogType", "Host"]
+
+# (extension, format name, description), longest extensions first
+FORMATS = [
+    (".jsonl.gz", "jsonl.gz", "JSON Lines, gzip"),
+    (".jsonl.zst", "jsonl.zst", "JSON Lines, zstd"),
+    (".csv.gz", "csv.gz", "CSV, gzip"),
+    (".csv.zst", "csv.zst", "CSV, zstd"),
+    (".jsonl", "jsonl", "JSON Lines"),
+    (".csv", "csv", "CSV"),
+    (".parquet", "parquet", "Parquet"),
+    (".arrow", "arrow", "Arrow IPC"),
+]
+
+
+def format_for_path(path):
+    """Picks the export format from the file name, defaulting to CSV."""
+    lower = path.lower()
+    for ext, fmt, _ in FORMATS:
+        if lower.endswith(ext):
+            return fmt
+    return "csv"
+
+
+def available_formats():
+    """Formats usable with the installed optional packages."""
+    result = []
+    for ext, fmt, description in FORMATS:
+        if fmt.endswith(".zst") and zstandard is None:
+            continue
+        if fmt in ("parquet", "arrow") and pa is None:
+            continue
+        result.append((ext, fmt, description))
+    return result
+
+
+def _iter_chunks(rows, chunk_size):
+    """Splits any sequence or iterable of record dicts into lists of at most chunk_size."""
+    if hasattr(rows, "__getitem__") and hasattr(rows, "__len__"):
+        for start in range(0, len(rows), chunk_size):
+            yield [rows[i] for i in range(start, min(start + chunk_size, len(rows)))]
+        return
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _open_text(path, fmt):
+    if fmt.endswith(".gz"):
+        import gzip
+        return gzip.open(path, "wt", encoding="utf-8", newline='')
+    if fmt.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("zstd export needs the 'zstandard' package.")
+        raw = open(path, "wb")
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(raw), encoding="utf-8", newline='')
+    return open(path, "w", newline='', encoding="utf-8")
+
+
+class _TextWriter:
+    """Writes CSV or JSON Lines, optionally compressed."""
+    def __init__(self, path, fmt):
+        self.file = _open_text(path, fmt)
+        self.jsonl = fmt.startswith("jsonl")
+        if not self.jsonl:
+            self.writer = csv.DictWriter(self.file, fieldnames=FIELDNAMES, restval="", extrasaction="ignore")
+            self.writer.writeheader()
+
+    def write(self, chunk):
+        if self.jsonl:
+            self.file.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in chunk))
+        else:
+            self.writer.writerows(chunk)
+
+    def close(self):
+        self.file.close()
+
+
+class _ArrowWriter:
+    """Writes Parquet or Arrow IPC files one record batch per chunk."""
+    def __init__(self, path, fmt):
+        if pa is None:
+            raise RuntimeError("Parquet/Arrow export needs the 'pyarrow' package.")
+        self.schema = pa.schema([(name, pa.string()) for name in FIELDNAMES])
+        if fmt == "parquet":
+            self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+        else:
+            self.sink = pa.OSFile(path, "wb")
+            self.writer = pa.ipc.new_file(self.sink, self.schema)
+
+    def write(self, chunk):
+        columns = [[row.get(name, "") for row in chunk] for name in FIELDNAMES]
+        batch = pa.RecordBatch.from_arrays([pa.array(c, pa.string()) for c in columns], schema=self.schema)
+        self.writer.write_batch(batch)
+
+    def close(self):
+        self.writer.close()
+        if hasattr(self, "sink"):
+            self.sink.close()
+
+
+def open_writer(path, fmt):
+    return _ArrowWriter(path, fmt) if fmt in ("parquet", "arrow") else _TextWriter(path, fmt)
+
+
+class ExportJob(threading.Thread):
+    """
+    Background export of 'rows' (an EventBatch, live window, list or any
+    iterable of record dicts) to 'path'.
+
+    progress_callback(written, total) is called after every chunk and
+    done_callback(written, error, cancelled) once at the end, both from the
+    worker thread. total is None when the row count is unknown.
+    """
+    def __init__(self, rows, path, fmt=None, progress_callback=None, done_callback=None, chunk_size=5000):
+        super().__init__(daemon=True)
+        self.rows = rows
+        self.path = path
+        self.fmt = fmt or format_for_path(path)
+        self.progress_callback = progress_callback
+        self.done_callback = done_callback
+        self.chunk_size = chunk_size
+        self.written = 0
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def run(self):
+        total = len(self.rows) if hasattr(self.rows, "__len__") else None
+        error = None
+        try:
+            writer = open_writer(self.path, self.fmt)
+            try:
+                for chunk in _iter_chunks(self.rows, self.chunk_size):
+                    if self._cancel.is_set():
+                        break
+                    with METRICS.stage("export"):
+                        writer.write(chunk)
+                    self.written += len(chunk)
+                    METRICS.inc("events_exported", len(chunk))
+                    if self.progress_callback:
+                        self.progress_callback(self.written, total)
+            finally:
+                writer.close()
+            if self._cancel.is_set():
+                os.remove(self.path)  # Don't leave a truncated export behind
+        except Exception as e:
+            error = e
+        if self.done_callback:
+            self.done_callback(self.written, error, self._cancel.is_set())
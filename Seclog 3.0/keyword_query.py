@@ -0,0 +1,59 @@
+import re
+
+# This file contains the keyword search syntax used by the "Keyword" filter.
+#
+#   admin logon          -> both terms (AND is implied)
+#   admin OR guest       -> either term
+#   "failed logon"       -> exact phrase
+#
+# Matching is case-insensitive substring matching against Message,
+# SourceName and EventID only, never against the field names.
+
+SEARCH_FIELDS = ("Message", "SourceName", "EventID")
+
+# The trigram index can only serve terms of at least this many characters
+MIN_INDEXED_TERM = 3
+
+_TOKEN_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+
+class KeywordQuery:
+    """A parsed keyword query: an OR of groups, each group an AND of terms."""
+
+    def __init__(self, text):
+        self.text = text or ""
+        self.groups = self._parse(self.text)
+
+    @staticmethod
+    def _parse(text):
+        groups = [[]]
+        for match in _TOKEN_RE.finditer(text):
+            phrase, word = match.groups()
+            if word == "OR":
+                if groups[-1]:
+                    groups.append([])
+                continue
+            if word == "AND":
+                continue
+            term = (phrase if phrase is not None else word).strip().lower()
+            if term:
+                groups[-1].append(term)
+        return [group for group in groups if group]
+
+    def __bool__(self):
+        return bool(self.groups)
+
+    def matches(self, record):
+        """Checks a record dict against the query without stringifying the whole record."""
+        haystacks = [str(record.get(field, "")).lower() for field in SEARCH_FIELDS]
+        return any(all(any(term in h for h in haystacks) for term in group) for group in self.groups)
+
+    def indexable(self):
+        """True if every term is long enough to be served by the trigram index."""
+        return bool(self.groups) and all(
+            len(term) >= MIN_INDEXED_TERM for group in self.groups for term in group)
+
+    @staticmethod
+    def fts_phrase(term):
+        """Quotes a term as an FTS5 phrase, which the trigram tokenizer treats as a substring."""
+        return '"' + term.replace('"', '""') + '"'
@@ -1,132 +1,482 @@
-import win32evtlog
+import copy
+import heapq
+import os
+import sys
 import threading
 from datetime import datetime
-import csv
-from tkinter import filedialog, messagebox
+from itertools import islice
+
+from event_batch import EventBatch, to_epoch
+from exporter import ExportJob
+from event_sources import LOCAL_HOST, LOG_TYPES, default_sources, wait_for_new_events
+from metrics import METRICS, SamplingProfiler
+from parallel_fetch import merge_jobs, read_channel, split_source
+from query import Query
+from query_jobs import QueryJob, QueryScheduler
+from rules import RuleEngine, load_rules_or_defaults
+from tailing import DEFAULT_STATE_DIR, AdaptiveInterval, CursorStore, LiveWindow
+from templates import TEMPLATES
+
+PROFILE_DIR = os.path.join(DEFAULT_STATE_DIR, "profiles")
+QUERY_BATCH_SIZE = 8192  # Matching rows per batch from the readers
+FIRST_BATCH_SIZE = 1024  # A smaller first batch, so a progressive query shows something early
+
+def parse_date_range(start_date, end_date):
+    """Parses optional YYYY-MM-DD strings into datetimes, raising ValueError on bad input."""
+    try:
+        start_dt = datetime.strptime(start_date, "%Y-%m-%d") if start_date else None
+        end_dt = datetime.strptime(end_date, "%Y-%m-%d") if end_date else None
+    except ValueError:
+        raise ValueError("Please enter valid date(s) in YYYY-MM-DD format.")
+    return start_dt, end_dt
+
+def _calling(callback, batches):
+    """Passes each batch to 'callback' on its way through."""
+    for batch in batches:
+        callback(batch)
+        yield batch
+
+def _batched(stream, cancel=None):
+    """Yields a stream of (log_type, record) pairs as EventBatches, a small one first."""
+    try:
+        size = FIRST_BATCH_SIZE
+        while cancel is None or not cancel.is_set():
+            batch = EventBatch.from_records(islice(stream, size), TEMPLATES)
+            if not len(batch):
+                return
+            yield batch
+            size = QUERY_BATCH_SIZE
+    finally:
+        stream.close()
+
+def _batch_records(batches):
+    """The rows of EventBatches as (log_type, record) pairs."""
+    for batch in batches:
+        for index in range(len(batch)):
+            record = batch[index]
+            yield record.pop("LogType"), record
 
 class LogHandler:
     """
     Handles all backend logic for fetching, filtering, monitoring,
     and exporting Windows Event Logs.
     """
-    def __init__(self):
+    def __init__(self, sources=None, cursor_store=None, live_window=None, store=None,
+                 max_workers=None, use_processes=False, chunk_bytes=64 * 1024 * 1024, rules=None, sync_wait=None):
+        # Maps a log type ("Security", ...) to the EventSource that reads it
+        self.sources = sources if sources is not None else default_sources()
+        # Optional EventStore; when set, queries are served from its indexes
+        self.store = store
+        # Seconds a query waits for the store to catch up with the sources before
+        # reading them directly while the sync carries on; None waits for the sync
+        self.sync_wait = sync_wait
+        self._sync_thread = None
+        self._sync_channels = set()  # The channels the running sync covers
+        self._sync_lock = threading.Lock()
+
+        # --- Parallel fetch settings ---
+        self.max_workers = max_workers  # None = one worker per channel/chunk
+        self.use_processes = use_processes  # Process pool instead of threads (file sources)
+        self.chunk_bytes = chunk_bytes  # Large JSONL files are split into chunks of this size
         self.monitoring = False
         self.monitor_thread = None
+        self._stop_event = threading.Event()
+
+        # --- Real-time monitoring state ---
+        self.cursor_store = cursor_store or CursorStore()
+        self.live_window = live_window if live_window is not None else LiveWindow()  # Empty windows are falsy
+        self.poll_interval = AdaptiveInterval()
+        # Listeners of the running monitor; forwarded events are delivered to them too
+        self._callback = None
+        self._alert_callback = None
+        self._deliver_lock = threading.Lock()  # The monitor and the collector both deliver
+
+        # --- Detection rules ---
+        # Rule specs (see rules.py); the live engine keeps its windows across polls
+        self.rules = rules if rules is not None else load_rules_or_defaults()
+        self.rule_engine = RuleEngine(self.rules)
+
+        # --- Background queries (the app's "Fetch Logs") ---
+        self.query_scheduler = QueryScheduler()
+
+        # --- Profiling ---
+        self._profile_request = None  # Output path ("" = default) for the next fetch/interval
+        self._profile_lock = threading.Lock()
+        self.last_profile = None
 
     def fetch_logs(self, log_types, start_date, end_date, keyword):
         """
         Fetches and filters logs based on the provided criteria.
+        Raises ValueError if a date is not in YYYY-MM-DD format.
 
         Returns:
-            A tuple containing a list of log records (dicts) and a dictionary
+            A tuple containing an EventBatch (newest first) and a dictionary
             of log counts by type.
         """
-        logs = []
+        start_dt, end_dt = parse_date_range(start_date, end_date)
+        return self.query_logs(Query.from_filters(log_types, start_dt, end_dt, keyword))
+
+    def query_logs(self, query, cancel=None, batch_callback=None):
+        """
+        Runs a Query (or query text) over all configured channels.
+        Raises QueryError, a ValueError, if the text does not parse.
+        Once 'cancel' (a threading.Event) is set the readers stop and the
+        events found so far are returned. batch_callback(batch), if given,
+        is called with each EventBatch as it is found.
+
+        Returns:
+            A tuple containing an EventBatch (newest first) and a dictionary
+            of log counts by type.
+        """
+        if not isinstance(query, Query):
+            query = Query.parse(query)
         log_type_counts = {"Security": 0, "System": 0, "Application": 0}
 
+        profile = self._start_requested_profile()
         try:
-            start_dt = datetime.strptime(start_date, "%Y-%m-%d") if start_date else None
-            end_dt = datetime.strptime(end_date, "%Y-%m-%d") if end_date else None
-        except ValueError:
-            messagebox.showerror("Invalid Date", "Please enter valid date(s) in YYYY-MM-DD format.")
-            return [], log_type_counts
-
-        for log_type in log_types:
-            try:
-                handle = win32evtlog.OpenEventLog(None, log_type)
-                flags = win32evtlog.EVENTLOG_BACKWARDS_READ | win32evtlog.EVENTLOG_SEQUENTIAL_READ
-                total_records = win32evtlog.GetNumberOfEventLogRecords(handle)
-                
-                events_read = 0
-                while events_read < total_records:
-                    events = win32evtlog.ReadEventLog(handle, flags, 0, 1024) # Read in chunks
-                    if not events:
-                        break
-                    
-                    for ev_obj in events:
-                        time_generated = ev_obj.TimeGenerated
-                        
-                        # Apply date filtering
-                        if start_dt and time_generated < start_dt:
-                            continue
-                        if end_dt and time_generated > end_dt:
-                            continue
-
-                        record = {
-                            "TimeGenerated": time_generated.strftime("%Y-%m-%d %H:%M:%S"),
-                            "SourceName": ev_obj.SourceName,
-                            "EventID": str(ev_obj.EventID & 0xFFFF),
-                            "EventType": str(ev_obj.EventType),
-                            "Category": str(ev_obj.EventCategory),
-                            "Message": ' '.join(str(s).strip() for s in ev_obj.StringInserts) if ev_obj.StringInserts else ""
-                        }
-
-                        # Apply keyword filtering
-                        if not keyword or keyword.lower() in str(record).lower():
-                            logs.append(record)
-                            if log_type in log_type_counts:
-                                log_type_counts[log_type] += 1
-                    
-                    events_read += len(events)
-                win32evtlog.CloseEventLog(handle)
-            except Exception as e:
-                print(f"Error reading {log_type} log: {e}")
-                # messagebox.showerror("Error", f"Failed to read {log_type} log: {str(e)}")
+            with METRICS.stage("fetch"):
+                batches = self.iter_batches(query, cancel)
+                if batch_callback is not None:
+                    batches = _calling(batch_callback, batches)
+                logs = EventBatch.concat(batches)
+        finally:
+            self._finish_profile(profile, "fetch")
+        log_type_counts.update(logs.log_type_counts())
 
         return logs, log_type_counts
 
-    def start_monitoring(self, callback_func):
-        """Starts the real-time log monitoring thread."""
-        if self.monitoring:
-            messagebox.showinfo("Real-Time", "Already monitoring.")
+    def start_query(self, query, page_callback=None, done_callback=None):
+        """
+        Starts a background, cancellable run of 'query' (see QueryJob for
+        the callbacks) and returns the QueryJob. A query still running is
+        cancelled: only the newest one is worth finishing.
+        """
+        return self.query_scheduler.submit(QueryJob(self, query, page_callback, done_callback))
+
+    def cancel_query(self):
+        """Cancels the running background query, if any."""
+        self.query_scheduler.cancel()
+
+    def iter_batches(self, query, cancel=None):
+        """
+        Lazily yields EventBatches of the events matching 'query', newest
+        first. The channel, date range, EventID, SourceName and keyword
+        conditions are pushed down to the event store's indexes (or, without
+        a store, to the readers); the rest of the query is evaluated on
+        batches of candidates by its fused filter. Stops early once 'cancel'
+        (a threading.Event) is set. If the store is still syncing after
+        sync_wait seconds, the query is answered without waiting for it
+        (see _read_during_sync).
+        """
+        plan = query.plan(self.channels(), indexed=self.store is not None)
+        if not plan.log_types:
+            return
+        if self.store is None:
+            batches = self._read_batches(plan, cancel)
+        elif self._sync_store(plan.log_types, cancel):
+            batches = map(plan.apply, self._query_store(plan, plan.log_types, plan.host_names, cancel))
+        else:
+            batches = self._read_during_sync(query.plan(plan.log_types), cancel)
+        for batch in batches:
+            METRICS.inc("events_matched", len(batch))
+            if len(batch):
+                yield batch
+
+    def _read_batches(self, plan, cancel=None):
+        """
+        Reads the planned channels concurrently and yields the merged stream
+        in batches. Each reader filters its own records, so only matches
+        travel through the merge.
+        """
+        stream = self._read_stream(plan, cancel)
+        if stream is not None:
+            yield from _batched(stream, cancel)
+
+    def _read_stream(self, plan, cancel=None):
+        """The planned channels' matching (log_type, record) pairs, newest first, or None if none can match."""
+        if self.use_processes:
+            cancel = None  # An Event cannot be sent to another process; the job runs to the end
+        if plan.host_names is not None and LOCAL_HOST.lower() not in plan.host_names:
+            return None  # Only this machine's events are read directly
+        jobs = []
+        for log_type in plan.log_types:
+            source = self.sources.get(log_type)
+            if source is None:
+                print(f"Error reading {log_type} log: no event source configured", file=sys.stderr)
+                continue
+            for part in split_source(source, self.chunk_bytes):
+                jobs.append((read_channel, (log_type, part, plan.start_dt, plan.end_dt,
+                                              plan.event_ids, plan.residual, cancel)))
+        return merge_jobs(jobs, self.max_workers, self.use_processes)
+
+    def _read_during_sync(self, plan, cancel=None):
+        """
+        Answers a query while the store is still catching up (e.g. on first
+        use): this machine's events come straight from the sources, merged
+        newest first with the stored events the sources cannot provide,
+        those forwarded from other hosts and those of channels that have no
+        source. 'plan' must not be an indexed one, as the readers need the
+        whole residual filter.
+        """
+        local_types = [log_type for log_type in plan.log_types if log_type in self.sources]
+        other_types = [log_type for log_type in plan.log_types if log_type not in self.sources]
+        forwarded = [host for host in self.store.values("host")
+                     if host and (plan.host_names is None or host.lower() in plan.host_names)]
+        local_plan = copy.copy(plan)
+        local_plan.log_types = local_types
+        local = self._read_stream(local_plan, cancel) if local_types else None
+        streams = [local] if local is not None else []
+        if local_types and forwarded:
+            streams.append(_batch_records(map(plan.apply, self._query_store(plan, local_types, forwarded, cancel))))
+        if other_types:
+            streams.append(_batch_records(map(plan.apply, self._query_store(plan, other_types, plan.host_names,
+                                                                            cancel))))
+        METRICS.inc("queries_during_sync")
+        if not streams:
             return
+        if streams == [local]:
+            yield from _batched(local, cancel)
+            return
+        try:
+            yield from _batched(heapq.merge(*streams, key=lambda item: item[1]["TimeGenerated"], reverse=True),
+                                cancel)
+        finally:
+            for stream in streams:
+                stream.close()
+
+    def _query_store(self, plan, log_types, host_names, cancel=None):
+        return self.store.query_batches(log_types, plan.start_dt, plan.end_dt, plan.event_ids, plan.source_names,
+                                        plan.keyword, host_names, cancel)
+
+    def iter_records(self, query):
+        """Lazily yields (log_type, record) pairs matching 'query', newest first."""
+        for batch in self.iter_batches(query):
+            for index in range(len(batch)):
+                record = batch[index]
+                yield record.pop("LogType"), record
+
+    def iter_logs(self, log_types, start_dt=None, end_dt=None, keyword=""):
+        """
+        Lazily yields (log_type, record) pairs for the given channels, newest
+        first across all of them. Same as iter_records() with the classic
+        filters.
+        """
+        return self.iter_records(Query.from_filters(log_types, start_dt, end_dt, keyword))
+
+    def channels(self):
+        """The channels that can be queried: the configured sources plus any forwarded to the event store."""
+        channels = list(self.sources)
+        if self.store is not None:
+            channels += [name for name in self.store.values("channel") if name not in self.sources]
+        return channels
+
+    def _sync_store(self, log_types, cancel=None):
+        """
+        Brings the store up to date with the sources of 'log_types'. With
+        sync_wait set the sync runs on a background thread and this returns
+        False if it has not finished within sync_wait seconds; the sync
+        carries on, so later queries find the store up to date.
+        """
+        sources = {log_type: self.sources[log_type] for log_type in log_types if log_type in self.sources}
+        if self.sync_wait is None:
+            self.store.sync(sources, self.max_workers, cancel)
+            return True
+        with self._sync_lock:
+            thread = self._sync_thread
+            if thread is None or not thread.is_alive():
+                thread = threading.Thread(target=self.store.sync, args=(sources, self.max_workers),
+                                          name="store-sync", daemon=True)
+                thread.start()
+                self._sync_thread = thread
+                self._sync_channels = set(sources)
+            elif not self._sync_channels.issuperset(sources):
+                return False  # Another sync is running; this one starts once it is done
+        thread.join(self.sync_wait)
+        return not thread.is_alive()
+
+    def rebuild_cache(self):
+        """Drops and re-ingests the event store. Returns the number of cached events."""
+        if self.store is None:
+            return 0
+        return self.store.rebuild(self.sources)
+
+    def detect(self, logs):
+        """
+        Runs the detection rules over a fetched EventBatch (newest first)
+        with fresh window state. Returns the alerts, oldest first.
+        """
+        return RuleEngine(self.rules).process_batch(logs)
+
+    def start_monitoring(self, callback_func, log_types=None, alert_callback=None):
+        """
+        Starts the real-time log monitoring thread.
+
+        callback_func(new_logs, counts) is called from the monitoring thread
+        with each delta batch, as (log_type, record) pairs, and the per-type
+        counts of the live window. If alert_callback is given, the rules run
+        on every delta batch and alert_callback(alerts) gets their alerts.
+        Returns False if monitoring was already running.
+        """
+        if self.monitoring:
+            return False
         
         self.monitoring = True
-        self.monitor_thread = threading.Thread(target=self._monitor_loop, args=(callback_func,), daemon=True)
+        self._callback = callback_func
+        self._alert_callback = alert_callback
+        self._stop_event.clear()
+        self.monitor_thread = threading.Thread(target=self._monitor_loop, args=(log_types or LOG_TYPES,), daemon=True)
         self.monitor_thread.start()
+        return True
 
     def stop_monitoring(self):
         """Stops the real-time log monitoring."""
         self.monitoring = False
+        self._stop_event.set()
         if self.monitor_thread and self.monitor_thread.is_alive():
             # The thread will exit its loop based on the self.monitoring flag
-            print("Stopping monitoring thread...")
+            print("Stopping monitoring thread...", file=sys.stderr)
+
+    def poll_new_logs(self, log_types):
+        """
+        Reads only the records added since each channel's saved cursor.
+
+        Returns:
+            A list of (log_type, records) pairs, records oldest first.
+        """
+        batches = []
+        moved = False
+        for log_type in log_types:
+            source = self.sources.get(log_type)
+            if source is None:
+                continue
+            try:
+                cursor = self.cursor_store.get(log_type)
+                if cursor is None:
+                    # First run: start at the current end of the log instead of replaying history
+                    cursor = source.latest_cursor()
+                    if cursor is not None:
+                        self.cursor_store.set(log_type, cursor)
+                        moved = True
+                    continue
+                records = []
+                for cursor, record in source.read_since(cursor):
+                    records.append(record)
+                if records:
+                    self.cursor_store.set(log_type, cursor)
+                    batches.append((log_type, records))
+                    moved = True
+            except Exception as e:
+                print(f"Error tailing {log_type} log: {e}", file=sys.stderr)
+        if moved:
+            self.cursor_store.save()
+        return batches
 
-    def _monitor_loop(self, callback_func):
+    def _monitor_loop(self, log_types):
         """The actual monitoring logic that runs in a separate thread."""
-        # This is a simplified example. Real-time monitoring is complex.
-        # For a robust solution, you'd need to handle event sources properly.
-        # This example will periodically re-fetch logs to simulate real-time updates.
-        print("Monitoring thread started.")
-        # This is a placeholder for a more advanced real-time implementation
-        # A true real-time implementation would use Win32 API calls like `NotifyChangeEventLog`
-        # which are more complex. For this project, a periodic poll is a reasonable simulation.
+        print("Monitoring thread started.", file=sys.stderr)
+        sources = [self.sources[log_type] for log_type in log_types if log_type in self.sources]
         while self.monitoring:
-            # Simulate fetching new logs every 5 seconds
-            # In a real app, you would only fetch *new* events since the last check
-            logs, counts = self.fetch_logs(["Security", "System", "Application"], None, None, "")
-            if self.monitoring: # Check again in case it was stopped during fetch
-                callback_func(logs, counts)
-            threading.Event().wait(5)
-        print("Monitoring thread stopped.")
-
-    def save_logs_to_csv(self, logs_to_save):
-        """Saves a list of log records to a CSV file."""
-        if not logs_to_save:
-            messagebox.showwarning("No Data", "No filtered log data to save.")
+            profile = self._start_requested_profile()
+            with METRICS.stage("monitor_poll"):
+                batches = self.poll_new_logs(log_types)
+            new_logs = self._deliver(batches)
+            if new_logs:
+                # How long the oldest new event waited before the monitor delivered it
+                oldest = new_logs[0][1]["TimeGenerated"]
+                METRICS.set_gauge("monitor_lag_seconds", max(0, to_epoch(datetime.now()) - to_epoch(oldest)))
+                METRICS.inc("events_live", len(new_logs))
+            # Poll faster while events are arriving; wake early if the OS notifies us
+            interval = self.poll_interval.update(len(new_logs))
+            METRICS.set_gauge("monitor_interval_seconds", interval)
+            wait_for_new_events(sources, interval, self._stop_event)
+            self._finish_profile(profile, "monitor")
+        for source in sources:
+            source.close()
+        print("Monitoring thread stopped.", file=sys.stderr)
+
+    def receive(self, pairs):
+        """
+        Feeds events forwarded from other machines (see collector.py) into
+        the same pipeline as local ones: the event store, the live window and,
+        while monitoring, the monitor callback and the detection rules.
+        'pairs' are (log_type, record) pairs whose records carry a "Host" key.
+        Events for channels other than the standard ones and this handler's
+        sources are dropped, so a peer cannot grow the channel vocabulary.
+        """
+        known = set(LOG_TYPES).union(self.sources)
+        batches = {}
+        rejected = 0
+        for log_type, record in pairs:
+            if log_type in known:
+                batches.setdefault(log_type, []).append(record)
+            else:
+                rejected += 1
+        if rejected:
+            METRICS.inc("events_rejected", rejected)
+        if self.store is not None:
+            for log_type, records in batches.items():
+                self.store.ingest(log_type, records)
+        self._deliver(batches.items())
+        METRICS.inc("events_received", len(pairs) - rejected)
+
+    def _deliver(self, batches):
+        """
+        Appends (log_type, records) batches to the live window and passes
+        them on to the monitor's listeners. Returns the new events as
+        (log_type, record) pairs, oldest first.
+        """
+        new_logs = []
+        with self._deliver_lock:
+            for log_type, records in batches:
+                self.live_window.append(log_type, records)
+                new_logs.extend((log_type, record) for record in records)
+            METRICS.set_gauge("live_window_events", len(self.live_window))
+            if not new_logs:
+                return new_logs
+            new_logs.sort(key=lambda item: item[1]["TimeGenerated"])  # Channels interleaved, oldest first
+            if self.monitoring and self._callback is not None:  # Check again in case it was stopped during the poll
+                self._callback(new_logs, self.live_window.counts())
+                if self._alert_callback is not None:
+                    alerts = self.rule_engine.process_records(new_logs)
+                    if alerts:
+                        self._alert_callback(alerts)
+        return new_logs
+
+    def request_profile(self, path=None):
+        """
+        Profiles the next fetch or monitoring interval, whichever comes first.
+        The collapsed stacks are written to 'path' (default: a timestamped
+        file in ~/.seclog/profiles) and the path is kept in last_profile.
+        """
+        with self._profile_lock:
+            self._profile_request = path or ""
+
+    def _start_requested_profile(self):
+        with self._profile_lock:
+            path, self._profile_request = self._profile_request, None
+        if path is None:
+            return None
+        return SamplingProfiler().start(), path
+
+    def _finish_profile(self, profile, kind):
+        if profile is None:
             return
+        profiler, path = profile
+        profiler.stop()
+        path = path or os.path.join(PROFILE_DIR, f"{kind}-{datetime.now():%Y%m%d-%H%M%S}.folded")
+        try:
+            self.last_profile = profiler.dump(path)
+            print(f"Profile written to {path} ({profiler.samples} samples)", file=sys.stderr)
+        except OSError as e:
+            print(f"Error writing profile: {e}", file=sys.stderr)
+
+    def export_logs(self, rows, path, fmt=None, progress_callback=None, done_callback=None):
+        """
+        Starts a background export of 'rows' to 'path' and returns the
+        ExportJob, which can be cancelled. The format follows the file
+        extension unless 'fmt' is given.
+        """
+        job = ExportJob(rows, path, fmt, progress_callback, done_callback)
+        job.start()
+        return job
 
-        file_path = filedialog.asksaveasfilename(
-            defaultextension=".csv",
-            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")]
-        )
-        if file_path:
-            try:
-                with open(file_path, "w", newline='', encoding="utf-8") as f:
-                    if logs_to_save:
-                        writer = csv.DictWriter(f, fieldnames=logs_to_save[0].keys())
-                        writer.writeheader()
-                        writer.writerows(logs_to_save)
-                messagebox.showinfo("Success", f"Logs successfully saved to {file_path}")
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to save file: {str(e)}")
@@ -0,0 +1,254 @@
+import tkinter as tk
+import tkinter.font as tkfont
+import customtkinter as ctk
+
+from event_sources import EVENT_TYPE_LABELS, LOCAL_HOST
+from metrics import METRICS
+
+# This file contains the virtual-scrolling table used by the Logs tab.
+# Only the rows inside the viewport (plus a small overscan) are formatted and
+# drawn, so showing or scrolling a result set costs the same at any size.
+
+# (record key, header text, width in characters; 0 = rest of the line)
+COLUMNS = [
+    ("TimeGenerated", "Time", 19),
+    ("SourceName", "Source", 34),
+    ("EventID", "Event ID", 8),
+    ("EventType", "Type", 13),
+    ("Host", "Host", 15),
+    ("Message", "Message", 0),
+]
+NUMERIC_COLUMNS = {"EventID", "EventType"}
+
+
+class VirtualLogTable(ctk.CTkFrame):
+    """
+    Table that reads rows on demand from any sequence of record dicts
+    (anything supporting len() and indexing), with sortable columns and
+    constant-time jumps to a row.
+    """
+    OVERSCAN = 5
+    ROW_PADDING = 4
+
+    def __init__(self, master, font=("Courier New", 12), **kwargs):
+        super().__init__(master, **kwargs)
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(1, weight=1)
+
+        self._font = tkfont.Font(family=font[0], size=font[1])
+        self._char_width = self._font.measure("0")
+        self._row_height = self._font.metrics("linespace") + self.ROW_PADDING
+
+        self.header = tk.Canvas(self, height=self._row_height + 4, highlightthickness=0)
+        self.header.grid(row=0, column=0, sticky="ew", padx=(5, 0), pady=(5, 0))
+        self.canvas = tk.Canvas(self, highlightthickness=0)
+        self.canvas.grid(row=1, column=0, sticky="nsew", padx=(5, 0))
+        self.v_scroll = ctk.CTkScrollbar(self, command=self._on_vertical_scroll)
+        self.v_scroll.grid(row=1, column=1, sticky="ns")
+        self.h_scroll = ctk.CTkScrollbar(self, orientation="horizontal", command=self._on_horizontal_scroll)
+        self.h_scroll.grid(row=2, column=0, sticky="ew", padx=(5, 0))
+
+        self._rows = []
+        self._order = None  # Row indexes in display order when sorted
+        self._sort_values = None  # Per-row sort values of a columnar batch, kept for rows_appended()
+        self._sort_key = None
+        self._sort_reverse = False
+        self._top = 0
+        self._items = []  # Reused canvas text items, one per drawn row
+        self._message = ""
+        self._content_width = 0
+
+        self.canvas.bind("<Configure>", lambda e: self._render())
+        self.header.bind("<Button-1>", self._on_header_click)
+        for widget in (self.canvas, self.header):
+            widget.bind("<MouseWheel>", self._on_mouse_wheel)
+            widget.bind("<Button-4>", lambda e: self.scroll_rows(-3))
+            widget.bind("<Button-5>", lambda e: self.scroll_rows(3))
+
+    # --- Data ---
+
+    def set_rows(self, rows):
+        """Shows a new result set. The sequence is used as-is, not copied."""
+        self._rows = rows
+        self._message = "" if len(rows) else "No logs found matching your criteria."
+        self._top = 0
+        self._apply_sort()
+        self._render()
+
+    def show_message(self, text):
+        """Clears the table and shows a single line of text instead."""
+        self._rows = []
+        self._order = None
+        self._sort_values = None
+        self._message = text
+        self._top = 0
+        self._render()
+
+    def refresh(self):
+        """Redraws the visible rows, e.g. after rows were appended to the sequence."""
+        self._apply_sort()
+        self._render()
+
+    def rows_appended(self):
+        """
+        Redraws after rows were appended to the end of a columnar batch. A
+        sorted view merges the new rows into its order instead of sorting
+        everything again.
+        """
+        values = self._sort_values
+        if self._order is None or values is None:
+            self.refresh()
+            return
+        start = len(values)
+        values.extend(self._rows.sort_column(self._sort_key, start))
+        self._order.extend(range(start, len(values)))
+        # One sorted run plus the new rows: Timsort sorts the new rows and merges them in linear time
+        self._order.sort(key=values.__getitem__, reverse=self._sort_reverse)
+        self._render()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def row(self, index):
+        """Returns the record shown at display position 'index'."""
+        return self._rows[self._order[index]] if self._order is not None else self._rows[index]
+
+    # --- Sorting ---
+
+    def sort_by(self, key, reverse=False):
+        self._sort_key = key
+        self._sort_reverse = reverse
+        self._apply_sort()
+        self._top = 0
+        self._render()
+
+    def _apply_sort(self):
+        self._sort_values = None
+        if self._sort_key is None or not len(self._rows):
+            self._order = None
+            return
+        key = self._sort_key
+        rows = self._rows
+        if hasattr(rows, "sort_column"):
+            # Columnar batches sort on their typed columns
+            values = self._sort_values = rows.sort_column(key)
+            self._order = sorted(range(len(values)), key=values.__getitem__, reverse=self._sort_reverse)
+            return
+        if key in NUMERIC_COLUMNS:
+            def sort_value(i):
+                value = rows[i][key]
+                return int(value) if str(value).isdigit() else -1
+        else:
+            def sort_value(i):
+                return rows[i].get(key, "")
+        self._order = sorted(range(len(rows)), key=sort_value, reverse=self._sort_reverse)
+
+    def _on_header_click(self, event):
+        column_chars = int(self.header.canvasx(event.x) // self._char_width)
+        offset = 0
+        for key, _, width in COLUMNS:
+            if width == 0 or column_chars < offset + width + 1:
+                reverse = not self._sort_reverse if key == self._sort_key else False
+                self.sort_by(key, reverse)
+                return
+            offset += width + 1
+
+    # --- Scrolling ---
+
+    def jump_to_row(self, index):
+        """Scrolls so that display row 'index' is at the top."""
+        self._top = index
+        self._render()
+
+    def scroll_rows(self, delta):
+        self._top += delta
+        self._render()
+
+    def _visible_rows(self):
+        return max(1, self.canvas.winfo_height() // self._row_height)
+
+    def _on_vertical_scroll(self, *args):
+        if args[0] == "moveto":
+            self._top = int(float(args[1]) * len(self._rows))
+        elif args[0] == "scroll":
+            step = self._visible_rows() if args[2] == "pages" else 1
+            self._top += int(float(args[1])) * step
+        self._render()
+
+    def _on_horizontal_scroll(self, *args):
+        self.canvas.xview(*args)
+        self.header.xview(*args)
+        self.h_scroll.set(*self.canvas.xview())
+
+    def _on_mouse_wheel(self, event):
+        self.scroll_rows(-3 if event.delta > 0 else 3)
+
+    # --- Drawing ---
+
+    def _format_row(self, record):
+        parts = []
+        for key, _, width in COLUMNS:
+            value = str(record.get(key, ""))
+            if key == "EventType":
+                value = EVENT_TYPE_LABELS.get(value, value)
+            elif key == "Host":
+                value = value or LOCAL_HOST  # Records read on this machine carry no "Host" key
+            parts.append(value[:width].ljust(width) if width else value)
+        return " ".join(parts)
+
+    def _render(self):
+        with METRICS.stage("render"):
+            drawn = self._draw()
+        METRICS.inc("events_rendered", drawn)
+
+    def _draw(self):
+        """Redraws the visible rows and returns how many records were drawn."""
+        dark = ctk.get_appearance_mode() == "Dark"
+        bg_color = "#2b2b2b" if dark else "#f0f0f0"
+        text_color = "white" if dark else "black"
+        header_color = "#3a3a3a" if dark else "#dcdcdc"
+        self.canvas.configure(bg=bg_color)
+        self.header.configure(bg=header_color)
+
+        total = len(self._rows)
+        visible = self._visible_rows()
+        self._top = max(0, min(self._top, total - visible))
+
+        lines = [self._message] if self._message else []
+        drawn = 0
+        for index in range(self._top, min(total, self._top + visible + self.OVERSCAN)):
+            try:
+                lines.append(self._format_row(self.row(index)))
+            except IndexError:
+                break  # A live window shrank while we were drawing
+            drawn += 1
+
+        for slot, line in enumerate(lines):
+            if slot == len(self._items):
+                self._items.append(self.canvas.create_text(
+                    4, slot * self._row_height + self.ROW_PADDING // 2, anchor="nw", font=self._font))
+            self.canvas.itemconfigure(self._items[slot], text=line, fill=text_color, state="normal")
+            self._content_width = max(self._content_width, len(line) * self._char_width + 8)
+        for item in self._items[len(lines):]:
+            self.canvas.itemconfigure(item, state="hidden")
+
+        self._draw_header(text_color)
+        height = visible * self._row_height
+        self.canvas.configure(scrollregion=(0, 0, self._content_width, height))
+        self.header.configure(scrollregion=(0, 0, self._content_width, self._row_height))
+        self.h_scroll.set(*self.canvas.xview())
+        if total:
+            self.v_scroll.set(self._top / total, min(1.0, (self._top + visible) / total))
+        else:
+            self.v_scroll.set(0.0, 1.0)
+        return drawn
+
+    def _draw_header(self, text_color):
+        self.header.delete("all")
+        x = 4
+        for key, title, width in COLUMNS:
+            if key == self._sort_key:
+                title += " ▼" if self._sort_reverse else " ▲"
+            self.header.create_text(x, 2 + self.ROW_PADDING // 2, anchor="nw", text=title,
+                                    font=self._font, fill=text_color)
+            x += (width + 1) * self._char_width
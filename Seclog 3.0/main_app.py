@@ -1,10 +1,25 @@
 import customtkinter as ctk
 import tkinter as tk
+from tkinter import filedialog, messagebox
 import threading
 
 from log_handler import LogHandler
+from event_store import EventStore
+from aggregation import EventAggregator
+from event_batch import EventBatch
+from exporter import available_formats
+from metrics import METRICS
+from query import Query, QueryError
+from tailing import LiveWindow
 import ui_components
 
+# Reader threads per query. Scans are CPU-bound Python, so more threads would
+# only take turns on the GIL with the Tk main loop and make the UI stutter.
+MAX_READER_WORKERS = 2
+# How long Fetch Logs waits for the event cache to catch up before reading the
+# logs directly; on first use a full sync would hold back the first page
+SYNC_WAIT = 0.25
+
 class SecurityLogApp(ctk.CTk):
     """
     The main application class that ties the UI and the backend logic together.
@@ -16,12 +31,16 @@ class SecurityLogApp(ctk.CTk):
         self.geometry("1100x650")
         self.minsize(900, 500)
 
-        # Initialize the backend log handler
-        self.log_handler = LogHandler()
+        # Initialize the backend log handler with the on-disk event cache
+        self.log_handler = LogHandler(store=EventStore(), max_workers=MAX_READER_WORKERS, sync_wait=SYNC_WAIT)
 
         # --- Data Storage ---
-        self.all_logs = []
-        self.filtered_logs = []
+        self.all_logs = EventBatch()
+        self.filtered_logs = self.all_logs
+        self.aggregator = EventAggregator()
+        self.export_job = None
+        self._query_generation = 0  # Pages and results of older queries are ignored
+        self._query_results = None  # The pages of the running or last query, joined
 
         # --- Configure Grid Layout ---
         self.grid_columnconfigure(1, weight=1)
@@ -32,55 +51,116 @@ class SecurityLogApp(ctk.CTk):
         # (like entry fields and buttons) directly to the app instance.
         ui_components.create_sidebar(self, self)
         ui_components.create_main_tabs(self, self)
+        ui_components.create_status_bar(self, self)
+        self._refresh_diagnostics()
+        if not self.log_handler.sources:
+            # Shown once the window is up; cached and forwarded events can still be browsed
+            self.after(0, lambda: messagebox.showerror(
+                "No Event Sources",
+                "The Windows event logs cannot be read on this system (pywin32 is not available). "
+                "Only events already in the cache or forwarded by other hosts will be shown."))
 
     def search_logs(self):
         """
         Handles the 'Fetch Logs' button click.
-        Fetches logs in a separate thread to keep the UI responsive.
+        Runs the query as a background job whose results are shown page by
+        page as they arrive; a query still running is cancelled.
         """
+        # Parse the query here so syntax errors are reported before any work starts
+        try:
+            query = Query.parse(self.query_entry.get().strip())
+        except QueryError as e:
+            messagebox.showerror("Invalid Query", str(e))
+            return
+
         self.logs_label.configure(text="🔄 Fetching and filtering logs...")
-        self.log_textbox.configure(state="normal")
-        self.log_textbox.delete("1.0", tk.END)
-        self.log_textbox.insert("1.0", "Searching logs... this may take a moment.")
-        self.log_textbox.configure(state="disabled")
-
-        # Get filter criteria from UI elements
-        selected_log_type = self.log_type.get()
-        log_types_to_fetch = ["Security", "System", "Application"] if selected_log_type == "All" else [selected_log_type]
-        start_date = self.start_date_entry.get().strip()
-        end_date = self.end_date_entry.get().strip()
-        keyword = self.filter_entry.get().strip()
-
-        # Run the fetching in a new thread
-        threading.Thread(
-            target=self._fetch_logs_thread_target,
-            args=(log_types_to_fetch, start_date, end_date, keyword),
-            daemon=True
-        ).start()
-
-    def _fetch_logs_thread_target(self, log_types, start_date, end_date, keyword):
-        """Target function for the log fetching thread."""
-        logs, counts = self.log_handler.fetch_logs(log_types, start_date, end_date, keyword)
-        
-        # Schedule the UI update on the main thread
-        self.after(0, self._update_ui_with_fetched_logs, logs, counts)
+        self.log_table.show_message("Searching logs... this may take a moment.")
+        self._query_results = EventBatch()
+        self.all_logs = self._query_results
+        self.filtered_logs = self._query_results
+        self.aggregator = EventAggregator()
+        ui_components.show_query_progress(self, True)
 
-    def _update_ui_with_fetched_logs(self, logs, counts):
-        """Updates the entire UI with new log data. Must be run on the main thread."""
-        self.all_logs = logs
-        self.filtered_logs = logs
-        
-        self.logs_label.configure(text=f"Logs Loaded: {len(self.filtered_logs)} entries found")
-        
-        # Update all parts of the UI
-        ui_components.display_logs(self.log_textbox, self.filtered_logs)
-        ui_components.update_summary_cards(self, len(self.filtered_logs), counts)
-        ui_components.update_summary_tab(self, self.filtered_logs)
-        ui_components.draw_event_graph(self.graph_frame, self.filtered_logs)
+        # The callbacks run on the job's thread, so they only schedule the UI updates
+        self._query_generation += 1
+        generation = self._query_generation
+        self.log_handler.start_query(
+            query,
+            page_callback=lambda page, matched: self.after(0, self._show_query_page, generation, page, matched),
+            done_callback=lambda logs, counts, alerts, error, cancelled: self.after(
+                0, self._query_finished, generation, counts, alerts, error, cancelled)
+        )
+
+    def cancel_query(self):
+        """Handles the query 'Cancel' button click."""
+        self.log_handler.cancel_query()
+
+    def _show_query_page(self, generation, page, matched):
+        """Appends a page of results to the view. Must be run on the main thread."""
+        if generation != self._query_generation:
+            return
+        results = self._query_results
+        first_page = not len(results)
+        if first_page:
+            # Pages are ours to keep; the first one becomes the result set, so the
+            # rest are appended with its templates instead of as plain text
+            showing = self.filtered_logs is results
+            results = self._query_results = page
+            if showing:
+                self.all_logs = results
+                self.filtered_logs = results
+        else:
+            results.extend(page)
+        self.aggregator.add_batch(page)
+        ui_components.update_query_progress(self, matched)
+        if self.filtered_logs is not results:
+            return  # Real-time monitoring took over the view
+        if first_page:
+            ui_components.display_logs(self.log_table, results)
+        else:
+            self.log_table.rows_appended()
+        ui_components.update_summary_cards(self, len(results), results.log_type_counts())
+        ui_components.update_summary_tab(self, self.aggregator)
+
+    def _query_finished(self, generation, counts, alerts, error, cancelled):
+        """Reports the end of a query. Must be run on the main thread."""
+        if generation != self._query_generation:
+            return
+        ui_components.show_query_progress(self, False)
+        if error is not None:
+            self.log_table.show_message("")
+            self.logs_label.configure(text="Fetching logs failed.")
+            messagebox.showerror("Error", f"Failed to fetch logs: {str(error)}")
+            return
+        if cancelled:
+            if not len(self._query_results):
+                self.log_table.show_message("")
+            self.logs_label.configure(text=f"Query cancelled: {len(self._query_results)} entries shown")
+            return
+        self._update_ui_with_fetched_logs(counts, alerts)
+
+    def _update_ui_with_fetched_logs(self, counts, alerts):
+        """
+        Completes the UI once all pages of a query have been shown. Must be
+        run on the main thread.
+        """
+        results = self._query_results
+        if not len(results):
+            ui_components.display_logs(self.log_table, results)  # Shows "No logs found"
+        self.logs_label.configure(text=f"Logs Loaded: {len(results)} entries found")
+
+        # The pages already fed the aggregator; the dashboard and summary read from it
+        ui_components.update_summary_cards(self, len(results), counts)
+        ui_components.update_summary_tab(self, self.aggregator)
+        ui_components.draw_event_graph(self, self.aggregator)
+        ui_components.show_alerts(self, alerts)
 
     def start_real_time_monitoring(self):
         """Handles the 'Start Real-Time' button click."""
-        self.log_handler.start_monitoring(self._real_time_update_callback)
+        if not self.log_handler.start_monitoring(self._real_time_update_callback,
+                                                 alert_callback=self._real_time_alert_callback):
+            messagebox.showinfo("Real-Time", "Already monitoring.")
+            return
         self.start_button.configure(state="disabled")
         self.stop_button.configure(state="normal")
         self.logs_label.configure(text="🔄 Real-Time Monitoring Started...")
@@ -92,26 +172,126 @@ class SecurityLogApp(ctk.CTk):
         self.stop_button.configure(state="disabled")
         self.logs_label.configure(text="Real-Time Monitoring Stopped.")
 
-    def _real_time_update_callback(self, logs, counts):
-        """Callback function for the monitor to send data back to the UI."""
+    def _real_time_update_callback(self, new_logs, counts):
+        """Callback function for the monitor to send each delta batch back to the UI."""
         # This function is called from the monitoring thread, so we must
         # schedule the UI update on the main thread using self.after()
-        self.after(0, self._update_ui_with_fetched_logs, logs, counts)
+        self.after(0, self._update_ui_with_live_logs, counts)
+
+    def _real_time_alert_callback(self, alerts):
+        """Called from the monitoring thread with the alerts raised by a delta batch."""
+        self.after(0, ui_components.show_alerts, self, alerts, True)
+
+    def _update_ui_with_live_logs(self, counts):
+        """
+        Shows the current live window. Must be run on the main thread.
+        Only the visible rows and the fixed-size summaries are redrawn, so
+        the cost does not grow with the size of the window.
+        """
+        window = self.log_handler.live_window
+        self.aggregator = window.aggregator
+        if self.filtered_logs is not window:
+            self.all_logs = window
+            self.filtered_logs = window
+            ui_components.display_logs(self.log_table, window)
+        else:
+            self.log_table.refresh()
+
+        self.logs_label.configure(text=f"Live: {len(window)} entries in window")
+        ui_components.update_summary_cards(self, len(window), counts)
+        ui_components.update_summary_tab(self, self.aggregator)
+        ui_components.draw_event_graph(self, self.aggregator)
 
     def save_filtered_logs(self):
-        """Handles the 'Export to CSV' button click."""
-        self.log_handler.save_logs_to_csv(self.filtered_logs)
+        """Handles the 'Export Logs' button click."""
+        logs_to_save = self.filtered_logs
+        if not len(logs_to_save):
+            messagebox.showwarning("No Data", "No filtered log data to save.")
+            return
+        if self.export_job is not None and self.export_job.is_alive():
+            messagebox.showinfo("Export", "An export is already running.")
+            return
+
+        formats = available_formats()
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            filetypes=[(description, f"*{ext}") for ext, _, description in formats] + [("All files", "*.*")]
+        )
+        if not file_path:
+            return
+        if isinstance(logs_to_save, LiveWindow):
+            logs_to_save = logs_to_save.snapshot()  # The window keeps changing while we export
+        elif logs_to_save is self._query_results and self.log_handler.query_scheduler.active is not None:
+            logs_to_save = logs_to_save.take(range(len(logs_to_save)))  # Pages are still being appended
+
+        ui_components.show_export_progress(self, True)
+        self.export_job = self.log_handler.export_logs(
+            logs_to_save, file_path,
+            progress_callback=lambda written, total: self.after(0, ui_components.update_export_progress, self, written, total),
+            done_callback=lambda written, error, cancelled: self.after(0, self._export_finished, file_path, written, error, cancelled)
+        )
+
+    def cancel_export(self):
+        """Handles the export 'Cancel' button click."""
+        if self.export_job is not None:
+            self.export_job.cancel()
+
+    def _export_finished(self, file_path, written, error, cancelled):
+        """Reports the end of an export. Must be run on the main thread."""
+        ui_components.show_export_progress(self, False)
+        self.export_job = None
+        if error is not None:
+            messagebox.showerror("Error", f"Failed to save file: {str(error)}")
+        elif cancelled:
+            self.logs_label.configure(text="Export cancelled.")
+        else:
+            messagebox.showinfo("Success", f"{written} logs successfully saved to {file_path}")
+
+    def _refresh_diagnostics(self):
+        """Updates the status bar and Diagnostics tab once a second."""
+        ui_components.update_diagnostics(self)
+        if self.log_handler.last_profile:
+            self.profile_label.configure(text=f"Last profile: {self.log_handler.last_profile}")
+        self.after(1000, self._refresh_diagnostics)
+
+    def request_profile(self):
+        """Handles the 'Profile Next Fetch' button click."""
+        self.log_handler.request_profile()
+        self.profile_label.configure(text="Profiling the next fetch or monitoring interval...")
+
+    def save_metrics(self):
+        """Handles the 'Save Metrics' button click."""
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".prom",
+            filetypes=[("Prometheus text", "*.prom"), ("JSON", "*.json")]
+        )
+        if not file_path:
+            return
+        try:
+            METRICS.write(file_path, "json" if file_path.lower().endswith(".json") else "prometheus")
+        except OSError as e:
+            messagebox.showerror("Error", f"Failed to save metrics: {str(e)}")
+
+    def rebuild_cache(self):
+        """Handles the 'Rebuild Cache' button click."""
+        self.logs_label.configure(text="🔄 Rebuilding event cache...")
+        threading.Thread(target=self._rebuild_cache_thread_target, daemon=True).start()
+
+    def _rebuild_cache_thread_target(self):
+        """Target function for the cache rebuild thread."""
+        count = self.log_handler.rebuild_cache()
+        self.after(0, lambda: self.logs_label.configure(text=f"Event cache rebuilt: {count} entries"))
 
     def reset_filters(self):
         """Resets all filter fields and clears the log view."""
-        self.start_date_entry.delete(0, tk.END)
-        self.end_date_entry.delete(0, tk.END)
-        self.filter_entry.delete(0, tk.END)
-        self.log_type.set("All")
-        
-        self.filtered_logs = []
-        self.log_textbox.configure(state="normal")
-        self.log_textbox.delete("1.0", tk.END)
-        self.log_textbox.configure(state="disabled")
+        self.query_entry.delete(0, tk.END)
+
+        # Stop a running query; its pages still on their way are dropped
+        self.log_handler.cancel_query()
+        self._query_generation += 1
+        ui_components.show_query_progress(self, False)
+
+        self.filtered_logs = EventBatch()
+        self.log_table.show_message("")
         
         self.logs_label.configure(text="Filters reset. Click 'Fetch Logs' to reload.")
@@ -0,0 +1,288 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# This file contains the built-in instrumentation: per-stage timers, event
+# counters and gauges (queue depths, monitor lag), plus an opt-in sampling
+# profiler. Everything is recorded into the process-wide METRICS registry,
+# which the status bar, the Diagnostics tab and the CLI read from.
+#
+# Hot loops never take a lock per event. Counters are added once per chunk
+# or per read, and per-record stages time one record in SAMPLE_EVERY and
+# scale the result up, so instrumentation costs around 1%.
+
+SAMPLE_EVERY = 16  # Must be a power of two
+
+# Counters shown in the status bar, in order
+STATUS_COUNTERS = [("events_read", "Read"), ("events_matched", "Matched"), ("events_live", "Live"),
+                   ("events_rendered", "Rendered"), ("events_exported", "Exported")]
+
+
+class _StageTimer:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """Thread-safe registry of counters, gauges and stage timings."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.counters = Counter()
+            self.gauges = {}
+            # name -> [calls, total seconds, max seconds, last seconds]
+            self.stages = {}
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def set_gauge(self, name, value):
+        self.gauges[name] = value  # A single dict store is atomic
+
+    def observe(self, stage, seconds, calls=1):
+        with self._lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                entry = self.stages[stage] = [0, 0.0, 0.0, 0.0]
+            entry[0] += calls
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds / calls if calls else seconds)
+            entry[3] = seconds
+
+    def stage(self, name):
+        """Context manager that times a block as one call of stage 'name'."""
+        return _StageTimer(self, name)
+
+    # --- Reading ---
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "uptime_seconds": round(time.time() - self.started, 3),
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "stages": {name: {"calls": calls, "total_seconds": round(total, 6),
+                                  "max_seconds": round(longest, 6), "last_seconds": round(last, 6)}
+                           for name, (calls, total, longest, last) in self.stages.items()},
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix="seclog"):
+        """The snapshot in the Prometheus text exposition format."""
+        snap = self.snapshot()
+        lines = [f"# TYPE {prefix}_uptime_seconds gauge", f"{prefix}_uptime_seconds {snap['uptime_seconds']}"]
+        for name, value in sorted(snap["counters"].items()):
+            lines += [f"# TYPE {prefix}_{name}_total counter", f"{prefix}_{name}_total {value}"]
+        for name, value in sorted(snap["gauges"].items()):
+            lines += [f"# TYPE {prefix}_{name} gauge", f"{prefix}_{name} {value}"]
+        if snap["stages"]:
+            for metric, key, kind in (("stage_seconds_total", "total_seconds", "counter"),
+                                      ("stage_calls_total", "calls", "counter"),
+                                      ("stage_seconds_max", "max_seconds", "gauge")):
+                lines.append(f"# TYPE {prefix}_{metric} {kind}")
+                for name, stage in sorted(snap["stages"].items()):
+                    lines.append(f'{prefix}_{metric}{{stage="{name}"}} {stage[key]}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, fmt="prometheus"):
+        """Writes the metrics atomically, e.g. for node_exporter's textfile collector."""
+        text = self.to_json() + "\n" if fmt == "json" else self.to_prometheus()
+        if path == "-":
+            sys.stderr.write(text)
+            return
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def status_text(self):
+        """One line for the status bar."""
+        snap = self.snapshot()
+        parts = [f"{label} {snap['counters'].get(name, 0):,}" for name, label in STATUS_COUNTERS]
+        fetch = snap["stages"].get("fetch")
+        if fetch:
+            parts.append(f"Last fetch {fetch['last_seconds']:.2f} s")
+        if "merge_queue_depth" in snap["gauges"]:
+            parts.append(f"Queue {snap['gauges']['merge_queue_depth']}")
+        if "monitor_lag_seconds" in snap["gauges"]:
+            parts.append(f"Monitor lag {snap['gauges']['monitor_lag_seconds']:.1f} s")
+        return "  |  ".join(parts)
+
+    def report(self):
+        """Multi-line plain-text report for the Diagnostics tab."""
+        snap = self.snapshot()
+        lines = [f"Uptime: {snap['uptime_seconds']:.0f} s", "", "Stage                 calls     total s    mean ms     max ms"]
+        for name, stage in sorted(snap["stages"].items(), key=lambda item: -item[1]["total_seconds"]):
+            mean_ms = stage["total_seconds"] / stage["calls"] * 1000 if stage["calls"] else 0
+            lines.append(f"{name:<20} {stage['calls']:>7} {stage['total_seconds']:>11.3f} "
+                         f"{mean_ms:>10.3f} {stage['max_seconds'] * 1000:>10.3f}")
+        lines += ["", "Counters"]
+        lines += [f"  {name:<28} {value:>12,}" for name, value in sorted(snap["counters"].items())]
+        lines += ["", "Gauges"]
+        lines += [f"  {name:<28} {value:>12}" for name, value in sorted(snap["gauges"].items())]
+        return "\n".join(lines)
+
+
+METRICS = Metrics()
+
+
+def timed_map(func, items, read_stage, func_stage, counter=None, metrics=METRICS):
+    """
+    Yields func(item) for each item, charging the time spent producing items
+    to read_stage and the time spent in func to func_stage. The first
+    SAMPLE_EVERY items, which carry one-off costs such as opening the file,
+    are timed exactly; after that one item in SAMPLE_EVERY is timed and the
+    rest is extrapolated.
+    """
+    clock = time.perf_counter
+    mask = SAMPLE_EVERY - 1
+    iterator = iter(items)
+    count = samples = 0
+    exact = [0.0, 0.0]
+    sampled = [0.0, 0.0]
+    try:
+        while True:
+            if count & mask and count >= SAMPLE_EVERY:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                result = func(item)
+            else:
+                start = clock()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                middle = clock()
+                result = func(item)
+                totals = exact if count < SAMPLE_EVERY else sampled
+                totals[0] += middle - start
+                totals[1] += clock() - middle
+                samples += count >= SAMPLE_EVERY
+            count += 1
+            yield result
+    finally:
+        if count:
+            scale = (count - SAMPLE_EVERY) / samples if samples else 0
+            metrics.observe(read_stage, exact[0] + sampled[0] * scale, count)
+            metrics.observe(func_stage, exact[1] + sampled[1] * scale, count)
+            if counter:
+                metrics.inc(counter, count)
+
+
+def timed_filter(predicate, items, stage, counter=None, metrics=METRICS):
+    """
+    Yields the items for which predicate(item) is true, timing the first
+    SAMPLE_EVERY calls and then one call in SAMPLE_EVERY.
+    """
+    clock = time.perf_counter
+    mask = SAMPLE_EVERY - 1
+    count = kept = samples = 0
+    exact = sampled = 0.0
+    try:
+        for item in items:
+            if count & mask and count >= SAMPLE_EVERY:
+                ok = predicate(item)
+            else:
+                start = clock()
+                ok = predicate(item)
+                if count < SAMPLE_EVERY:
+                    exact += clock() - start
+                else:
+                    sampled += clock() - start
+                    samples += 1
+            count += 1
+            if ok:
+                kept += 1
+                yield item
+    finally:
+        if count:
+            scale = (count - SAMPLE_EVERY) / samples if samples else 0
+            metrics.observe(stage, exact + sampled * scale, count)
+            if counter:
+                metrics.inc(counter, kept)
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every other thread every 'interval' seconds and
+    aggregates them as collapsed stacks ("thread;outer;...;inner count"),
+    the input format of flamegraph.pl, speedscope and inferno.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="seclog-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                stack.reverse()
+                self.stacks[";".join(s.replace(";", ":") for s in stack)] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def dump(self, path):
+        """Writes the collapsed stacks to 'path' and returns the path."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+        return path
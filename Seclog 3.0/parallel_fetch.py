@@ -0,0 +1,159 @@
+import heapq
+import os
+import queue
+import sys
+import threading
+
+from event_sources import JsonlFileSource
+from metrics import METRICS
+from query import filter_records
+
+# This file contains the concurrent reader used when several channels (or
+# chunks of one large file) are fetched at once. Every job produces a stream
+# sorted newest first; the streams are merged by timestamp with a k-way heap
+# merge, so callers see one chronologically ordered stream as it arrives.
+
+CHUNK_SIZE = 512  # Items handed from a worker to the merge at a time
+CANCEL_CHECK_INTERVAL = 1024  # Records read between checks of a cancellation token
+_DONE = object()
+
+
+def read_channel(log_type, source, start_dt, end_dt, event_ids=None, condition=None, cancel=None):
+    """
+    Job: yields (log_type, record) pairs from one source, newest first.
+    'event_ids' is passed on to the source as a hint; if 'condition' (a
+    query predicate tree) is given, only records that satisfy it are kept.
+    Reading stops early once 'cancel' (a threading.Event) is set.
+    """
+    try:
+        records = source.read(start_dt, end_dt, event_ids)
+        if cancel is not None:
+            records = until_cancelled(records, cancel)
+        if source.order != "desc":
+            # The merge needs newest-first streams
+            records = sorted(records, key=lambda r: r["TimeGenerated"], reverse=True)
+        if condition is not None:
+            records = filter_records(log_type, records, condition)
+        for record in records:
+            yield log_type, record
+    except Exception as e:
+        print(f"Error reading {log_type} log: {e}", file=sys.stderr)
+
+
+def until_cancelled(items, cancel):
+    """Yields from 'items' until 'cancel' is set, checking it every CANCEL_CHECK_INTERVAL items."""
+    for count, item in enumerate(items):
+        if count % CANCEL_CHECK_INTERVAL == 0 and cancel.is_set():
+            return
+        yield item
+
+
+def collect(job, args):
+    """Runs a job to completion; used for process pools, which cannot stream generators."""
+    return list(job(*args))
+
+
+def split_source(source, chunk_bytes):
+    """
+    Splits a large JSONL file into byte ranges that can be read concurrently.
+    Other sources are returned whole.
+    """
+    if not isinstance(source, JsonlFileSource) or source.byte_range is not None:
+        return [source]
+    size = os.path.getsize(source.path)
+    if size <= chunk_bytes:
+        return [source]
+    return [JsonlFileSource(source.path, source.channel, source.order, byte_range=(start, min(size, start + chunk_bytes)))
+            for start in range(0, size, chunk_bytes)]
+
+
+def _put(out_queue, item, cancel):
+    """Blocking put that gives up once the consumer has gone away."""
+    while not cancel.is_set():
+        try:
+            out_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            METRICS.inc("merge_queue_full")  # The consumer is the bottleneck
+            continue
+    return False
+
+
+def _produce(streams, out_queue, cancel):
+    """Worker: merges its share of the streams and feeds the result to the consumer in chunks."""
+    try:
+        iterable = streams[0] if len(streams) == 1 else heapq.merge(*streams, key=_time_key, reverse=True)
+        chunk = []
+        for item in iterable:
+            chunk.append(item)
+            if len(chunk) >= CHUNK_SIZE:
+                if not _put(out_queue, chunk, cancel):
+                    return
+                chunk = []
+        if chunk:
+            _put(out_queue, chunk, cancel)
+    except Exception as e:
+        print(f"Error in parallel reader: {e}", file=sys.stderr)
+    finally:
+        _put(out_queue, _DONE, cancel)
+
+
+def _consume(out_queue, queues):
+    while True:
+        chunk = out_queue.get()
+        if chunk is _DONE:
+            return
+        METRICS.set_gauge("merge_queue_depth", sum(q.qsize() for q in queues))
+        yield from chunk
+
+
+def _future_items(future):
+    try:
+        yield from future.result()
+    except Exception as e:
+        print(f"Error in parallel reader: {e}", file=sys.stderr)
+
+
+def _time_key(item):
+    return item[1]["TimeGenerated"]
+
+
+def merge_jobs(jobs, max_workers=None, use_processes=False, queue_size=8):
+    """
+    Runs jobs concurrently and yields their items merged newest first.
+
+    'jobs' is a list of (function, args) pairs; each function must yield
+    (log_type, record) pairs sorted newest first. With more jobs than
+    workers, each worker pre-merges a group of jobs, so a bounded number of
+    threads never deadlocks on the bounded queues.
+    """
+    if not jobs:
+        return
+    workers = max(1, min(max_workers or len(jobs), len(jobs)))
+
+    if use_processes:
+        from concurrent.futures import ProcessPoolExecutor  # Slow to import; rarely used
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(collect, job, args) for job, args in jobs]
+            yield from heapq.merge(*(_future_items(f) for f in futures), key=_time_key, reverse=True)
+        return
+
+    if len(jobs) == 1:
+        job, args = jobs[0]
+        yield from job(*args)
+        return
+
+    cancel = threading.Event()
+    groups = [[] for _ in range(workers)]
+    for i, (job, args) in enumerate(jobs):
+        groups[i % workers].append(job(*args))
+    queues = [queue.Queue(maxsize=queue_size) for _ in groups]
+    threads = [threading.Thread(target=_produce, args=(group, q, cancel), daemon=True)
+               for group, q in zip(groups, queues)]
+    for thread in threads:
+        thread.start()
+    try:
+        yield from heapq.merge(*(_consume(q, queues) for q in queues), key=_time_key, reverse=True)
+    finally:
+        # Unblocks the workers if the consumer stopped early
+        cancel.set()
@@ -0,0 +1,608 @@
+import re
+from datetime import datetime, timedelta
+from itertools import compress, islice
+
+from event_batch import EPOCH, EventBatch, to_epoch
+from keyword_query import MIN_INDEXED_TERM, KeywordQuery
+from metrics import METRICS
+from templates import plain_contains, plain_lower
+
+# This file contains the query language used by the sidebar's query box and
+# the CLI's --query option. A query is parsed once into a predicate tree:
+#
+#   EventID in (4624, 4625) and Source = "Microsoft-Windows-Security-Auditing"
+#   Channel = Security and time > now-2h and Message ~ "admin"
+#   Host in (web01, web02) and EventID = 4625
+#   not Type in (4, 8) or (Category = 12544 and Message !~ svchost)
+#   "failed logon" administrator      -> bare words and phrases, as in Keyword
+#
+# Operators: = != < <= > >= on EventID, Type, Category and Time; = != ~
+# (contains) !~ on Source, Channel, Host and Message; "in (...)" and "not in (...)"
+# on everything but Time. Text comparisons are case-insensitive. Times are
+# now, now-2h (s/m/h/d/w), today, yesterday or "YYYY-MM-DD[ HH:MM[:SS]]".
+# Terms are joined by "and" (implied between adjacent terms), "or" and
+# "not", with parentheses for grouping.
+#
+# Running a query is split in two. QueryPlan pulls the selective conjuncts
+# (channel, time range, EventID, SourceName and host sets, keywords) out of the
+# tree so the readers and the event store only produce candidate rows. The
+# remaining predicates are compiled into one generated function per query
+# that checks every condition in a single pass over an EventBatch's columns,
+# with SourceName and channel conditions resolved against the batch
+# dictionaries first. No record dicts are built for rows that get dropped.
+
+FIELDS = {
+    "eventid": "EventID", "id": "EventID",
+    "type": "EventType", "eventtype": "EventType", "level": "EventType",
+    "category": "Category",
+    "source": "SourceName", "sourcename": "SourceName", "provider": "SourceName",
+    "channel": "LogType", "logtype": "LogType", "log": "LogType",
+    "message": "Message", "msg": "Message",
+    "time": "TimeGenerated", "timegenerated": "TimeGenerated",
+    "host": "Host", "hostname": "Host", "computer": "Host",
+}
+NUMERIC_FIELDS = {"EventID", "EventType", "Category"}
+TEXT_FIELDS = {"SourceName", "LogType", "Message", "Host"}
+
+_OPERATORS = {
+    "number": {"=", "!=", "<", "<=", ">", ">=", "in"},
+    "text": {"=", "!=", "~", "!~", "in"},
+    "time": {"=", "!=", "<", "<=", ">", ">="},
+}
+_KEYWORDS = {"and", "or", "not", "in"}
+
+_TOKEN_RE = re.compile(r'\s*(?:"((?:[^"\\]|\\.)*)"|(!=|<=|>=|!~|[=<>~(),])|([^\s"=!<>~(),]+))')
+_RELATIVE_RE = re.compile(r"now(?:([+-])(\d+)([smhdw]))?$")
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+_TIME_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d")
+
+# Column each field is read from, and the loop variable used in generated code
+_COLUMNS = {"TimeGenerated": ("times", "t"), "EventID": ("event_ids", "e"), "EventType": ("event_types", "y"),
+            "Category": ("categories", "g"), "SourceName": ("sources", "s"), "LogType": ("channels", "c"),
+            "Message": ("messages", "m"), "Host": ("hosts", "h"), "Template": ("template_ids", "k")}
+_DICTIONARIES = {"SourceName": "source_names", "LogType": "channel_names", "Host": "host_names"}
+_PYTHON_OPS = {"=": "==", "!=": "!=", "<": "<", "<=": "<=", ">": ">", ">=": ">="}
+
+
+class QueryError(ValueError):
+    """Raised for a query that does not parse; the message points at the problem."""
+
+
+# --- Predicate tree ---
+
+class Compare:
+    """'field op value'; value is an int, epoch seconds, a lower-case str or a frozenset."""
+    def __init__(self, field, op, value):
+        self.field = field
+        self.op = op
+        self.value = value
+
+    def __repr__(self):
+        return f"Compare({self.field!r}, {self.op!r}, {self.value!r})"
+
+
+class Term:
+    """A bare word or phrase, matched like a keyword against Message, SourceName and EventID."""
+    def __init__(self, text):
+        self.text = text
+
+    def __repr__(self):
+        return f"Term({self.text!r})"
+
+
+class And:
+    def __init__(self, children):
+        self.children = children
+
+    def __repr__(self):
+        return f"And({self.children!r})"
+
+
+class Or:
+    def __init__(self, children):
+        self.children = children
+
+    def __repr__(self):
+        return f"Or({self.children!r})"
+
+
+class Not:
+    def __init__(self, child):
+        self.child = child
+
+    def __repr__(self):
+        return f"Not({self.child!r})"
+
+
+def _keyword_terms(node):
+    """The keyword terms of a Term, 'Message ~ x' or an and of those; None for anything else."""
+    if isinstance(node, Term):
+        return [node.text]
+    if isinstance(node, Compare):
+        return [node.value] if node.field == "Message" and node.op == "~" else None
+    if isinstance(node, And):
+        terms = [_keyword_terms(child) for child in node.children]
+        return None if None in terms else [term for group in terms for term in group]
+    return None
+
+
+def _only_terms(node):
+    if isinstance(node, (And, Or)):
+        return all(_only_terms(child) for child in node.children)
+    return isinstance(node, Term)
+
+
+def _conjuncts(node):
+    if node is None:
+        return []
+    return list(node.children) if isinstance(node, And) else [node]
+
+
+def _join(nodes):
+    if not nodes:
+        return None
+    return nodes[0] if len(nodes) == 1 else And(nodes)
+
+
+# --- Parsing ---
+
+def parse_time(text, now=None):
+    """A time value from a query ('now-2h', 'today', '2024-01-01 12:00') -> datetime."""
+    now = now or datetime.now().replace(microsecond=0)
+    lower = text.lower()
+    match = _RELATIVE_RE.match(lower)
+    if match:
+        sign, amount, unit = match.groups()
+        if not sign:
+            return now
+        delta = timedelta(seconds=int(amount) * _UNITS[unit])
+        return now - delta if sign == "-" else now + delta
+    if lower in ("today", "yesterday"):
+        midnight = now.replace(hour=0, minute=0, second=0)
+        return midnight if lower == "today" else midnight - timedelta(days=1)
+    for fmt in _TIME_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    raise QueryError(f"'{text}' is not a time; use now-2h, today or YYYY-MM-DD [HH:MM:SS]")
+
+
+class _Parser:
+    def __init__(self, text, now):
+        self.text = text
+        self.now = now
+        self.tokens = self._tokenize(text)
+        self.pos = 0
+
+    @staticmethod
+    def _tokenize(text):
+        """-> list of (kind, value, offset); kind is 'string', 'op' or 'word'."""
+        tokens = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            match = _TOKEN_RE.match(text, pos)
+            if not match or match.end() == pos:
+                raise QueryError(f"unexpected character at position {pos + 1}: {text[pos:pos + 10]!r}")
+            string, op, word = match.groups()
+            offset = match.start(match.lastindex)
+            if string is not None:
+                tokens.append(("string", re.sub(r"\\(.)", r"\1", string), offset))
+            elif op is not None:
+                tokens.append(("op", op, offset))
+            else:
+                tokens.append(("word", word, offset))
+            pos = match.end()
+        return tokens
+
+    def peek(self, offset=0):
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None, len(self.text))
+
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def is_keyword(self, word, offset=0):
+        kind, value, _ = self.peek(offset)
+        return kind == "word" and value.lower() == word
+
+    def error(self, message, token=None):
+        kind, value, offset = token or self.peek()
+        where = f"at position {offset + 1}" if kind is not None else "at the end of the query"
+        return QueryError(f"{message} {where}")
+
+    def expect_op(self, op):
+        kind, value, _ = self.peek()
+        if kind != "op" or value != op:
+            raise self.error(f"expected '{op}'")
+        self.next()
+
+    def parse(self):
+        if not self.tokens:
+            return None
+        node = self.parse_or()
+        if self.peek()[0] is not None:
+            raise self.error("unexpected " + repr(self.peek()[1]))
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.is_keyword("or"):
+            self.next()
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else Or(children)
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        while True:
+            if self.is_keyword("and"):
+                self.next()
+            elif not self.starts_term():
+                break
+            children.append(self.parse_not())
+        return children[0] if len(children) == 1 else And(children)
+
+    def starts_term(self):
+        kind, value, _ = self.peek()
+        if kind == "string" or (kind == "op" and value == "("):
+            return True
+        return kind == "word" and value.lower() not in ("and", "or", "in")
+
+    def parse_not(self):
+        if self.is_keyword("not"):
+            self.next()
+            return Not(self.parse_not())
+        return self.parse_primary()
+
+    def parse_primary(self):
+        token = self.next()
+        kind, value, _ = token
+        if kind == "op" and value == "(":
+            node = self.parse_or()
+            self.expect_op(")")
+            return node
+        if kind == "string":
+            return Term(value.lower())
+        if kind != "word" or value.lower() in _KEYWORDS:
+            raise self.error("expected a condition", token)
+        following = self.peek()
+        negated_in = self.is_keyword("not") and self.is_keyword("in", 1)
+        if (following[0] == "op" and following[1] not in "(),") or self.is_keyword("in") or negated_in:
+            return self.parse_comparison(token)
+        return Term(value.lower())
+
+    def parse_comparison(self, field_token):
+        field = FIELDS.get(field_token[1].lower())
+        if field is None:
+            raise self.error(f"unknown field '{field_token[1]}' (fields: {', '.join(sorted(set(FIELDS.values())))})",
+                             field_token)
+        kind = "number" if field in NUMERIC_FIELDS else "text" if field in TEXT_FIELDS else "time"
+        negate = self.is_keyword("not")
+        if negate:
+            self.next()
+        op_token = self.next()
+        if op_token[0] is None:
+            raise self.error(f"expected an operator after {field_token[1]}", op_token)
+        op = op_token[1].lower()
+        if negate and op != "in":
+            raise self.error("expected 'in' after 'not'", op_token)
+        if op not in _OPERATORS[kind]:
+            raise self.error(f"'{op_token[1]}' cannot be used with {field_token[1]}", op_token)
+        if op == "in":
+            self.expect_op("(")
+            values = [self.parse_value(field_token[1], kind)]
+            while self.peek()[:2] == ("op", ","):
+                self.next()
+                values.append(self.parse_value(field_token[1], kind))
+            self.expect_op(")")
+            node = Compare(field, "in", frozenset(values))
+        else:
+            node = Compare(field, op, self.parse_value(field_token[1], kind))
+        return Not(node) if negate else node
+
+    def parse_value(self, field, kind):
+        """Parses one value; 'field' is the field name as typed, for messages."""
+        token = self.next()
+        token_kind, value, _ = token
+        if token_kind not in ("string", "word"):
+            raise self.error(f"expected a value for {field}", token)
+        if kind == "number":
+            try:
+                return int(value)
+            except ValueError:
+                raise self.error(f"{field} needs a number, not '{value}',", token)
+        if kind == "time":
+            return to_epoch(parse_time(value, self.now))
+        return value.lower()
+
+
+# --- Compilation ---
+
+def _message_lower(batch):
+    """Constant maker: (template id, message) -> lower-case text, for the batch's templates."""
+    return plain_lower if batch.templates is None else batch.templates.lower
+
+
+def _message_contains(term):
+    """Constant maker: (template id, message) -> whether it contains 'term', matched against templates first."""
+    def make(batch):
+        if batch.templates is None:
+            return plain_contains(term)
+        return batch.templates.contains(term)
+    return make
+
+
+def _codes(names_attr, test):
+    """Constant maker: the dictionary codes of a batch whose (lower-case) name passes 'test'."""
+    def make(batch):
+        return frozenset(code for code, name in enumerate(getattr(batch, names_attr)) if test(name.lower()))
+    return make
+
+
+def _cost(node):
+    """Rough relative cost per row, used to order the operands of and/or."""
+    if isinstance(node, (And, Or)):
+        return sum(_cost(child) for child in node.children)
+    if isinstance(node, Not):
+        return _cost(node.child)
+    if isinstance(node, Term) or node.field == "Message":
+        return 10
+    return 1
+
+
+class _Compiler:
+    """Turns a predicate tree into the source of one generator expression."""
+    def __init__(self):
+        self.constants = []  # Functions batch -> value, evaluated once per batch
+        self.columns = []
+
+    def constant(self, make):
+        self.constants.append(make)
+        return f"K{len(self.constants) - 1}"
+
+    def static(self, value):
+        return self.constant(lambda batch: value)
+
+    def column(self, field):
+        if field not in self.columns:
+            self.columns.append(field)
+        return _COLUMNS[field][1]
+
+    def message(self):
+        """The arguments for an encoded message: its template id and inserts."""
+        return f"{self.column('Template')}, {self.column('Message')}"
+
+    def emit(self, node):
+        if isinstance(node, (And, Or)):
+            joiner = " and " if isinstance(node, And) else " or "
+            return "(" + joiner.join(self.emit(child) for child in sorted(node.children, key=_cost)) + ")"
+        if isinstance(node, Not):
+            return f"(not {self.emit(node.child)})"
+        if isinstance(node, Term):
+            term = node.text
+            source = self.constant(_codes("source_names", lambda name: term in name))
+            event_id = self.constant(lambda batch: frozenset(
+                eid for eid in set(batch.event_ids) if term in str(eid)))
+            contains = self.constant(_message_contains(term))
+            return (f"({self.column('SourceName')} in {source} or {self.column('EventID')} in {event_id} "
+                    f"or {contains}({self.message()}))")
+        return self.emit_compare(node)
+
+    def emit_compare(self, node):
+        field, op, value = node.field, node.op, node.value
+        var = self.column(field)
+        if field in _DICTIONARIES:
+            # Resolved against the batch dictionary, so each row is one set lookup
+            if op in ("=", "!=", "in"):
+                wanted = value if op == "in" else {value}
+                codes = self.constant(_codes(_DICTIONARIES[field], wanted.__contains__))
+            else:
+                codes = self.constant(_codes(_DICTIONARIES[field], lambda name: value in name))
+            return f"{var} {'not in' if op in ('!=', '!~') else 'in'} {codes}"
+        if field == "Message":
+            if op in ("~", "!~"):
+                contains = self.constant(_message_contains(value))
+                return f"{'not ' if op == '!~' else ''}{contains}({self.message()})"
+            text = f"{self.constant(_message_lower)}({self.message()})"
+            if op == "in":
+                return f"{text} in {self.static(value)}"
+            return f"{text} {_PYTHON_OPS[op]} {self.static(value)}"
+        if op == "in":
+            return f"{var} in {self.static(value)}"
+        return f"{var} {_PYTHON_OPS[op]} {self.static(value)}"
+
+    def build(self, node):
+        """Returns a function batch -> bytearray mask."""
+        expr = self.emit(node)
+        columns = ", ".join(f"batch.{_COLUMNS[field][0]}" for field in self.columns)
+        names = ", ".join(_COLUMNS[field][1] for field in self.columns)
+        loop = f"for {names} in batch.{_COLUMNS[self.columns[0]][0]}" if len(self.columns) == 1 \
+            else f"for {names} in zip({columns})"
+        constants = ", ".join(f"K{i}" for i in range(len(self.constants)))
+        source = (f"def fused(batch, constants):\n"
+                  f"    {constants}, = constants\n"
+                  f"    return bytearray({expr} {loop})\n")
+        namespace = {}
+        exec(compile(source, "<query>", "exec"), namespace)
+        fused = namespace["fused"]
+        makers = self.constants
+
+        def mask(batch):
+            return fused(batch, [make(batch) for make in makers])
+        mask.source = source
+        return mask
+
+
+def compile_filter(node):
+    """Compiles a predicate tree into a function EventBatch -> bytearray mask."""
+    return _Compiler().build(node)
+
+
+def filter_records(log_type, records, condition, batch_size=512):
+    """
+    Yields the records of one channel that satisfy 'condition' (a predicate
+    tree), evaluated a batch at a time. Used by the readers, so that only
+    matching records are handed on to the merge.
+    """
+    mask = compile_filter(condition)
+    iterator = iter(records)
+    while True:
+        chunk = list(islice(iterator, batch_size))
+        if not chunk:
+            return
+        with METRICS.stage("filter"):
+            keep = mask(EventBatch.from_records((log_type, record) for record in chunk))
+        yield from compress(chunk, keep)
+
+
+# --- Plans ---
+
+class QueryPlan:
+    """
+    How a Query runs against a set of channels: what can be pushed down to
+    the readers and the store, and the fused filter for the rest.
+
+    log_types, start_dt and end_dt are exact. event_ids, source_names and
+    host_names (sets, or None for no restriction) and keyword (a KeywordQuery for the
+    trigram index, or None) narrow the candidates; the predicates they came
+    from stay in the residual filter, which is cheap on the survivors. With
+    'indexed' set the plan is for the event store, which matches bare terms
+    exactly, so those are left out of the residual filter.
+    """
+    def __init__(self, query, channels, indexed=False):
+        self.log_types = list(channels)
+        self.start_dt = None
+        self.end_dt = None
+        self.event_ids = None
+        self.source_names = None
+        self.host_names = None
+        self.keyword = None
+        residual = []
+        start = end = None
+        and_terms = []
+        and_nodes = []
+        or_groups = None
+        or_node = None
+        for node in _conjuncts(query.tree):
+            if isinstance(node, Compare) and node.field == "LogType":
+                self.log_types = [name for name in self.log_types if self._channel_matches(node, name.lower())]
+                continue
+            residual.append(node)
+            if isinstance(node, Compare):
+                if node.field == "TimeGenerated" and node.op != "!=":
+                    if node.op in (">", ">=", "="):
+                        start = node.value if start is None else max(start, node.value)
+                    if node.op in ("<", "<=", "="):
+                        end = node.value if end is None else min(end, node.value)
+                    if node.op != "=" and len(node.op) == 2:
+                        residual.pop()  # Inclusive bounds are exact once pushed down
+                elif node.field == "EventID" and node.op in ("=", "in"):
+                    values = node.value if node.op == "in" else {node.value}
+                    self.event_ids = frozenset(values) if self.event_ids is None else self.event_ids & values
+                elif node.field == "SourceName" and node.op in ("=", "in"):
+                    values = node.value if node.op == "in" else {node.value}
+                    self.source_names = frozenset(values) if self.source_names is None else self.source_names & values
+                elif node.field == "Host" and node.op in ("=", "in"):
+                    values = node.value if node.op == "in" else {node.value}
+                    self.host_names = frozenset(values) if self.host_names is None else self.host_names & values
+            terms = _keyword_terms(node)
+            if terms is not None:
+                and_terms.extend(terms)
+                and_nodes.append(node)
+            elif isinstance(node, Or) and or_groups is None:
+                groups = [_keyword_terms(child) for child in node.children]
+                if None not in groups:
+                    or_groups = groups
+                    or_node = node
+
+        if start is not None:
+            self.start_dt = EPOCH + timedelta(seconds=start)
+        if end is not None:
+            self.end_dt = EPOCH + timedelta(seconds=end)
+        if (start is not None and end is not None and start > end) \
+                or frozenset() in (self.event_ids, self.source_names, self.host_names):
+            self.log_types = []  # Contradictory conditions; nothing can match
+        self.keyword, or_served = self._keyword(and_terms, or_groups)
+        if indexed and self.keyword is not None:
+            served = and_nodes + ([or_node] if or_served else [])
+            residual = [node for node in residual if not (node in served and _only_terms(node))]
+        self.residual = _join(residual)
+        self.filter_mask = compile_filter(self.residual) if self.residual is not None else None
+
+    @staticmethod
+    def _channel_matches(node, name):
+        if node.op == "in":
+            return name in node.value
+        if node.op in ("=", "!="):
+            return (name == node.value) == (node.op == "=")
+        return (node.value in name) == (node.op == "~")
+
+    @staticmethod
+    def _keyword(and_terms, or_groups):
+        """
+        The keyword conditions as a KeywordQuery the store can answer from
+        its trigram index (or None), and whether the or-conjunct is part of
+        it. 'a and (b or c)' becomes the groups [a, b] and [a, c]; if some
+        term is too short for the index, only the top-level terms are used.
+        """
+        candidates = [([and_terms], False)]
+        if or_groups:
+            candidates.insert(0, ([and_terms + group for group in or_groups], True))
+        for groups, uses_or in candidates:
+            if groups[0] and all(len(term) >= MIN_INDEXED_TERM for group in groups for term in group):
+                keyword = KeywordQuery("")
+                keyword.groups = groups
+                return keyword, uses_or
+        return None, False
+
+    def apply(self, batch):
+        """Returns the rows of 'batch' that satisfy the residual predicates."""
+        if self.filter_mask is None or not len(batch):
+            return batch
+        with METRICS.stage("filter"):
+            return batch.filter(self.filter_mask(batch))
+
+
+class Query:
+    """A parsed query. 'tree' is None for the empty query, which matches everything."""
+    def __init__(self, tree=None, text=""):
+        self.tree = tree
+        self.text = text
+
+    @classmethod
+    def parse(cls, text, now=None):
+        """Parses query text; raises QueryError (a ValueError) with the position of any error."""
+        return cls(_Parser(text or "", now).parse(), text or "")
+
+    @classmethod
+    def from_filters(cls, log_types=None, start_dt=None, end_dt=None, keyword="", hosts=None):
+        """The query equivalent of the classic channel / date range / keyword filters."""
+        nodes = []
+        if log_types is not None:
+            nodes.append(Compare("LogType", "in", frozenset(name.lower() for name in log_types)))
+        if hosts is not None:
+            nodes.append(Compare("Host", "in", frozenset(name.lower() for name in hosts)))
+        if start_dt:
+            nodes.append(Compare("TimeGenerated", ">=", to_epoch(start_dt)))
+        if end_dt:
+            nodes.append(Compare("TimeGenerated", "<=", to_epoch(end_dt)))
+        groups = [_join([Term(term) for term in group]) for group in KeywordQuery(keyword).groups]
+        if groups:
+            nodes.append(groups[0] if len(groups) == 1 else Or(groups))
+        return cls(_join(nodes))
+
+    def __and__(self, other):
+        text = " and ".join(f"({q.text})" for q in (self, other) if q.text)
+        return Query(_join(_conjuncts(self.tree) + _conjuncts(other.tree)), text)
+
+    def __bool__(self):
+        return self.tree is not None
+
+    def plan(self, channels, indexed=False):
+        return QueryPlan(self, channels, indexed)
+
+    def __repr__(self):
+        return f"Query({self.tree!r})"
@@ -0,0 +1,120 @@
+import queue
+import sys
+import threading
+import time
+
+from event_batch import EventBatch
+from metrics import METRICS
+
+# This file contains the background query jobs behind the app's "Fetch Logs".
+# A job hands its results to the UI in pages while it runs, and a single
+# scheduler thread runs the jobs one at a time: submitting a query cancels
+# the one before it, whose readers notice the cancellation token and stop,
+# so repeated clicks never stack up scans competing with the Tk main loop.
+
+PAGE_INTERVAL = 0.3  # Seconds between pages after the first
+
+
+class QueryJob:
+    """
+    One background run of a Query through a LogHandler.
+
+    page_callback(page, matched) is called with each new EventBatch of
+    results, following on from the previous pages (newest first), and the
+    number of events matched so far; the first page is sent as soon as
+    there is one, later ones at most every 'page_interval' seconds.
+    done_callback(logs, counts, alerts, error, cancelled) is called once at
+    the end; after a cancel, logs holds whatever was found so far and
+    there are no alerts. Both are called from the worker thread.
+    """
+    def __init__(self, handler, query, page_callback=None, done_callback=None, page_interval=PAGE_INTERVAL):
+        self.handler = handler
+        self.query = query
+        self.page_callback = page_callback
+        self.done_callback = done_callback
+        self.page_interval = page_interval
+        self.matched = 0
+        self._cancel = threading.Event()
+        self._pending = []
+        self._started = None
+        self._last_page = None
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def run(self):
+        logs, counts, alerts, error = None, None, [], None
+        if not self._cancel.is_set():  # Superseded before it got to run
+            self._started = time.perf_counter()
+            try:
+                logs, counts = self.handler.query_logs(self.query, self._cancel, self._add_batch)
+                if not self._cancel.is_set():
+                    self._send_page()
+                    alerts = self.handler.detect(logs)
+            except Exception as e:
+                error = e
+        if self._cancel.is_set():
+            METRICS.inc("queries_cancelled")
+        if self.done_callback:
+            self.done_callback(logs, counts, alerts, error, self._cancel.is_set())
+
+    def _add_batch(self, batch):
+        self.matched += len(batch)
+        self._pending.append(batch)
+        now = time.perf_counter()
+        if self._last_page is None:
+            METRICS.observe("query_first_page", now - self._started)
+        if self._last_page is None or now - self._last_page >= self.page_interval:
+            self._send_page()
+            self._last_page = now
+
+    def _send_page(self):
+        pending, self._pending = self._pending, []
+        if pending and self.page_callback and not self._cancel.is_set():
+            # A copy: the page belongs to the receiver, which may append to it
+            self.page_callback(EventBatch.concat(pending), self.matched)
+
+
+class QueryScheduler:
+    """
+    Runs QueryJobs one at a time on a single daemon thread and keeps track
+    of the current one. Submitting a job cancels the current job (and any
+    still queued), so only the newest query runs to the end.
+    """
+    def __init__(self):
+        self.active = None
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, job):
+        with self._lock:
+            if self.active is not None:
+                self.active.cancel()
+            self.active = job
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="query-jobs", daemon=True)
+                self._thread.start()
+        self._jobs.put(job)
+        return job
+
+    def cancel(self):
+        """Cancels the current job, if any."""
+        with self._lock:
+            if self.active is not None:
+                self.active.cancel()
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            try:
+                job.run()
+            except Exception as e:
+                print(f"Error in query job: {e}", file=sys.stderr)
+            with self._lock:
+                if self.active is job:
+                    self.active = None
@@ -0,0 +1,354 @@
+import json
+import os
+import re
+import sys
+from collections import deque
+
+from event_batch import to_epoch, to_int
+from metrics import METRICS
+from tailing import DEFAULT_STATE_DIR
+
+# This file contains the detection-rule engine. Rules are declared as JSON
+# (or YAML) and compiled into one dispatch table keyed by EventID, so events
+# that no rule cares about cost a single dict lookup. Rules with a threshold
+# keep a deque of timestamps per group; each event appends once and expires
+# old entries from the front, so the work per event is O(1) amortised and
+# history is never re-scanned.
+#
+# A rule:
+#   {
+#     "id": "brute-force",                 unique name
+#     "title": "Possible brute force",     shown in alerts
+#     "severity": "high",                  low / medium / high / critical
+#     "event_ids": [4625],                 omit to look at every event
+#     "channels": ["Security"],            optional
+#     "match": {                           optional, all must hold
+#       "SourceName": "Service Control Manager",     equals (case-insensitive)
+#       "Message": {"contains": "powershell"}        or {"regex": ...} / {"in": [...]}
+#     },
+#     "group_by": {"field": "Message", "regex": "(\\d+\\.\\d+\\.\\d+\\.\\d+)"},
+#     "threshold": 20,                     events per group needed to alert
+#     "window": "5m"                       seconds, or a number with s/m/h/d
+#   }
+#
+# Events must be fed oldest first; LogHandler.detect reverses fetched batches.
+
+RULE_FIELDS = ("TimeGenerated", "SourceName", "EventID", "EventType", "Category", "Message", "LogType")
+SEVERITIES = ("low", "medium", "high", "critical")
+DEFAULT_RULES_PATHS = [os.path.join(DEFAULT_STATE_DIR, name) for name in ("rules.json", "rules.yaml", "rules.yml")]
+SWEEP_EVERY = 65536  # Events between sweeps of idle groups
+
+DEFAULT_RULES = [
+    {
+        "id": "brute-force-logon",
+        "title": "Possible brute force: repeated failed logons from one address",
+        "severity": "high",
+        "event_ids": [4625],
+        "channels": ["Security"],
+        # The last IPv4 address in the message is the caller's network address
+        "group_by": {"field": "Message", "regex": r".*\b(\d{1,3}(?:\.\d{1,3}){3})\b"},
+        "threshold": 20,
+        "window": "5m",
+    },
+    {
+        "id": "audit-log-cleared",
+        "title": "Security audit log was cleared",
+        "severity": "critical",
+        "event_ids": [1102],
+    },
+    {
+        "id": "service-installed",
+        "title": "A new service was installed",
+        "severity": "medium",
+        "event_ids": [7045],
+        "channels": ["System"],
+    },
+]
+
+_DURATION_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*$")
+_DURATION_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(value):
+    """'90', '30s', '5m', '1h', '2d' or a number -> seconds."""
+    if isinstance(value, (int, float)):
+        return value
+    match = _DURATION_RE.match(str(value))
+    if not match:
+        raise ValueError(f"invalid duration {value!r}")
+    return float(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+
+def _compile_condition(field, condition):
+    """Builds a predicate over the field's string value."""
+    if isinstance(condition, dict):
+        if len(condition) != 1:
+            raise ValueError(f"condition on {field} must have exactly one operator")
+        (op, operand), = condition.items()
+        if op == "contains":
+            needle = str(operand).lower()
+            return lambda value: needle in value.lower()
+        if op == "regex":
+            return re.compile(operand, re.IGNORECASE).search
+        if op == "in":
+            wanted = {str(item).lower() for item in operand}
+            return lambda value: value.lower() in wanted
+        raise ValueError(f"unknown operator {op!r} on {field}")
+    wanted = str(condition).lower()
+    return lambda value: value.lower() == wanted
+
+
+class Rule:
+    """One compiled rule and its sliding-window state."""
+    def __init__(self, spec):
+        try:
+            self.id = spec["id"]
+        except (KeyError, TypeError):
+            raise ValueError(f"rule without an 'id': {spec!r}")
+        try:
+            self.title = spec.get("title", self.id)
+            self.severity = spec.get("severity", "medium")
+            if self.severity not in SEVERITIES:
+                raise ValueError(f"severity must be one of {', '.join(SEVERITIES)}")
+            self.event_ids = [int(eid) for eid in spec.get("event_ids", [])]
+            self.channels = set(spec["channels"]) if spec.get("channels") else None
+            self.conditions = []
+            for field, condition in spec.get("match", {}).items():
+                if field not in RULE_FIELDS:
+                    raise ValueError(f"unknown field {field!r}")
+                self.conditions.append((field, _compile_condition(field, condition)))
+            group_by = spec.get("group_by")
+            if isinstance(group_by, str):
+                group_by = {"field": group_by}
+            self.group_field = group_by["field"] if group_by else None
+            if self.group_field is not None and self.group_field not in RULE_FIELDS:
+                raise ValueError(f"unknown group_by field {self.group_field!r}")
+            self.group_regex = re.compile(group_by["regex"]) if group_by and group_by.get("regex") else None
+            self.threshold = int(spec.get("threshold", 1))
+            self.window = parse_duration(spec.get("window", 0))
+            if self.threshold < 1 or (self.threshold > 1 and self.window <= 0):
+                raise ValueError("a threshold above 1 needs a positive window")
+        except (TypeError, ValueError, KeyError, re.error) as e:
+            raise ValueError(f"rule {self.id!r}: {e}")
+        self.windows = {}  # group key -> deque of epoch seconds, oldest first
+
+    def needs_record(self):
+        return bool(self.conditions) or self.group_field is not None
+
+    def matches(self, record):
+        return all(predicate(str(record.get(field, ""))) for field, predicate in self.conditions)
+
+    def group_key(self, record):
+        if self.group_field is None:
+            return None
+        value = str(record.get(self.group_field, ""))
+        if self.group_regex is None:
+            return value
+        match = self.group_regex.search(value)
+        if not match:
+            return None
+        return match.group(1) if match.groups() else match.group(0)
+
+    def observe(self, seconds, key):
+        """
+        Counts one matching event. Returns the window's count when it has
+        just reached the threshold, so a sustained burst raises one alert
+        until its rate drops below the threshold again.
+        """
+        if self.threshold == 1:
+            return 1
+        times = self.windows.get(key)
+        if times is None:
+            times = self.windows[key] = deque()
+        times.append(seconds)
+        cutoff = seconds - self.window
+        while times[0] <= cutoff:
+            times.popleft()
+        return self.threshold if len(times) == self.threshold else None
+
+    def sweep(self, now):
+        """Drops groups whose newest event has left the window."""
+        cutoff = now - self.window
+        for key in [key for key, times in self.windows.items() if not times or times[-1] <= cutoff]:
+            del self.windows[key]
+
+    def reset(self):
+        self.windows.clear()
+
+
+class RuleEngine:
+    """
+    Runs a set of rules over a stream of events, oldest first, and returns
+    alert dicts. Keeps its window state between calls, so the monitoring
+    loop can feed it one delta batch at a time.
+    """
+    def __init__(self, rules=None):
+        self.rules = [rule if isinstance(rule, Rule) else Rule(rule) for rule in (rules or [])]
+        ids = [rule.id for rule in self.rules]
+        duplicates = {rule_id for rule_id in ids if ids.count(rule_id) > 1}
+        if duplicates:
+            raise ValueError(f"duplicate rule ids: {', '.join(sorted(duplicates))}")
+        # EventID -> rules; rules without event_ids run for every event
+        self.dispatch = {}
+        self.any_event = []
+        for rule in self.rules:
+            if rule.event_ids:
+                for event_id in rule.event_ids:
+                    self.dispatch.setdefault(event_id, []).append(rule)
+            else:
+                self.any_event.append(rule)
+        self._seen = 0
+        self._now = 0
+
+    def reset(self):
+        for rule in self.rules:
+            rule.reset()
+        self._seen = 0
+        self._now = 0
+
+    def process_records(self, pairs):
+        """Feeds (log_type, record) pairs, oldest first; returns the alerts raised."""
+        alerts = []
+        with METRICS.stage("rules"):
+            count = 0
+            for log_type, record in pairs:
+                count += 1
+                rules = self.dispatch.get(to_int(record["EventID"]))
+                if rules is None and not self.any_event:
+                    continue
+                alerts += self._apply(rules, lambda: dict(record, LogType=log_type), log_type,
+                                      to_epoch(record["TimeGenerated"]))
+            self._tick(count)
+        METRICS.inc("alerts", len(alerts))
+        return alerts
+
+    def process_batch(self, batch, reverse=True):
+        """
+        Feeds an EventBatch straight from its columns. Fetched batches are
+        newest first, so by default they are walked backwards. Record dicts
+        are only built for events some rule looks at.
+        """
+        alerts = []
+        dispatch = self.dispatch
+        any_event = self.any_event
+        times = batch.times
+        channels = batch.channels
+        channel_names = batch.channel_names
+        indexes = range(len(batch) - 1, -1, -1) if reverse else range(len(batch))
+        with METRICS.stage("rules"):
+            event_ids = batch.event_ids
+            for i in indexes:
+                rules = dispatch.get(event_ids[i])
+                if rules is None and not any_event:
+                    continue
+                alerts += self._apply(rules, lambda: batch[i], channel_names[channels[i]], times[i])
+            self._tick(len(batch))
+        METRICS.inc("alerts", len(alerts))
+        return alerts
+
+    def _apply(self, rules, get_record, log_type, seconds):
+        if seconds > self._now:
+            self._now = seconds
+        if self.any_event:
+            rules = (rules or []) + self.any_event
+        alerts = []
+        record = None
+        for rule in rules:
+            if rule.channels is not None and log_type not in rule.channels:
+                continue
+            if rule.needs_record():
+                if record is None:
+                    record = get_record()
+                if not rule.matches(record):
+                    continue
+                key = rule.group_key(record)
+            else:
+                key = None
+            count = rule.observe(seconds, key)
+            if count is not None:
+                if record is None:
+                    record = get_record()
+                alerts.append(self._alert(rule, record, log_type, key, count))
+        return alerts
+
+    def _tick(self, count):
+        self._seen += count
+        if self._seen >= SWEEP_EVERY:
+            self._seen = 0
+            for rule in self.rules:
+                if rule.threshold > 1:
+                    rule.sweep(self._now)
+
+    @staticmethod
+    def _alert(rule, record, log_type, key, count):
+        if rule.threshold > 1:
+            summary = f"{count} x EventID {record['EventID']}"
+            if key is not None:
+                summary += f" for {key}"
+            summary += f" within {rule.window / 60:g} min"
+        else:
+            summary = f"EventID {record['EventID']} from {record['SourceName']}"
+        return {
+            "Time": record["TimeGenerated"],
+            "RuleID": rule.id,
+            "Title": rule.title,
+            "Severity": rule.severity,
+            "LogType": log_type,
+            "EventID": record["EventID"],
+            "Group": key,
+            "Count": count,
+            "Summary": summary,
+            "Message": record["Message"],
+        }
+
+
+def format_alert(alert):
+    """One line of text for an alert."""
+    return f"[{alert['Time']}] {alert['Severity'].upper():<8} {alert['Title']}: {alert['Summary']}"
+
+
+def _load_file(path):
+    with open(path, "r", encoding="utf-8") as f:
+        if path.lower().endswith((".yaml", ".yml")):
+            try:
+                import yaml  # Optional, and only needed for rules written in YAML
+            except ImportError:
+                raise ValueError(f"{path}: YAML rules need the 'PyYAML' package") from None
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("rules", [])
+    if not isinstance(data, list):
+        raise ValueError(f"{path}: expected a list of rules")
+    return data
+
+
+def load_rules(paths=None, include_defaults=True):
+    """
+    Returns rule specs: the built-in rules plus those in 'paths' (default:
+    ~/.seclog/rules.json/.yaml/.yml if present). A rule in a file replaces
+    the built-in rule with the same id. Raises ValueError on a bad file.
+    """
+    specs = {rule["id"]: rule for rule in DEFAULT_RULES} if include_defaults else {}
+    if paths is None:
+        paths = [path for path in DEFAULT_RULES_PATHS if os.path.exists(path)]
+    for path in paths:
+        try:
+            for spec in _load_file(path):
+                Rule(spec)  # Validate now, so errors name the file
+                specs[spec["id"]] = spec
+        except OSError as e:
+            raise ValueError(f"could not read rules from {path}: {e}")
+        except ValueError as e:
+            raise ValueError(f"{path}: {e}")
+    return list(specs.values())
+
+
+def load_rules_or_defaults(paths=None):
+    """load_rules() for the GUI and the monitor: a broken rules file falls back to the built-in rules."""
+    try:
+        return load_rules(paths)
+    except ValueError as e:
+        print(f"Error loading rules: {e}; using the built-in rules.", file=sys.stderr)
+        return list(DEFAULT_RULES)
@@ -1,10 +1,17 @@
-import customtkinter as ctk
-from main_app import SecurityLogApp
+import sys
 
 if __name__ == "__main__":
-    
+    # Any command-line arguments select the headless CLI, which never
+    # imports the GUI libraries
+    if len(sys.argv) > 1:
+        from cli import main
+        sys.exit(main(sys.argv[1:]))
+
+    import customtkinter as ctk
+    from main_app import SecurityLogApp
+
     ctk.set_appearance_mode("System")
     ctk.set_default_color_theme("dark-blue")
 
     app = SecurityLogApp()
-    app.mainloop()
\ No newline at end of file
+    app.mainloop()
@@ -0,0 +1,141 @@
+import json
+import os
+import sys
+import threading
+from datetime import datetime, timedelta
+
+from aggregation import EventAggregator, template_keys
+from event_sources import TIME_FORMAT
+
+# This file contains the pieces used by real-time monitoring: per-channel
+# cursors that survive restarts, the bounded window of recent events and the
+# adaptive poll interval.
+
+DEFAULT_STATE_DIR = os.path.join(os.path.expanduser("~"), ".seclog")
+
+
+class CursorStore:
+    """
+    Remembers, per channel, the position of the last record that was read
+    (a record number or file offset) and its timestamp. Saved as JSON.
+    """
+    def __init__(self, path=None):
+        self.path = path or os.path.join(DEFAULT_STATE_DIR, "cursors.json")
+        self.cursors = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.cursors = json.load(f)
+        except FileNotFoundError:
+            self.cursors = {}
+        except (OSError, ValueError) as e:
+            print(f"Could not load cursors from {self.path}: {e}", file=sys.stderr)
+            self.cursors = {}
+
+    def save(self):
+        """Writes the cursors atomically so a crash never leaves a half-written file."""
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.cursors, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not save cursors to {self.path}: {e}", file=sys.stderr)
+
+    def get(self, channel):
+        return self.cursors.get(channel)
+
+    def set(self, channel, cursor):
+        self.cursors[channel] = cursor
+
+
+class LiveWindow:
+    """
+    Bounded, thread-safe window of the most recent events seen while
+    monitoring. Oldest events drop out once either max_events or max_age
+    is exceeded. An EventAggregator is kept up to date incrementally.
+
+    Indexing is newest first, so the window can be handed straight to the
+    log table without copying it.
+    """
+    def __init__(self, max_events=50000, max_age=timedelta(hours=24)):
+        self.max_events = max_events
+        self.max_age = max_age
+        self.aggregator = EventAggregator()
+        # (log_type, record, template key), oldest first; the entries before
+        # _head have been evicted and are dropped once they are half the list
+        self._entries = []
+        self._head = 0
+        self._lock = threading.Lock()
+
+    def append(self, log_type, records):
+        """Appends a delta batch and returns the (log_type, record, template key) entries that were evicted."""
+        keys = template_keys(records)
+        with self._lock:
+            entries = self._entries
+            entries.extend((log_type, record, key) for record, key in zip(records, keys))
+            head = max(self._head, len(entries) - self.max_events)
+            if self.max_age:
+                cutoff = (datetime.now() - self.max_age).strftime(TIME_FORMAT)
+                while head < len(entries) and entries[head][1]["TimeGenerated"] < cutoff:
+                    head += 1
+            evicted = entries[self._head:head]
+            if head * 2 > len(entries):
+                del entries[:head]
+                head = 0
+            self._head = head
+        self.aggregator.add(records, log_type, keys)
+        for evicted_type in {entry[0] for entry in evicted}:
+            entries = [entry for entry in evicted if entry[0] == evicted_type]
+            self.aggregator.remove([entry[1] for entry in entries], evicted_type, [entry[2] for entry in entries])
+        return evicted
+
+    def snapshot(self):
+        """Returns the records in the window, newest first."""
+        with self._lock:
+            return [self._entries[i][1] for i in range(len(self._entries) - 1, self._head - 1, -1)]
+
+    def counts(self):
+        return self.aggregator.log_type_counts()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._head = 0
+        self.aggregator.reset()
+
+    def __len__(self):
+        return len(self._entries) - self._head
+
+    def __getitem__(self, index):
+        with self._lock:
+            size = len(self._entries) - self._head
+            if index < 0:
+                index += size
+            if not 0 <= index < size:
+                raise IndexError("LiveWindow index out of range")
+            return self._entries[-1 - index][1]
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+
+class AdaptiveInterval:
+    """
+    Poll interval that shortens while events keep arriving and backs off
+    exponentially while the logs are quiet.
+    """
+    def __init__(self, minimum=0.5, maximum=10.0, initial=2.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.current = initial
+
+    def update(self, new_events):
+        if new_events:
+            self.current = max(self.minimum, self.current / 2)
+        else:
+            self.current = min(self.maximum, self.current * 1.5)
+        return self.current
@@ -0,0 +1,271 @@
+import json
+import sys
+import threading
+from collections import Counter
+from operator import itemgetter
+
+# This file contains message-template mining. Most events repeat the same
+# message with a few words changed (a user name, a logon ID, an address), so
+# a message is stored as a template learned per SourceName and EventID plus
+# the words that vary ("inserts"). The text is rebuilt only when a row is
+# shown, exported or searched for a phrase.
+#
+# Messages are split on single spaces, so rebuilding is exact. Messages with
+# the same source, EventID and word count share templates: the first one
+# becomes a template with no slots, and a later one that differs in at most
+# half of the fixed words generalizes it, the differing words becoming slots.
+# Templates never change once created (rows keep pointing at the one they
+# were encoded with); a generalized template is linked to its successor so
+# that counts can be rolled up. Counts are kept per template and only rolled
+# up when they are shown: a message encoded again later may land on the
+# successor, so it would not find a count kept under the old pattern.
+#
+# An encoded message is a (template id, inserts) pair: the inserts joined by
+# SEPARATOR into one string, which costs far less memory than a string per
+# insert. Messages kept literally have the template id LITERAL and their
+# full text as the inserts.
+
+LITERAL = -1
+SEPARATOR = "\x1f"
+MAX_TOKENS = 128             # Longer messages are kept literally
+MAX_TEMPLATES_PER_KEY = 16   # Per (source, EventID, word count)
+MAX_TEMPLATES = 50000
+MAX_INTERNED = 32            # Inserts up to this length are interned
+SLOT_TEXT = "<*>"
+
+
+class Template:
+    """One learned message shape: its words, with None at the slots."""
+    __slots__ = ("id", "source", "event_id", "tokens", "slots", "merged_into", "successor", "format", "text",
+                 "lower", "_constants", "_constant_values", "_inserts", "_single")
+
+    def __init__(self, template_id, source, event_id, tokens, merged_into=None):
+        self.id = template_id
+        self.source = source
+        self.event_id = event_id
+        self.tokens = tokens
+        self.merged_into = merged_into
+        self.successor = None  # The Template with id merged_into
+        self.slots = [i for i, token in enumerate(tokens) if token is None]
+        constants = [i for i, token in enumerate(tokens) if token is not None]
+        self.format = " ".join("{}" if token is None else token.replace("{", "{{").replace("}", "}}")
+                               for token in tokens)
+        self.text = None if self.slots else " ".join(tokens)
+        self.lower = self.text.lower() if self.text is not None else None
+        # itemgetter returns a bare item for one index and a tuple for several
+        self._constants = itemgetter(*constants)
+        self._constant_values = self._constants(tokens)
+        self._inserts = itemgetter(*self.slots) if self.slots else None
+        self._single = len(self.slots) == 1
+
+    def matches(self, words):
+        return self._constants(words) == self._constant_values
+
+    def inserts(self, words):
+        if self._inserts is None:
+            return ""
+        inserts = self._inserts(words) if self._single else SEPARATOR.join(self._inserts(words))
+        return sys.intern(inserts) if len(inserts) <= MAX_INTERNED else inserts
+
+    def fill(self, inserts):
+        """The message text for the given inserts."""
+        if self.text is not None:
+            return self.text
+        if self._single:
+            return self.format.format(inserts)
+        return self.format.format(*inserts.split(SEPARATOR))
+
+    def pattern(self):
+        """The template as text, with <*> at the slots."""
+        return " ".join(SLOT_TEXT if token is None else token for token in self.tokens)
+
+    def root(self):
+        """The most general template this one was folded into (itself if none)."""
+        template = self
+        while template.successor is not None:
+            template = template.successor
+        return template
+
+    def segments(self):
+        """The lower-cased runs of fixed words between the slots."""
+        runs = [[]]
+        for token in self.tokens:
+            if token is None:
+                runs.append([])
+            else:
+                runs[-1].append(token)
+        return [" ".join(run).lower() for run in runs if run]
+
+
+class TemplateMiner:
+    """
+    Learns templates and encodes/decodes messages with them. Encoding may be
+    called from several reader threads; learning takes a lock, matching
+    does not.
+    """
+    def __init__(self):
+        self.templates = []
+        self._by_key = {}    # (source, event_id, word count) -> templates, newest first
+        self._lock = threading.Lock()
+        self._changed = []   # Templates created or linked since the last pop_changes()
+        self._containing = {}
+
+    def __len__(self):
+        return len(self.templates)
+
+    # --- Encoding ---
+
+    def encode(self, source, event_id, message):
+        """Returns 'message' as a (template id, inserts) pair."""
+        words = message.split(" ")
+        if len(words) > MAX_TOKENS or SEPARATOR in message:
+            return LITERAL, message
+        key = (source, event_id, len(words))
+        candidates = self._by_key.get(key)
+        if candidates is not None:
+            for template in candidates:
+                if template.matches(words):
+                    return template.id, template.inserts(words)
+        template = self._learn(key, words)
+        if template is None:
+            return LITERAL, message
+        return template.id, template.inserts(words)
+
+    def _learn(self, key, words):
+        with self._lock:
+            candidates = self._by_key.setdefault(key, [])
+            for template in candidates:
+                if template.matches(words):
+                    return template  # Learned by another thread since encode() looked
+            if len(candidates) >= MAX_TEMPLATES_PER_KEY or len(self.templates) >= MAX_TEMPLATES:
+                return None
+            tokens = list(words)
+            base = candidates[0] if candidates else None
+            if base is not None:
+                fixed = [i for i, token in enumerate(base.tokens) if token is not None]
+                differing = [i for i in fixed if words[i] != base.tokens[i]]
+                if len(differing) * 2 <= len(fixed) and len(differing) < len(fixed):
+                    tokens = list(base.tokens)
+                    for i in differing:
+                        tokens[i] = None
+                else:
+                    base = None  # Too different: a template of its own
+            template = self._add(Template(len(self.templates), key[0], key[1], tokens))
+            if base is not None:
+                base.merged_into = template.id
+                base.successor = template
+                self._changed.append(base)
+            return template
+
+    def _add(self, template):
+        self.templates.append(template)
+        self._by_key.setdefault((template.source, template.event_id, len(template.tokens)), []).insert(0, template)
+        self._changed.append(template)
+        self._containing.clear()
+        return template
+
+    # --- Decoding and matching ---
+
+    def text(self, template_id, inserts):
+        """The full text of an encoded message."""
+        if template_id < 0:
+            return inserts
+        return self.templates[template_id].fill(inserts)
+
+    def lower(self, template_id, inserts):
+        if template_id < 0:
+            return inserts.lower()
+        template = self.templates[template_id]
+        return template.lower if template.lower is not None else template.fill(inserts).lower()
+
+    def contains(self, term):
+        """
+        Returns a function (template id, inserts) -> whether the message
+        contains 'term' (lower-case). The template's fixed words are checked
+        first, once per template. Only when they do not decide are the
+        inserts searched, which is enough for a single word (it cannot span
+        words), or the message rebuilt, for a phrase.
+        """
+        hits = {}
+        templates = self.templates
+        single_word = " " not in term
+
+        def test(template_id, inserts):
+            if template_id < 0:
+                return term in inserts.lower()
+            hit = hits.get(template_id)
+            if hit is None:
+                hit = hits[template_id] = any(term in segment for segment in templates[template_id].segments())
+            if hit or not inserts:
+                return hit
+            if single_word:
+                return term in inserts.lower()
+            return term in templates[template_id].fill(inserts).lower()
+        return test
+
+    def containing(self, term):
+        """Ids of the templates whose fixed words contain 'term' (lower-case), i.e. all of whose messages do."""
+        ids = self._containing.get(term)
+        if ids is None:
+            ids = self._containing[term] = [template.id for template in list(self.templates)
+                                            if any(term in segment for segment in template.segments())]
+        return ids
+
+    def count_templates(self, event_ids, template_ids, messages):
+        """
+        Counts encoded messages by (EventID, Template), for the "top message
+        templates" view; literal messages are counted by (EventID, text).
+        See pattern_counts() for rolling the counts up.
+        """
+        counts = Counter()
+        templates = self.templates
+        for (event_id, template_id), count in Counter(zip(event_ids, template_ids)).items():
+            if template_id >= 0:
+                counts[event_id, templates[template_id]] = count
+        if LITERAL in template_ids:
+            counts.update((event_id, message) for event_id, template_id, message
+                          in zip(event_ids, template_ids, messages) if template_id < 0)
+        return counts
+
+    # --- Persistence (used by the event cache) ---
+
+    def pop_changes(self):
+        """Rows (id, source, event_id, pattern JSON, merged_into) for templates created or linked since the last call."""
+        with self._lock:
+            changed, self._changed = self._changed, []
+        return [(t.id, t.source, t.event_id, json.dumps(t.tokens), t.merged_into) for t in changed]
+
+    def load(self, rows):
+        """Restores templates from (id, source, event_id, pattern JSON, merged_into) rows, in id order."""
+        for template_id, source, event_id, pattern, merged_into in rows:
+            if template_id != len(self.templates):
+                raise ValueError(f"template {template_id} is out of sequence")
+            self._add(Template(template_id, source, event_id, json.loads(pattern), merged_into))
+        for template in self.templates:
+            if template.merged_into is not None:
+                template.successor = self.templates[template.merged_into]
+        self._changed = []
+
+
+def pattern_counts(counts):
+    """
+    Rolls counts keyed by (EventID, Template or literal text) up into
+    (EventID, pattern) counts, generalized templates into their successors.
+    """
+    patterns = Counter()
+    for (event_id, key), count in counts.items():
+        patterns[event_id, key if isinstance(key, str) else key.root().pattern()] += count
+    return patterns
+
+
+def plain_contains(term):
+    """The contains() test for messages that were not encoded (all LITERAL)."""
+    return lambda template_id, inserts: term in inserts.lower()
+
+
+def plain_lower(template_id, inserts):
+    return inserts.lower()
+
+
+# Templates for the batches built while reading sources; the event cache keeps its own
+TEMPLATES = TemplateMiner()
@@ -0,0 +1,48 @@
+import json
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+# The modules live flat in the directory above; make them importable as in run.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_sources import LOG_TYPES, JsonlFileSource, SyntheticEventSource  # noqa: E402
+from log_handler import LogHandler  # noqa: E402
+from tailing import CursorStore, LiveWindow  # noqa: E402
+
+END = datetime(2024, 6, 1, 12, 0, 0)
+
+
+def write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def rows(batches):
+    """The rows of EventBatches as record dicts."""
+    return [record for batch in batches for record in batch]
+
+
+@pytest.fixture
+def jsonl_sources(tmp_path):
+    """{channel: JsonlFileSource} over exports of 2000 synthetic events per channel, newest first."""
+    sources = {}
+    for channel in LOG_TYPES:
+        path = str(tmp_path / f"{channel}.jsonl")
+        write_jsonl(path, SyntheticEventSource(channel, count=2000, end=END).read())
+        sources[channel] = JsonlFileSource(path, channel, order="desc")
+    return sources
+
+
+@pytest.fixture
+def make_handler(tmp_path):
+    """Builds LogHandlers that keep their state under tmp_path and run no rules."""
+    def make(sources, **kwargs):
+        kwargs.setdefault("cursor_store", CursorStore(str(tmp_path / "cursors.json")))
+        kwargs.setdefault("live_window", LiveWindow(max_age=None))
+        kwargs.setdefault("rules", [])
+        return LogHandler(sources, **kwargs)
+    return make
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+from aggregation import EventAggregator, template_keys
+from event_batch import EventBatch
+from tailing import LiveWindow
+from templates import TemplateMiner
+
+
+def record(i, message, event_id=4625, source="Test"):
+    time_generated = (datetime.now() - timedelta(seconds=1000 - i)).strftime("%Y-%m-%d %H:%M:%S")
+    return {"TimeGenerated": time_generated, "SourceName": source, "EventID": str(event_id),
+            "EventType": "16", "Category": "12544", "Message": message}
+
+
+def empty_counts(aggregator):
+    return (aggregator.total, aggregator.event_ids, aggregator.sources, aggregator.event_types,
+            aggregator.log_types, aggregator.hours, aggregator.templates) == (0, {}, {}, {}, {}, {}, {})
+
+
+def test_add_remove_symmetry_across_generalization():
+    aggregator = EventAggregator()
+    # A source of its own, so earlier tests cannot have taught the shared miner these messages
+    first = [record(0, "Service zeta-one stopped", source="SymmetryTest")]
+    later = [record(1, "Service zeta-two stopped", source="SymmetryTest")]  # Generalizes the first template
+    window = LiveWindow(max_events=1, max_age=None)
+    window.aggregator = aggregator
+    window.append("System", first)
+    window.append("System", later)  # Evicts the first, whose message now encodes differently
+    assert aggregator.total == 1
+    assert aggregator.top("templates") == [((4625, "Service <*> stopped"), 1)]
+    window.append("System", [record(2, "unrelated", event_id=7036, source="SymmetryTest")])
+    assert aggregator.top("templates") == [((7036, "unrelated"), 1)]
+    window.clear()
+    assert empty_counts(aggregator)
+
+
+def test_window_eviction_leaves_no_counts():
+    window = LiveWindow(max_events=50, max_age=None)
+    for i in range(20):
+        window.append("Security", [record(i * 10 + j, f"Logon failed for user{j}") for j in range(10)])
+    assert len(window) == 50
+    assert window.aggregator.total == 50
+    assert sum(count for _, count in window.aggregator.top("templates", 100)) == 50
+    assert window.counts() == {"Security": 50}
+
+
+def test_add_then_remove_records():
+    aggregator = EventAggregator()
+    records = [record(i, f"Logon failed for user{i % 3}", 4624 + i % 2, "RemoveTest") for i in range(30)]
+    keys = template_keys(records)  # The first message is encoded before the template generalizes
+    aggregator.add(records, "Security", keys)
+    assert aggregator.total == 30
+    assert aggregator.top("templates") == [((4624, "Logon failed for <*>"), 15), ((4625, "Logon failed for <*>"), 15)]
+    aggregator.remove(records, "Security", keys)
+    assert empty_counts(aggregator)
+
+
+def test_batches_from_different_pages_share_patterns():
+    miner = TemplateMiner()
+    first = EventBatch.from_records([("Security", record(0, "Logon failed for alice"))], miner)
+    second = EventBatch.from_records([("Security", record(1, "Logon failed for bob")),
+                                      ("Security", record(2, "Logon failed for carol"))], miner)
+    aggregator = EventAggregator(first)
+    aggregator.add_batch(second)
+    assert aggregator.top("templates") == [((4625, "Logon failed for <*>"), 3)]
+    assert aggregator.top("event_ids") == [(4625, 3)]
+    assert aggregator.log_type_counts() == {"Security": 3}
@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+
+import cli
+from collector import DEFAULT_PORT, parse_address
+from event_sources import SyntheticEventSource
+from event_store import EventStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_cli_does_not_import_the_collector():
+    code = "import sys, cli; print('asyncio' in sys.modules, 'collector' in sys.modules)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert output.stdout.split() == ["False", "False"]
+
+
+def test_collect_listens_on_localhost_by_default():
+    args = cli.build_parser().parse_args(["collect"])
+    assert parse_address(args.listen) == ("127.0.0.1", DEFAULT_PORT)
+
+
+def run_cli(argv, monkeypatch, capsys):
+    monkeypatch.setattr(cli, "default_sources", lambda: {})  # As on a machine without pywin32
+    code = cli.main(["--no-default-rules"] + argv)
+    out, err = capsys.readouterr()
+    return code, out, err
+
+
+def test_no_sources_is_an_error(tmp_path, monkeypatch, capsys):
+    cache = str(tmp_path / "events.db")
+    for argv in (["query"], ["tail"], ["export", "-o", str(tmp_path / "out.csv")], ["--cache", cache, "query"],
+                 ["--cache", cache, "tail"]):
+        code, out, err = run_cli(argv, monkeypatch, capsys)
+        assert code != 0 and out == "", argv
+        assert "no event sources" in err
+    assert not (tmp_path / "out.csv").exists()
+
+
+def test_a_filled_cache_is_enough_without_sources(tmp_path, monkeypatch, capsys):
+    cache = str(tmp_path / "events.db")
+    store = EventStore(cache)
+    store.ingest("Security", list(SyntheticEventSource("Security", count=5).read()))
+    store.close()
+    code, out, err = run_cli(["--cache", cache, "query", "-f", "jsonl"], monkeypatch, capsys)
+    assert code == 0 and len(out.splitlines()) == 5
+    code, out, err = run_cli(["stats", "--json"], monkeypatch, capsys)  # Still runs, with a warning
+    assert code == 0 and '"total": 0' in out and "no event sources" in err
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import zlib
+
+import pytest
+
+from collector import (EVENTS, EVENTS_Z, HELLO, PROTOCOL_VERSION, Collector, ProtocolError, decode_events,
+                       decode_hello, encode_events, encode_frame, read_frame)
+from event_sources import SyntheticEventSource
+from log_handler import LogHandler
+from tailing import CursorStore, LiveWindow
+
+RECORD = {"TimeGenerated": "2024-06-01 12:00:00", "SourceName": "Test", "EventID": "4625",
+          "EventType": "16", "Category": "12544", "Message": "An account failed to log on"}
+
+
+def lines(*rows):
+    return "".join(json.dumps(row) + "\n" for row in rows).encode()
+
+
+def test_decode_round_trip():
+    frame = encode_events([("Security", RECORD)], compress=True)
+    pairs = decode_events(EVENTS_Z, frame[5:], "web01")
+    assert pairs == [("Security", dict(RECORD, Host="web01"))]
+
+
+@pytest.mark.parametrize("row", [
+    [1, 2, 3],
+    "text",
+    {"LogType": "Security"},
+    dict(RECORD, TimeGenerated=12345),
+    dict(RECORD, TimeGenerated="yesterday"),
+    dict(RECORD, LogType=["Security"]),
+])
+def test_decode_skips_invalid_rows(row):
+    payload = lines(row, dict(RECORD, LogType="System"))
+    assert decode_events(EVENTS, payload, "web01") == [("System", dict(RECORD, Host="web01"))]
+
+
+def test_decode_rejects_garbage_payloads():
+    with pytest.raises(ValueError):
+        decode_events(EVENTS, b"{not json\n", "web01")
+    with pytest.raises(ValueError):
+        decode_events(EVENTS, b"\xff\xfe\n", "web01")
+    with pytest.raises(zlib.error):
+        decode_events(EVENTS_Z, b"not compressed", "web01")
+
+
+def test_decode_hello():
+    assert decode_hello(json.dumps({"host": "web01", "version": PROTOCOL_VERSION})) == "web01"
+    assert decode_hello(b"{}") is None
+    assert decode_hello(json.dumps({"host": "web01", "token": "s3cret"}), token="s3cret") == "web01"
+
+
+@pytest.mark.parametrize("payload", [
+    b"",
+    b"\xff",
+    b"[1, 2]",
+    b'"web01"',
+    b'{"version": "1"}',
+    b'{"version": true}',
+    b'{"version": 99}',
+    b'{"host": 5}',
+    json.dumps({"host": "x" * 300}).encode(),
+    b"[" * 100000,
+])
+def test_decode_hello_rejects_bad_payloads(payload):
+    with pytest.raises(ProtocolError):
+        decode_hello(payload)
+
+
+@pytest.mark.parametrize("hello", [{"host": "web01"}, {"host": "web01", "token": "wrong"}, {"token": 1}])
+def test_decode_hello_checks_token(hello):
+    with pytest.raises(ProtocolError):
+        decode_hello(json.dumps(hello), token="s3cret")
+
+
+def test_collector_drops_bad_hello_and_keeps_serving():
+    received = []
+
+    async def main():
+        collector = await Collector(received.extend, port=0).start()
+        assert collector.host == "127.0.0.1"
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", collector.port)
+            writer.write(encode_frame(HELLO, b"[]"))
+            assert await asyncio.wait_for(read_frame(reader), 5) is None  # Closed by the collector
+            writer.close()
+
+            reader, writer = await asyncio.open_connection("127.0.0.1", collector.port)
+            writer.write(encode_frame(HELLO, json.dumps({"host": "web01"}).encode()))
+            writer.write(encode_events([("Security", RECORD)]))
+            kind, _ = await asyncio.wait_for(read_frame(reader), 5)  # The ACK
+            writer.close()
+            return kind
+        finally:
+            await collector.close()
+
+    asyncio.run(main())
+    assert received == [("Security", dict(RECORD, Host="web01"))]
+
+
+def test_receive_rejects_unknown_channels(tmp_path):
+    handler = LogHandler({"Security": SyntheticEventSource("Security", count=0)},
+                         cursor_store=CursorStore(str(tmp_path / "cursors.json")),
+                         live_window=LiveWindow(max_age=None), rules=[])
+    handler.receive([("Security", dict(RECORD, Host="web01"))]
+                    + [(f"Channel{i}", dict(RECORD, Host="web01")) for i in range(300)])
+    assert handler.live_window.counts() == {"Security": 1}
@@ -0,0 +1,99 @@
+import gc
+import tracemalloc
+
+from conftest import END
+from event_batch import EventBatch, to_epoch
+from event_sources import LOCAL_HOST, SyntheticEventSource
+from templates import LITERAL, TemplateMiner
+
+
+def record(i, source="Service Control Manager", event_id=7036, host=None):
+    r = {"TimeGenerated": f"2024-06-01 12:{i // 60:02d}:{i % 60:02d}", "SourceName": source,
+         "EventID": str(event_id), "EventType": "4", "Category": "0",
+         "Message": f"The service{i} service entered the running state."}
+    if host:
+        r["Host"] = host
+    return r
+
+
+PAIRS = [(("System", "Security")[i % 2], record(i, ("Alpha", "Beta", "Gamma")[i % 3], 7000 + i % 4,
+                                                  "web01" if i % 5 == 0 else None))
+         for i in range(60)]
+
+
+def expected(pairs):
+    return [dict(r, LogType=log_type, Host=r.get("Host") or LOCAL_HOST) for log_type, r in pairs]
+
+
+def test_round_trip_and_dictionary_encoding():
+    for templates in (None, TemplateMiner()):
+        batch = EventBatch.from_records(PAIRS, templates)
+        assert list(batch) == expected(PAIRS)
+        assert batch[-1] == expected(PAIRS)[-1]
+        assert batch.source_names == ["Alpha", "Beta", "Gamma"]
+        assert batch.channel_names == ["System", "Security"]
+        assert batch.host_names == ["web01", LOCAL_HOST]
+        assert list(batch.sources[:6]) == [0, 1, 2, 0, 1, 2]
+        assert batch.log_type_counts() == {"System": 30, "Security": 30}
+        assert (set(batch.template_ids) == {LITERAL}) == (templates is None)
+
+
+def test_filter_and_take():
+    batch = EventBatch.from_records(PAIRS, TemplateMiner())
+    mask = [i % 7 == 0 for i in range(len(PAIRS))]
+    assert list(batch.filter(mask)) == [r for r, keep in zip(expected(PAIRS), mask) if keep]
+    indexes = [59, 3, 3, 17, 0]
+    assert list(batch.take(indexes)) == [expected(PAIRS)[i] for i in indexes]
+    assert len(batch.take([])) == 0
+    order = batch.sort_order("SourceName", reverse=True)
+    assert [r["SourceName"] for r in batch.take(order)] == sorted((r["SourceName"] for _, r in PAIRS), reverse=True)
+
+
+def test_selected_batches_do_not_share_dictionaries():
+    batch = EventBatch.from_records(PAIRS[:3])
+    part = batch.take([0])
+    part.append("Application", record(99, "Delta", host="db01"))
+    other = batch.filter([True, False, False])
+    assert batch.source_names == ["Alpha", "Beta", "Gamma"]
+    assert batch.channel_names == ["System", "Security"] and batch.host_names == ["web01", LOCAL_HOST]
+    assert "Delta" not in batch._source_codes and "db01" not in batch._host_codes
+    other.append("Security", record(98, "Epsilon"))
+    assert other.source_code("Epsilon") == 3 and "Delta" not in other.source_names
+    assert list(batch) == expected(PAIRS[:3])
+
+
+def test_extend_recodes_dictionaries_and_messages():
+    miner, other_miner = TemplateMiner(), TemplateMiner()
+    first = EventBatch.from_records(PAIRS[:30], miner)
+    second = EventBatch.from_records(reversed(PAIRS[30:]), other_miner)  # Dictionaries in another order
+    literal = EventBatch.from_records(PAIRS[:5])
+    joined = EventBatch.concat([first, second, literal])
+    assert list(joined) == expected(PAIRS[:30] + PAIRS[30:][::-1] + PAIRS[:5])
+    assert joined.source_names == ["Alpha", "Beta", "Gamma"]
+    assert len(joined.host_names) == 2
+    # The second batch's messages are re-encoded with the first's miner; literal ones are kept as text
+    assert joined.templates is miner
+    assert LITERAL not in joined.template_ids[30:60] and list(joined.template_ids[60:]) == [LITERAL] * 5
+    plain = EventBatch()
+    plain.extend(first)
+    assert list(plain) == expected(PAIRS[:30]) and set(plain.template_ids) == {LITERAL}
+    assert list(joined.times[:2]) == [to_epoch(PAIRS[0][1]["TimeGenerated"]), to_epoch(PAIRS[1][1]["TimeGenerated"])]
+
+
+def test_batch_is_much_smaller_than_the_records():
+    def traced():
+        gc.collect()
+        return tracemalloc.get_traced_memory()[0]
+
+    tracemalloc.start()
+    try:
+        base = traced()
+        pairs = [("Security", r) for r in SyntheticEventSource("Security", count=20000, end=END).read()]
+        records_size = traced() - base
+        batch = EventBatch.from_records(pairs, TemplateMiner())
+        del pairs
+        batch_size = traced() - base
+    finally:
+        tracemalloc.stop()
+    assert len(batch) == 20000
+    assert batch_size * 5 < records_size, (batch_size, records_size)
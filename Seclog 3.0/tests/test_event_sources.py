@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+
+import event_sources
+
+
+def test_no_synthetic_fallback_without_win32(monkeypatch):
+    monkeypatch.setattr(event_sources, "win32evtlog", None)
+    assert event_sources.default_sources() == {}
+
+
+
+class CountingSource(event_sources.SyntheticEventSource):
+    """A synthetic source that counts the raw items it has produced."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.produced = 0
+
+    def _iter_raw(self):
+        for item in super()._iter_raw():
+            self.produced += 1
+            yield item
+
+
+def test_clip_to_range_stops_after_the_range():
+    start, end = datetime(2024, 6, 1, 11, 0, 0), datetime(2024, 6, 1, 11, 30, 0)
+    source = CountingSource("Security", count=100000, end=datetime(2024, 6, 1, 12, 0, 0))
+    records = list(source.read(start, end))
+    everything = [time for time, _ in CountingSource("Security", count=100000, end=source.end)._iter_raw()]
+    assert [record["TimeGenerated"] for record in records] == [
+        time.strftime(event_sources.TIME_FORMAT) for time in everything if start <= time <= end]
+    # Newest first: reading stops at the first event older than the range
+    assert source.produced == sum(time >= start for time in everything) + 1
+    assert source.produced < 200
+
+    source.produced = 0
+    source.order = None  # Unknown order: every event has to be looked at
+    assert len(list(source.read(start, end))) == len(records)
+    assert source.produced == 100000
+
+
+def test_clip_to_range_oldest_first():
+    times = [datetime(2024, 6, 1, hour) for hour in range(24)]
+    seen = []
+    items = ((seen.append(time) or time, None) for time in times)
+    clipped = list(event_sources.clip_to_range(items, times[5], times[9], "asc"))
+    assert [time for time, _ in clipped] == times[5:10]
+    assert seen == times[:11]
+
+
+def test_synthetic_catch_up_is_bounded():
+    source = event_sources.SyntheticEventSource("System", max_catch_up=500)
+    cursor = {"position": 7, "time": "2024-06-01 12:00:00"}  # Long before now
+    before = datetime.now()
+    events = list(source.read_since(cursor))
+    assert 0 < len(events) <= 500
+    assert [c["position"] for c, _ in events] == list(range(8, 8 + len(events)))
+    times = [record["TimeGenerated"] for _, record in events]
+    assert times == sorted(times)
+    oldest = datetime.strptime(times[0], event_sources.TIME_FORMAT)
+    assert oldest >= before - timedelta(seconds=500 * source.interval + 1)
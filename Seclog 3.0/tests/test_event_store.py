@@ -0,0 +1,93 @@
+import csv
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from event_sources import CsvFileSource, SyntheticEventSource
+from event_store import EventStore
+
+FIELDS = ["TimeGenerated", "SourceName", "EventID", "EventType", "Category", "Message"]
+
+
+def record(time_generated, event_id=4625, message="An account failed to log on"):
+    return {"TimeGenerated": time_generated, "SourceName": "Test", "EventID": str(event_id),
+            "EventType": "16", "Category": "12544", "Message": message}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = EventStore(str(tmp_path / "events.db"), max_age_days=30)
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def old_export(tmp_path):
+    """A static source whose events are all years old."""
+    path = tmp_path / "old.csv"
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, FIELDS)
+        writer.writeheader()
+        for i in range(10):
+            writer.writerow(record(f"2019-01-01 00:00:{i:02d}", 4624 + i % 2))
+    return CsvFileSource(str(path), "Security")
+
+
+def test_static_source_is_ingested_once_and_kept(store, old_export):
+    assert store.sync({"Security": old_export}) == 10
+    assert store.count() == 10  # Old events are not evicted in the sync that ingests them
+    assert store.sync({"Security": old_export}) == 0  # The cursor marks it as done
+    assert sorted(r["EventID"] for _, r in store.query(["Security"], event_ids=[4625])) == ["4625"] * 5
+
+
+def test_tailing_source_resumes_from_its_cursor(store):
+    source = SyntheticEventSource("System", count=50)
+    assert store.sync({"System": source}) == 50
+    cursor = store._get_cursor("System")
+    assert cursor["position"] == 50
+    assert store.sync({"System": source}) == len(list(source.read_since(cursor)))
+    assert store.count() >= 50
+
+
+def test_evict_by_ingest_time(store, old_export):
+    store.sync({"Security": old_export})
+    store.evict(now=datetime.now() + timedelta(days=29))
+    assert store.count() == 10
+    store.ingest("System", [record("2024-06-01 00:00:00")])
+    store.evict(now=datetime.now() + timedelta(days=31))
+    assert store.count() == 0
+    store.ingest("System", [record("2024-06-01 00:00:00")])  # Ids start again in an empty table
+    store.evict()
+    assert store.count() == 1
+
+
+def test_evict_by_count_keeps_the_latest_cached(tmp_path):
+    store = EventStore(str(tmp_path / "events.db"), max_events=5)
+    try:
+        store.ingest("System", [record("2024-06-01 00:00:00", message=f"new {i}") for i in range(4)])
+        store.ingest("System", [record("2019-01-01 00:00:00", message=f"old {i}") for i in range(4)])
+        store.evict()
+        messages = sorted(r["Message"] for _, r in store.query(["System"]))
+        assert messages == ["new 3", "old 0", "old 1", "old 2", "old 3"]
+    finally:
+        store.close()
+
+
+def test_caches_without_ingest_times_age_from_the_upgrade(tmp_path):
+    path = str(tmp_path / "events.db")
+    store = EventStore(path, max_age_days=30)
+    store.ingest("System", [record("2019-01-01 00:00:00")])
+    store.close()
+    conn = sqlite3.connect(path)
+    conn.execute("DROP TABLE ingest_log")
+    conn.commit()
+    conn.close()
+    store = EventStore(path, max_age_days=30)
+    try:
+        store.evict()
+        assert store.count() == 1
+        store.evict(now=datetime.now() + timedelta(days=31))
+        assert store.count() == 0
+    finally:
+        store.close()
@@ -0,0 +1,130 @@
+import csv
+import gzip
+import io
+import json
+import threading
+
+import pytest
+
+import exporter
+from conftest import END
+from event_batch import EventBatch
+from event_sources import SyntheticEventSource
+from exporter import FIELDNAMES, ExportJob, available_formats, format_for_path
+from templates import TemplateMiner
+
+
+@pytest.fixture(scope="module")
+def batch():
+    pairs = [(log_type, record) for log_type in ("Security", "System")
+             for record in SyntheticEventSource(log_type, count=1200, end=END).read()]
+    pairs.append(("Application", {"TimeGenerated": "2024-06-01 12:00:00", "SourceName": "Test", "EventID": "1",
+                                  "EventType": "4", "Category": "0",
+                                  "Message": 'Quotes " and commas, a new\nline and non-ASCII: żółw'}))
+    return EventBatch.from_records(pairs, TemplateMiner())
+
+
+def export(rows, path, **kwargs):
+    """Runs an ExportJob to the end and returns (written, error, cancelled) and the progress calls."""
+    done, progress = [], []
+    job = ExportJob(rows, str(path), progress_callback=lambda *args: progress.append(args),
+                    done_callback=lambda *args: done.append(args), **kwargs)
+    job.start()
+    job.join(30)
+    assert not job.is_alive()
+    return done[0], progress
+
+
+def read_text(path, fmt):
+    if fmt.endswith(".gz"):
+        data = gzip.open(path, "rt", encoding="utf-8", newline="").read()
+    elif fmt.endswith(".zst"):
+        zstandard = pytest.importorskip("zstandard")
+        data = zstandard.ZstdDecompressor().stream_reader(open(path, "rb")).read().decode("utf-8")
+    else:
+        data = open(path, encoding="utf-8", newline="").read()
+    if fmt.startswith("jsonl"):
+        return [json.loads(line) for line in data.splitlines()]
+    return list(csv.DictReader(io.StringIO(data, newline="")))
+
+
+@pytest.mark.parametrize("fmt", ["csv", "csv.gz", "jsonl", "jsonl.gz", "csv.zst", "jsonl.zst"])
+def test_text_round_trip(batch, tmp_path, fmt):
+    if fmt.endswith(".zst"):
+        pytest.importorskip("zstandard")
+    path = tmp_path / f"export.{fmt}"
+    assert format_for_path(str(path)) == fmt
+    (written, error, cancelled), progress = export(batch, path, chunk_size=1000)
+    assert (written, error, cancelled) == (len(batch), None, False)
+    assert progress == [(1000, 2401), (2000, 2401), (2401, 2401)]
+    assert read_text(path, fmt) == list(batch)
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_arrow_round_trip(batch, tmp_path, fmt):
+    pa = pytest.importorskip("pyarrow")
+    path = tmp_path / f"export.{fmt}"
+    (written, error, cancelled), _ = export(batch, path, chunk_size=1000)
+    assert (written, error, cancelled) == (len(batch), None, False)
+    if fmt == "parquet":
+        table = pytest.importorskip("pyarrow.parquet").read_table(str(path))
+    else:
+        table = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+    assert table.column_names == FIELDNAMES
+    assert table.to_pylist() == list(batch)
+
+
+def test_export_from_an_iterable_without_a_length(batch, tmp_path):
+    path = tmp_path / "export.jsonl"
+    (written, error, _), progress = export(iter(batch), path, chunk_size=1000)
+    assert written == len(batch) and error is None
+    assert progress[-1] == (len(batch), None)
+    assert read_text(path, "jsonl") == list(batch)
+
+
+def test_cancel_stops_the_thread_and_removes_the_file(batch, tmp_path):
+    path = tmp_path / "export.csv.gz"
+    started, release = threading.Event(), threading.Event()
+
+    def progress(written, total):
+        started.set()
+        release.wait(10)
+
+    done = []
+    job = ExportJob(batch, str(path), progress_callback=progress, done_callback=lambda *args: done.append(args),
+                    chunk_size=100)
+    job.start()
+    assert started.wait(10)
+    assert path.exists()
+    job.cancel()
+    release.set()
+    job.join(10)
+    assert not job.is_alive()
+    assert done == [(100, None, True)]
+    assert job.cancelled and not path.exists()
+
+
+def test_write_errors_are_reported(tmp_path):
+    done = []
+    job = ExportJob([{"Message": "x"}], str(tmp_path / "missing" / "export.csv"),
+                    done_callback=lambda *args: done.append(args))
+    job.run()
+    (written, error, cancelled), = done
+    assert written == 0 and isinstance(error, OSError) and not cancelled
+
+
+def test_available_formats_hide_missing_libraries(monkeypatch):
+    monkeypatch.setattr(exporter, "zstandard", None)
+    monkeypatch.setattr(exporter, "pa", None)
+    assert [fmt for _, fmt, _ in available_formats()] == ["jsonl.gz", "csv.gz", "jsonl", "csv"]
+    monkeypatch.setattr(exporter, "zstandard", object())
+    monkeypatch.setattr(exporter, "pa", object())
+    assert [fmt for _, fmt, _ in available_formats()] == [fmt for _, fmt, _ in exporter.FORMATS]
+
+
+def test_missing_library_is_an_error(monkeypatch, tmp_path):
+    monkeypatch.setattr(exporter, "zstandard", None)
+    monkeypatch.setattr(exporter, "pa", None)
+    for name in ("export.csv.zst", "export.parquet"):
+        (written, error, _), _ = export([{"Message": "x"}], tmp_path / name)
+        assert written == 0 and isinstance(error, RuntimeError)
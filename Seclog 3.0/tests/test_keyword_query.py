@@ -0,0 +1,102 @@
+import pytest
+
+from conftest import END
+from event_sources import LOG_TYPES, SyntheticEventSource
+from event_store import EventStore
+from keyword_query import MIN_INDEXED_TERM, KeywordQuery
+
+FIELDS = ("Message", "SourceName", "EventID")
+
+
+def scan(pairs, groups):
+    """The pairs matching 'groups' (an OR of ANDs of lower-case terms) by a plain substring scan."""
+    return [(log_type, record) for log_type, record in pairs
+            if any(all(any(term in str(record[field]).lower() for field in FIELDS) for term in group)
+                   for group in groups)]
+
+
+def key(pairs):
+    return sorted((log_type, r["TimeGenerated"], r["EventID"], r["SourceName"], r["Message"]) for log_type, r in pairs)
+
+
+@pytest.mark.parametrize("text, groups", [
+    ("admin logon", [["admin", "logon"]]),
+    ("admin OR guest", [["admin"], ["guest"]]),
+    ("admin AND logon OR guest", [["admin", "logon"], ["guest"]]),
+    ('"Failed Logon" admin', [["failed logon", "admin"]]),
+    ('OR admin OR OR guest OR', [["admin"], ["guest"]]),
+    ('"" or', [["or"]]),  # Only upper-case OR is an operator
+    ("   ", []),
+])
+def test_parse(text, groups):
+    query = KeywordQuery(text)
+    assert query.groups == groups
+    assert bool(query) == bool(groups)
+
+
+def test_matches_values_not_field_names():
+    record = {"TimeGenerated": "2024-06-01 12:00:00", "SourceName": "Service Control Manager", "EventID": "7036",
+              "Message": "The Windows Update service entered the running state."}
+    assert KeywordQuery("update 7036").matches(record)
+    assert KeywordQuery('"control manager" OR nothing').matches(record)
+    assert not KeywordQuery("message").matches(record)
+    assert not KeywordQuery('"update entered"').matches(record)
+
+
+def test_indexable():
+    assert KeywordQuery("admin logon").indexable()
+    assert not KeywordQuery("admin " + "x" * (MIN_INDEXED_TERM - 1)).indexable()
+    assert not KeywordQuery("").indexable()
+
+
+@pytest.fixture(scope="module")
+def stored(tmp_path_factory):
+    """An EventStore holding synthetic events plus literal messages, and the same (log_type, record) pairs."""
+    store = EventStore(str(tmp_path_factory.mktemp("store") / "events.db"))
+    pairs = []
+    for log_type in LOG_TYPES:
+        records = list(SyntheticEventSource(log_type, count=500, end=END).read())
+        records += [{"TimeGenerated": f"2024-05-01 00:{i // 60:02d}:{i % 60:02d}", "SourceName": "Custom App",
+                     "EventID": str(100 + i % 7), "EventType": "4", "Category": "0",
+                     "Message": f"Backup job {i} copied {i * 37} files to \\\\nas{i % 3}\\share"}
+                    for i in range(60)]
+        store.ingest(log_type, records)
+        pairs += [(log_type, record) for record in records]
+    yield store, pairs
+    store.close()
+
+
+@pytest.mark.parametrize("text, groups", [
+    # Trigram index over the inserts and literal messages
+    ("administrator", [["administrator"]]),
+    ("nas2 files", [["nas2", "files"]]),
+    ("1665", [["1665"]]),
+    ("svchost OR ntdll", [["svchost"], ["ntdll"]]),
+    # Terms shorter than MIN_INDEXED_TERM are checked per row
+    ("17", [["17"]]),
+    ("0x OR 5", [["0x"], ["5"]]),
+    ("backup 9", [["backup", "9"]]),
+    # Phrases are checked per row too
+    ('"job 12 copied"', [["job 12 copied"]]),
+    # Templates' fixed words and the SourceName/EventID vocabulary
+    ("workstation", [["workstation"]]),
+    ("auditing", [["auditing"]]),
+    ("4625 OR 11707", [["4625"], ["11707"]]),
+    ("backup 104", [["backup", "104"]]),
+])
+def test_store_keyword_paths_match_a_scan(stored, text, groups):
+    store, pairs = stored
+    query = KeywordQuery(text)
+    assert query.groups == groups
+    expected = scan(pairs, groups)
+    assert expected
+    assert key(store.query(LOG_TYPES, keyword=query)) == key(expected)
+
+
+def test_store_keyword_path_selection(stored):
+    store, _ = stored
+    assert store._keyword_clause(KeywordQuery("administrator")) is not None
+    assert store._keyword_clause(KeywordQuery("17")) is None
+    assert store._keyword_clause(KeywordQuery('"job 12 copied"')) is None
+    assert store.templates.containing("backup")  # Served by the template ids
+    assert not store.templates.containing("1665")  # Only in an insert: served by the trigram index
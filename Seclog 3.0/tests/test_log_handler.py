@@ -0,0 +1,59 @@
+import threading
+import time
+
+from conftest import END, rows
+from event_store import EventStore
+from query import Query
+
+
+class SlowStore(EventStore):
+    """An event store whose writes take a while, like a first sync of a large log."""
+    def ingest(self, *args, **kwargs):
+        time.sleep(0.02)
+        return super().ingest(*args, **kwargs)
+
+
+def forwarded(i):
+    return ("Security", {"TimeGenerated": f"2024-06-01 11:{i:02d}:00", "SourceName": "Remote", "EventID": "4625",
+                         "EventType": "16", "Category": "12544", "Message": f"forwarded {i}", "Host": "web01"})
+
+
+def sort_key(record):
+    return tuple(sorted(record.items()))
+
+
+def test_first_page_does_not_wait_for_the_store_sync(tmp_path, jsonl_sources, make_handler):
+    direct = make_handler(jsonl_sources)
+    store = SlowStore(str(tmp_path / "events.db"), batch_size=100)
+    handler = make_handler(jsonl_sources, store=store, sync_wait=0.05)
+    handler.receive([forwarded(i) for i in range(30)])  # Only the store has these
+    synced = threading.Event()
+    sync = store.sync
+    store.sync = lambda *args: (sync(*args), synced.set())[0]
+
+    query = Query.parse("EventID in (4625, 4624, 7036) or Message ~ forwarded")
+    first_page = []
+    logs, _ = handler.query_logs(query, batch_callback=lambda batch: first_page.append(synced.is_set()))
+    assert first_page[0] is False  # The first page came while the sync was still running
+    times = list(logs.times)
+    assert times == sorted(times, reverse=True)
+    expected = rows(direct.iter_batches(query)) + [dict(record, LogType=log_type)
+                                                   for log_type, record in map(forwarded, range(30))]
+    assert sorted(map(sort_key, logs)) == sorted(map(sort_key, expected))
+
+    handler._sync_thread.join()
+    assert store.count() == 3 * 2000 + 30
+    assert handler._sync_store(list(jsonl_sources))  # Up to date now: served from the store
+    from_store = rows(handler.iter_batches(query))
+    assert sorted(map(sort_key, from_store)) == sorted(map(sort_key, logs))
+    store.close()
+
+
+def test_without_sync_wait_queries_wait_for_the_sync(tmp_path, jsonl_sources, make_handler):
+    store = EventStore(str(tmp_path / "events.db"))
+    handler = make_handler(jsonl_sources, store=store)
+    logs, counts = handler.query_logs(Query.parse("Channel = System"))
+    assert store.count() == 2000  # Only the queried channel is synced
+    assert len(logs) == counts["System"] == 2000
+    assert logs[0]["TimeGenerated"] <= END.strftime("%Y-%m-%d %H:%M:%S")
+    store.close()
@@ -0,0 +1,179 @@
+import json
+import re
+import threading
+import time
+
+import pytest
+
+import metrics
+from metrics import METRICS, SAMPLE_EVERY, Metrics, SamplingProfiler, timed_filter, timed_map
+from query import Query
+
+PROMETHEUS_LINE = re.compile(r'^([a-z_]+)(?:\{stage="([a-z_]+)"\})? (\S+)$')
+
+
+class FakeClock:
+    """Stands in for time.perf_counter; the workload advances it by known amounts."""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(metrics.time, "perf_counter", clock)
+    return clock
+
+
+def items(clock, count, read_cost):
+    for i in range(count):
+        clock.advance(read_cost(i))
+        yield i
+
+
+@pytest.mark.parametrize("count", [5, SAMPLE_EVERY, SAMPLE_EVERY * 11 + 3])
+def test_timed_map_extrapolates_the_samples(clock, count):
+    registry = Metrics()
+
+    def work(item):
+        clock.advance(0.25)
+        return item * 2
+
+    # The first items cost extra, as opening a file does; they are all timed exactly
+    read_cost = lambda i: 1.0 if i < 4 else 0.5  # noqa: E731
+    results = list(timed_map(work, items(clock, count, read_cost), "read", "construct", "events_read", registry))
+    assert results == [i * 2 for i in range(count)]
+    stages = registry.snapshot()["stages"]
+    assert stages["read"]["calls"] == stages["construct"]["calls"] == count
+    assert stages["read"]["total_seconds"] == pytest.approx(sum(read_cost(i) for i in range(count)))
+    assert stages["construct"]["total_seconds"] == pytest.approx(0.25 * count)
+    assert registry.counters["events_read"] == count
+
+
+def test_timed_map_records_a_partial_read(clock):
+    registry = Metrics()
+    stream = timed_map(lambda item: item, items(clock, 1000, lambda i: 0.5), "read", "construct", metrics=registry)
+    assert [next(stream) for _ in range(100)] == list(range(100))
+    stream.close()
+    assert registry.snapshot()["stages"]["read"] == {"calls": 100, "total_seconds": 50.0, "max_seconds": 0.5,
+                                                      "last_seconds": 50.0}
+
+
+def test_timed_filter_extrapolates_the_samples(clock):
+    registry = Metrics()
+
+    def predicate(item):
+        clock.advance(0.125)
+        return item % 3 == 0
+
+    kept = list(timed_filter(predicate, range(500), "filter", "events_kept", registry))
+    assert kept == list(range(0, 500, 3))
+    assert registry.snapshot()["stages"]["filter"]["total_seconds"] == pytest.approx(0.125 * 500)
+    assert registry.counters["events_kept"] == len(kept)
+
+
+def test_query_counters_and_stages(jsonl_sources, make_handler):
+    handler = make_handler(jsonl_sources)
+    for text, expected in (("", 6000), ("Channel = system", 2000)):
+        METRICS.reset()
+        logs, _ = handler.query_logs(Query.parse(text))
+        snap = METRICS.snapshot()
+        assert len(logs) == expected
+        assert snap["counters"]["events_read"] == snap["counters"]["events_matched"] == expected
+        assert snap["stages"]["read"]["calls"] == snap["stages"]["construct"]["calls"] == expected
+        assert snap["stages"]["fetch"]["calls"] == 1
+    METRICS.reset()
+    logs, _ = handler.query_logs(Query.parse("EventID = 4625"))
+    # The readers skip other EventIDs before building records
+    assert METRICS.counters["events_read"] == METRICS.counters["events_matched"] == len(logs) < 2000
+
+
+def sample_registry():
+    registry = Metrics()
+    registry.inc("events_read", 1234)
+    registry.inc("events_read", 6)
+    registry.inc("merge_queue_full")
+    registry.set_gauge("merge_queue_depth", 3)
+    registry.observe("read", 1.5, 100)
+    registry.observe("read", 0.5, 100)
+    with registry.stage("fetch"):
+        pass
+    return registry
+
+
+def test_prometheus_text_parses():
+    registry = sample_registry()
+    types, samples = {}, {}
+    for line in registry.to_prometheus().splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split()
+            types[name] = kind
+            continue
+        match = PROMETHEUS_LINE.match(line)
+        assert match, line
+        name, stage, value = match.groups()
+        assert name in types  # Every sample follows its TYPE line
+        samples[name, stage] = float(value)
+    assert types["seclog_events_read_total"] == "counter" and types["seclog_merge_queue_depth"] == "gauge"
+    assert samples["seclog_events_read_total", None] == 1240
+    assert samples["seclog_merge_queue_full_total", None] == 1
+    assert samples["seclog_merge_queue_depth", None] == 3
+    assert samples["seclog_stage_calls_total", "read"] == 200
+    assert samples["seclog_stage_seconds_total", "read"] == 2.0
+    assert samples["seclog_stage_seconds_max", "read"] == 0.015
+    assert samples["seclog_stage_calls_total", "fetch"] == 1
+    assert ("seclog_uptime_seconds", None) in samples
+
+
+def test_json_output_and_write(tmp_path, capsys):
+    registry = sample_registry()
+    data = json.loads(registry.to_json())
+    assert data["counters"] == {"events_read": 1240, "merge_queue_full": 1}
+    assert data["gauges"] == {"merge_queue_depth": 3}
+    assert data["stages"]["read"] == {"calls": 200, "total_seconds": 2.0, "max_seconds": 0.015,
+                                      "last_seconds": 0.5}
+    registry.write(str(tmp_path / "metrics.json"), "json")
+    assert json.loads((tmp_path / "metrics.json").read_text(encoding="utf-8"))["counters"] == data["counters"]
+    registry.write(str(tmp_path / "metrics.prom"))
+    assert "seclog_events_read_total 1240\n" in (tmp_path / "metrics.prom").read_text(encoding="utf-8")
+    registry.write("-")
+    assert "seclog_events_read_total 1240" in capsys.readouterr().err
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def spin_in_a_known_function(stop):
+    while not stop.is_set():
+        sum(range(100))
+
+
+def test_sampling_profiler_collapsed_stacks(tmp_path):
+    stop = threading.Event()
+    worker = threading.Thread(target=spin_in_a_known_function, args=(stop,), name="busy-worker")
+    worker.start()
+    try:
+        with SamplingProfiler(interval=0.001) as profiler:
+            time.sleep(0.2)
+    finally:
+        stop.set()
+        worker.join()
+    assert profiler.samples > 10
+    lines = profiler.collapsed().splitlines()
+    counts = []
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        counts.append(int(count))
+        frames = stack.split(";")
+        assert all(frames)
+        assert frames[0] != "seclog-profiler"  # The profiler does not sample itself
+    assert counts == sorted(counts, reverse=True)
+    busy = [line for line in lines if line.startswith("busy-worker;")]
+    assert busy and all("spin_in_a_known_function (test_metrics.py:" in line for line in busy)
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in busy) <= profiler.samples
+    path = profiler.dump(str(tmp_path / "profiles" / "fetch.folded"))
+    assert open(path, encoding="utf-8").read() == profiler.collapsed()
@@ -0,0 +1,91 @@
+import os
+import threading
+
+import pytest
+
+from conftest import END, write_jsonl
+from event_sources import JsonlFileSource, SyntheticEventSource
+from parallel_fetch import merge_jobs, read_channel, split_source
+
+
+def jobs_for(sources, chunk_bytes=1 << 30):
+    return [(read_channel, (log_type, part, None, None)) for log_type, source in sources.items()
+            for part in split_source(source, chunk_bytes)]
+
+
+@pytest.mark.parametrize("max_workers, queue_size", [(1, 8), (2, 1), (3, 8), (None, 2)])
+def test_merge_is_newest_first_across_channels(jsonl_sources, max_workers, queue_size):
+    merged = list(merge_jobs(jobs_for(jsonl_sources), max_workers, queue_size=queue_size))
+    times = [record["TimeGenerated"] for _, record in merged]
+    assert times == sorted(times, reverse=True)
+    for log_type, source in jsonl_sources.items():
+        # Every channel's events, each exactly once and in the channel's own order
+        assert [record for t, record in merged if t == log_type] == list(source.read())
+    assert len(merged) == 6000
+
+
+def test_merge_of_file_chunks_and_channels(jsonl_sources):
+    jobs = jobs_for(jsonl_sources, chunk_bytes=40000)
+    assert len(jobs) > 6
+    merged = list(merge_jobs(jobs, max_workers=4, queue_size=2))
+    times = [record["TimeGenerated"] for _, record in merged]
+    assert times == sorted(times, reverse=True)
+    assert sorted(map(repr, merged)) == sorted(map(repr, merge_jobs(jobs_for(jsonl_sources), 1)))
+
+
+def test_merge_stops_its_workers_when_closed(jsonl_sources):
+    before = set(threading.enumerate())
+    stream = merge_jobs(jobs_for(jsonl_sources), max_workers=3, queue_size=1)
+    first = [next(stream) for _ in range(10)]
+    workers = set(threading.enumerate()) - before
+    assert len(workers) == 3
+    stream.close()
+    for worker in workers:
+        worker.join(5)
+    assert not any(worker.is_alive() for worker in workers)
+    assert [r["TimeGenerated"] for _, r in first] == sorted((r["TimeGenerated"] for _, r in first), reverse=True)
+
+
+@pytest.fixture
+def jsonl_file(tmp_path):
+    path = str(tmp_path / "Security.jsonl")
+    write_jsonl(path, SyntheticEventSource("Security", count=300, end=END).read())
+    return path
+
+
+def line_starts(path):
+    starts, offset = [], 0
+    with open(path, "rb") as f:
+        for line in f:
+            starts.append(offset)
+            offset += len(line)
+    return starts
+
+
+@pytest.mark.parametrize("chunk_bytes", [7, 97, 500, 4096, None])
+def test_split_source_reads_every_record_once(jsonl_file, chunk_bytes):
+    source = JsonlFileSource(jsonl_file, "Security", order="desc")
+    size = os.path.getsize(jsonl_file)
+    if chunk_bytes is None:
+        chunk_bytes = line_starts(jsonl_file)[40] + 5  # The first boundary falls in the middle of a line
+    parts = split_source(source, chunk_bytes)
+    assert len(parts) == -(-size // chunk_bytes)
+    assert parts[0].byte_range[0] == 0 and parts[-1].byte_range[1] == size
+    rows = [row for part in parts for row in part._iter_rows()]
+    assert rows == list(source._iter_rows())
+    assert [r for part in parts for r in part.read()] == list(source.read())
+
+
+def test_split_source_boundaries(jsonl_file):
+    source = JsonlFileSource(jsonl_file, "Security", order="desc")
+    starts = line_starts(jsonl_file)
+    whole = list(source._iter_rows())
+    # A chunk ending mid-line owns that line; a chunk starting at a line start owns that line
+    straddle = JsonlFileSource(jsonl_file, "Security", "desc", byte_range=(0, starts[10] + 3))
+    after = JsonlFileSource(jsonl_file, "Security", "desc", byte_range=(starts[10] + 3, starts[20]))
+    at_start = JsonlFileSource(jsonl_file, "Security", "desc", byte_range=(starts[20], starts[21]))
+    assert list(straddle._iter_rows()) == whole[:11]
+    assert list(after._iter_rows()) == whole[11:20]
+    assert list(at_start._iter_rows()) == whole[20:21]
+    assert split_source(source, os.path.getsize(jsonl_file)) == [source]
+    assert split_source(straddle, 10) == [straddle]  # Already a chunk
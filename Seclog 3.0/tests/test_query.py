@@ -0,0 +1,118 @@
+from datetime import datetime
+
+import pytest
+
+from conftest import write_jsonl
+from event_batch import EventBatch, to_epoch
+from event_sources import LOCAL_HOST, JsonlFileSource
+from event_store import EventStore
+from query import And, Compare, Not, Or, Query, QueryError, Term
+from templates import TemplateMiner
+
+NOW = datetime(2024, 6, 1, 12, 0, 0)
+
+RECORDS = [
+    ("Security", {"TimeGenerated": "2024-06-01 11:30:00", "SourceName": "Microsoft-Windows-Security-Auditing",
+                  "EventID": "4625", "EventType": "16", "Category": "12544",
+                  "Message": "An account failed to log on. Account Name: administrator"}),
+    ("Security", {"TimeGenerated": "2024-06-01 11:40:00", "SourceName": "Microsoft-Windows-Security-Auditing",
+                  "EventID": "4625", "EventType": "16", "Category": "12544",
+                  "Message": "An account failed to log on. Account Name: alice"}),
+    ("Security", {"TimeGenerated": "2024-05-01 08:00:00", "SourceName": "Microsoft-Windows-Security-Auditing",
+                  "EventID": "4624", "EventType": "8", "Category": "12544",
+                  "Message": "An account was successfully logged on. Account Name: alice"}),
+    ("System", {"TimeGenerated": "2024-06-01 09:00:00", "SourceName": "Service Control Manager",
+                "EventID": "7036", "EventType": "4", "Category": "0",
+                "Message": "The Windows Update service entered the running state."}),
+    ("Application", {"TimeGenerated": "2024-06-01 11:59:00", "SourceName": "Application Error",
+                     "EventID": "1000", "EventType": "1", "Category": "100",
+                     "Message": "Faulting application svchost.exe, version 10.0"}),
+]
+CHANNELS = ["Security", "System", "Application"]
+
+
+@pytest.fixture
+def handlers(tmp_path, make_handler):
+    """A LogHandler reading RECORDS from JSONL files directly, and one answering from an EventStore."""
+    sources = {}
+    for channel in CHANNELS:
+        path = str(tmp_path / f"{channel}.jsonl")
+        records = [record for log_type, record in RECORDS if log_type == channel]
+        write_jsonl(path, sorted(records, key=lambda record: record["TimeGenerated"], reverse=True))
+        sources[channel] = JsonlFileSource(path, channel, order="desc")
+    return make_handler(sources), make_handler(sources, store=EventStore(str(tmp_path / "events.db")))
+
+
+def run(handler, text):
+    """The indexes of RECORDS that handler.query_logs returns for 'text', in the order returned."""
+    logs, _ = handler.query_logs(Query.parse(text, NOW))
+    index = {record["TimeGenerated"]: i for i, (_, record) in enumerate(RECORDS)}
+    return [index[time] for time in (record["TimeGenerated"] for record in logs)]
+
+
+def test_parse_trees():
+    assert repr(Query.parse("EventID in (4624, 4625) and Source = Foo").tree) == repr(
+        And([Compare("EventID", "in", frozenset({4624, 4625})), Compare("SourceName", "=", "foo")]))
+    assert repr(Query.parse('not Type in (4, 8) or "Failed Logon" admin').tree) == repr(
+        Or([Not(Compare("EventType", "in", frozenset({4, 8}))), And([Term("failed logon"), Term("admin")])]))
+    assert repr(Query.parse("Host not in (web01)").tree) == repr(Not(Compare("Host", "in", frozenset({"web01"}))))
+    assert repr(Query.parse("time > now-2h", NOW).tree) == repr(
+        Compare("TimeGenerated", ">", to_epoch(datetime(2024, 6, 1, 10, 0, 0))))
+    assert not Query.parse("   ")
+
+
+@pytest.mark.parametrize("text, message", [
+    ("EventID = ", "at the end of the query"),
+    ("EventID = abc", "needs a number"),
+    ("Colour = red", "unknown field"),
+    ("Message < 5", "cannot be used"),
+    ("(EventID = 1", r"expected '\)'"),
+    ("time > someday", "is not a time"),
+    ("EventID = 1 )", "unexpected"),
+    ("Source not = x", "expected a condition"),
+])
+def test_parse_errors(text, message):
+    with pytest.raises(QueryError, match=message):
+        Query.parse(text, NOW)
+
+
+def test_plan_pushes_down_selective_conditions():
+    plan = Query.parse("Channel = security and EventID in (4624, 4625) and time >= now-1d and Host = web01",
+                       NOW).plan(CHANNELS)
+    assert plan.log_types == ["Security"]
+    assert plan.event_ids == {4624, 4625}
+    assert plan.start_dt == datetime(2024, 5, 31, 12, 0, 0)
+    assert plan.host_names == {"web01"}
+    assert Query.parse("EventID = 1 and EventID = 2").plan(CHANNELS).log_types == []  # Contradiction
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("", [0, 1, 2, 3, 4]),
+    ("EventID = 4625", [0, 1]),
+    ("EventID != 4625 and Channel != application", [2, 3]),
+    ("time > now-1h", [0, 1, 4]),
+    ("time >= 2024-06-01 and Type in (1, 4)", [3, 4]),
+    ("Message ~ alice", [1, 2]),
+    ("Message !~ account", [3, 4]),
+    ('"failed to log on" administrator', [0]),
+    ("Source = \"service control manager\" or EventID = 1000", [3, 4]),
+    ("Source ~ auditing and not (Message ~ administrator)", [1, 2]),
+    ("Category > 100 or svchost", [0, 1, 2, 4]),
+    ("Channel in (system, application) and EventID < 7036", [4]),
+    (f'Host = "{LOCAL_HOST}" and EventID = 4624', [2]),
+    ("Host = web01", []),  # Only forwarded events come from other hosts
+])
+def test_store_and_readers_agree(handlers, text, expected):
+    direct, cached = handlers
+    results = run(direct, text)
+    assert results == run(cached, text)
+    assert sorted(results) == expected
+    assert results == sorted(results, key=lambda i: RECORDS[i][1]["TimeGenerated"], reverse=True)
+
+
+@pytest.mark.parametrize("templates", [None, TemplateMiner()])
+def test_compiled_filter_on_a_batch(templates):
+    batch = EventBatch.from_records(RECORDS, templates)
+    plan = Query.parse("Message ~ alice or Source = \"application error\"", NOW).plan(CHANNELS)
+    assert [record["TimeGenerated"] for record in plan.apply(batch)] == [
+        "2024-06-01 11:40:00", "2024-05-01 08:00:00", "2024-06-01 11:59:00"]
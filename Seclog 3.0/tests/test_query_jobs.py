@@ -0,0 +1,115 @@
+import threading
+
+import pytest
+
+from conftest import END, write_jsonl
+from event_batch import EventBatch
+from event_sources import JsonlFileSource, SyntheticEventSource
+from log_handler import FIRST_BATCH_SIZE
+from query import Query
+from query_jobs import QueryJob, QueryScheduler
+
+
+class CountingSource(JsonlFileSource):
+    """A JSONL source that counts the rows it has read."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rows_read = 0
+
+    def _iter_rows(self):
+        for row in super()._iter_rows():
+            self.rows_read += 1
+            yield row
+
+
+@pytest.fixture
+def big_source(tmp_path):
+    path = str(tmp_path / "Security.jsonl")
+    write_jsonl(path, SyntheticEventSource("Security", count=50000, end=END).read())
+    return CountingSource(path, "Security", order="desc")
+
+
+class Recorder:
+    """Collects a job's pages and its done_callback arguments."""
+    def __init__(self):
+        self.pages = []
+        self.done = threading.Event()
+        self.result = None
+
+    def page(self, page, matched):
+        self.pages.append((page, matched))
+
+    def finish(self, logs, counts, alerts, error, cancelled):
+        self.result = {"logs": logs, "counts": counts, "error": error, "cancelled": cancelled}
+        self.done.set()
+
+
+def test_job_pages_follow_on_newest_first(jsonl_sources, make_handler):
+    handler = make_handler(jsonl_sources)
+    recorder = Recorder()
+    QueryJob(handler, Query.parse(""), recorder.page, recorder.finish, page_interval=0).run()
+    result = recorder.result
+    assert result["error"] is None and result["cancelled"] is False
+    # The readers hand over a small first batch and then one large one; each became a page
+    assert [len(page) for page, _ in recorder.pages] == [FIRST_BATCH_SIZE, 6000 - FIRST_BATCH_SIZE]
+    assert [matched for _, matched in recorder.pages] == [FIRST_BATCH_SIZE, 6000]
+    joined = EventBatch.concat(page for page, _ in recorder.pages)
+    assert list(joined.times) == list(result["logs"].times) == sorted(joined.times, reverse=True)
+    assert result["counts"] == {"Security": 2000, "System": 2000, "Application": 2000}
+
+
+def test_cancel_stops_the_reader(big_source, make_handler):
+    handler = make_handler({"Security": big_source})
+    recorder = Recorder()
+    job = QueryJob(handler, Query.parse(""), lambda page, matched: job.cancel(), recorder.finish, page_interval=0)
+    job.run()
+    assert recorder.result["cancelled"] is True
+    assert len(recorder.result["logs"]) < 50000
+    assert big_source.rows_read < 25000  # The reader stopped soon after the first page
+
+
+def test_new_query_supersedes_the_running_one(big_source, make_handler):
+    handler = make_handler({"Security": big_source})
+    scheduler = QueryScheduler()
+    first, second = Recorder(), Recorder()
+    started = threading.Event()
+
+    def first_page(page, matched):
+        started.set()
+        first.page(page, matched)
+
+    old = scheduler.submit(QueryJob(handler, Query.parse(""), first_page, first.finish, page_interval=0))
+    assert started.wait(10)
+    new = scheduler.submit(QueryJob(handler, Query.parse("EventID = 4625"), second.page, second.finish))
+    assert old.cancelled and not new.cancelled
+    assert first.done.wait(10) and second.done.wait(30)
+    assert first.result["cancelled"] is True
+    assert second.result["cancelled"] is False and second.result["error"] is None
+    assert len(second.result["logs"]) == sum(len(page) for page, _ in second.pages)
+    assert set(second.result["logs"].event_ids) == {4625}
+    assert scheduler.active is None
+
+
+@pytest.mark.parametrize("key, reverse", [("EventID", False), ("Message", True), ("TimeGenerated", False)])
+def test_pages_merged_into_a_sorted_table(jsonl_sources, make_handler, monkeypatch, key, reverse):
+    log_table = pytest.importorskip("log_table")
+    handler = make_handler(jsonl_sources)
+    recorder = Recorder()
+    QueryJob(handler, Query.parse(""), recorder.page, recorder.finish, page_interval=0).run()
+    pages = [page.take(range(start, min(start + 700, len(page))))
+             for page, _ in recorder.pages for start in range(0, len(page), 700)]
+
+    # The table's data side only; drawing needs a display
+    table = log_table.VirtualLogTable.__new__(log_table.VirtualLogTable)
+    table.__dict__.update(_rows=[], _order=None, _sort_values=None, _sort_key=None, _sort_reverse=False,
+                          _top=0, _message="")
+    monkeypatch.setattr(table, "_render", lambda: None)
+    results = pages[0]  # As SecurityLogApp._show_query_page: the first page is adopted, later ones appended
+    table.set_rows(results)
+    table.sort_by(key, reverse)
+    for page in pages[1:]:
+        results.extend(page)
+        table.rows_appended()
+    assert len(pages) > 5
+    expected = results.sort_order(key, reverse)
+    assert [table.row(i) for i in range(len(table))] == [results[i] for i in expected]
@@ -0,0 +1,32 @@
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from rules import load_rules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_rules_do_not_import_yaml():
+    code = "import sys, rules; print('yaml' in sys.modules)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == "False"
+
+
+def test_json_rules_replace_built_in_ones(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({"rules": [{"id": "brute-force-logon", "title": "Mine", "event_ids": [4625]}]}))
+    specs = {spec["id"]: spec for spec in load_rules([str(path)])}
+    assert specs["brute-force-logon"]["title"] == "Mine"
+
+
+@pytest.mark.skipif(importlib.util.find_spec("yaml") is not None, reason="PyYAML is installed")
+def test_yaml_rules_without_pyyaml(tmp_path):
+    path = tmp_path / "rules.yaml"
+    path.write_text("rules: []\n")
+    with pytest.raises(ValueError, match="PyYAML"):
+        load_rules([str(path)])
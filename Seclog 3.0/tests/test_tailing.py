@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from aggregation import EventAggregator, template_keys
+from event_sources import TIME_FORMAT
+from tailing import AdaptiveInterval, CursorStore, LiveWindow
+
+
+def record(age, message="Logon failed for alice", event_id=4625):
+    """A record from 'age' seconds ago."""
+    return {"TimeGenerated": (datetime.now() - timedelta(seconds=age)).strftime(TIME_FORMAT),
+            "SourceName": "TailingTest", "EventID": str(event_id), "EventType": "16", "Category": "12544",
+            "Message": message}
+
+
+def summary(aggregator):
+    return (aggregator.total, aggregator.event_ids, aggregator.log_types,
+            sorted(aggregator.top("templates", 100)))
+
+
+def counts_of(pairs):
+    """The aggregator summary of (log_type, record) pairs, for comparison with a window's aggregator."""
+    aggregator = EventAggregator()
+    for log_type, record_ in pairs:
+        aggregator.add([record_], log_type, template_keys([record_]))
+    return summary(aggregator)
+
+
+def test_cursor_store_round_trip(tmp_path):
+    path = str(tmp_path / "state" / "cursors.json")
+    store = CursorStore(path)
+    assert store.get("Security") is None
+    store.set("Security", {"record": 1234, "time": "2024-06-01 12:00:00"})
+    store.set("app.jsonl", {"position": 5678, "time": None})
+    store.save()
+    assert not (tmp_path / "state" / "cursors.json.tmp").exists()
+    loaded = CursorStore(path)
+    assert loaded.get("Security") == {"record": 1234, "time": "2024-06-01 12:00:00"}
+    assert loaded.cursors == store.cursors
+
+
+def test_cursor_store_ignores_a_corrupt_file(tmp_path, capsys):
+    path = tmp_path / "cursors.json"
+    path.write_text('{"Security": ', encoding="utf-8")
+    assert CursorStore(str(path)).cursors == {}
+    assert "Could not load cursors" in capsys.readouterr().err
+
+
+def test_window_evicts_by_count():
+    window = LiveWindow(max_events=100, max_age=None)
+    appended = []
+    for i in range(25):
+        log_type = ("Security", "System")[i % 2]
+        batch = [record(1000 - i * 10 - j, f"Logon failed for user{j % 4}", 4624 + j % 3) for j in range(10)]
+        evicted = window.append(log_type, batch)
+        appended.extend((log_type, r) for r in batch)
+        assert len(evicted) == (10 if len(appended) > 100 else 0)
+        kept = appended[-100:]
+        assert len(window) == len(kept)
+        assert summary(window.aggregator) == counts_of(kept)
+    assert window.snapshot() == [r for _, r in reversed(kept)]
+    assert [window[i] for i in range(len(window))] == window.snapshot()
+    assert window[-1] is kept[0][1]
+    with pytest.raises(IndexError):
+        window[100]
+
+
+def test_window_evicts_by_age():
+    window = LiveWindow(max_events=1000, max_age=timedelta(minutes=10))
+    old = [record(3600 - i) for i in range(5)]
+    recent = [record(60 - i, "Service stopped", 7036) for i in range(5)]
+    evicted = window.append("Security", old)  # Already too old when they arrive
+    assert [entry[1] for entry in evicted] == old
+    assert len(window) == 0 and summary(window.aggregator) == counts_of([])
+    assert window.append("System", recent) == []
+    assert window.snapshot() == recent[::-1]
+    assert summary(window.aggregator) == counts_of([("System", r) for r in recent])
+    assert window.counts() == {"System": 5}
+    window.clear()
+    assert len(window) == 0 and window.aggregator.total == 0
+
+
+def test_adaptive_interval():
+    interval = AdaptiveInterval(minimum=0.5, maximum=10.0, initial=2.0)
+    assert [interval.update(3) for _ in range(3)] == [1.0, 0.5, 0.5]
+    assert [interval.update(0) for _ in range(3)] == [0.75, 1.125, 1.6875]
+    for _ in range(20):
+        interval.update(0)
+    assert interval.current == 10.0
+    assert interval.update(1) == 5.0
@@ -0,0 +1,105 @@
+import threading
+
+import pytest
+
+from templates import LITERAL, MAX_TOKENS, SEPARATOR, TemplateMiner, pattern_counts
+
+MESSAGES = [
+    "An account failed to log on. Account Name: alice Logon Type: 3",
+    "An account failed to log on. Account Name: bob Logon Type: 3",
+    "An account failed to log on. Account Name: carol Logon Type: 10",
+    "An account failed to log on. Account Name: {dave} Logon Type: 3",
+    "Something completely different happened to the quick brown fox today",
+    "  leading and trailing spaces  ",
+    "",
+    "contains a separator \x1f here",
+    " ".join(["word"] * (MAX_TOKENS + 1)),
+    "The service entered the running state.",
+]
+
+
+@pytest.mark.parametrize("message", MESSAGES)
+def test_encode_decode_round_trip(message):
+    miner = TemplateMiner()
+    for other in MESSAGES:
+        miner.encode("Test", 4625, other)
+    template_id, inserts = miner.encode("Test", 4625, message)
+    assert miner.text(template_id, inserts) == message
+    assert miner.lower(template_id, inserts) == message.lower()
+
+
+def test_long_or_separator_messages_are_literal():
+    miner = TemplateMiner()
+    assert miner.encode("Test", 1, "a\x1fb") == (LITERAL, "a\x1fb")
+    long_message = " ".join(["word"] * (MAX_TOKENS + 1))
+    assert miner.encode("Test", 1, long_message) == (LITERAL, long_message)
+
+
+def test_generalization_keeps_old_rows_decodable():
+    miner = TemplateMiner()
+    first = miner.encode("Test", 4625, "Logon failed for alice")
+    second = miner.encode("Test", 4625, "Logon failed for bob")
+    assert first[0] != second[0]
+    assert miner.text(*first) == "Logon failed for alice"
+    assert miner.templates[first[0]].root() is miner.templates[second[0]]
+    assert miner.templates[second[0]].pattern() == "Logon failed for <*>"
+    assert SEPARATOR not in second[1]
+
+
+def test_contains():
+    miner = TemplateMiner()
+    encoded = [miner.encode("Test", 4625, message) for message in MESSAGES]
+    for term in ("failed", "bob", "log on. account", "type: 10", "brown fox", "zzz"):
+        test = miner.contains(term)
+        assert [test(*pair) for pair in encoded] == [term in message.lower() for message in MESSAGES]
+
+
+def test_load_restores_templates_and_links():
+    miner = TemplateMiner()
+    encoded = [miner.encode("Test", 4625, message) for message in MESSAGES]
+    rows = {row[0]: row for row in miner.pop_changes()}  # Linked templates appear again, as in the store
+    restored = TemplateMiner()
+    restored.load(rows[template_id] for template_id in sorted(rows))
+    assert [restored.text(*pair) for pair in encoded] == MESSAGES
+    assert [t.root().id for t in restored.templates] == [t.root().id for t in miner.templates]
+
+
+def test_counts_roll_up_into_successors():
+    miner = TemplateMiner()
+    messages = ["Logon failed for alice", "Logon failed for bob", "Logon failed for carol", "x y"]
+    encoded = [miner.encode("Test", 4625, message) for message in messages]
+    template_ids, inserts = zip(*encoded)
+    counts = miner.count_templates([4625] * 4, template_ids, inserts)
+    assert pattern_counts(counts) == {(4625, "Logon failed for <*>"): 3, (4625, "x y"): 1}
+
+
+def test_learn_reuses_a_template_another_thread_learned():
+    miner = TemplateMiner()
+    words = "The service entered the running state.".split(" ")
+    key = ("Test", 7036, len(words))
+    # Two threads that both missed in encode() reach _learn one after the other
+    first = miner._learn(key, words)
+    assert miner._learn(key, words) is first
+    assert len(miner) == 1
+
+
+def test_concurrent_encoding_learns_each_template_once():
+    miner = TemplateMiner()
+    messages = [f"Service number{i % 4} entered the running state." for i in range(400)]
+    barrier = threading.Barrier(8)
+    results = [None] * 8
+
+    def encode(n):
+        barrier.wait()
+        results[n] = [miner.encode("Test", 7036, message) for message in messages]
+
+    threads = [threading.Thread(target=encode, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    patterns = [template.pattern() for template in miner.templates]
+    assert len(patterns) == len(set(patterns))
+    assert len(miner) <= 2  # The first message's template, then its generalization
+    for encoded in results:
+        assert [miner.text(*pair) for pair in encoded] == messages
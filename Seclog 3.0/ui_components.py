@@ -1,9 +1,12 @@
 import customtkinter as ctk
-import tkinter as tk
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from collections import Counter
-from datetime import datetime
+
+from event_sources import EVENT_TYPE_LABELS
+from log_table import VirtualLogTable
+from metrics import METRICS
+from rules import format_alert
+
+MAX_ALERT_LINES = 1000  # Oldest alerts drop off the Alerts tab beyond this
+TEMPLATE_TEXT_LENGTH = 160  # Longer templates are cut short on the Summary tab
 
 # This file contains functions that create or update parts of the UI.
 # This helps keep the main application class cleaner.
@@ -22,21 +25,17 @@ def create_sidebar(parent, app_instance):
     app_instance.stop_button = ctk.CTkButton(sidebar, text="⛔ Stop Real-Time", command=app_instance.stop_real_time_monitoring, height=40, state="disabled")
     app_instance.stop_button.grid(row=2, column=0, padx=20, pady=10, sticky="ew")
     
-    app_instance.log_type = ctk.StringVar(value="All")
-    log_type_menu = ctk.CTkOptionMenu(sidebar, values=["All", "Security", "System", "Application"], variable=app_instance.log_type)
-    log_type_menu.grid(row=3, column=0, padx=20, pady=10, sticky="ew")
-    
-    app_instance.start_date_entry = ctk.CTkEntry(sidebar, placeholder_text="Start Date (YYYY-MM-DD)")
-    app_instance.start_date_entry.grid(row=4, column=0, padx=20, pady=(10, 5), sticky="ew")
-    app_instance.end_date_entry = ctk.CTkEntry(sidebar, placeholder_text="End Date (YYYY-MM-DD)")
-    app_instance.end_date_entry.grid(row=5, column=0, padx=20, pady=(0, 10), sticky="ew")
-    
-    app_instance.filter_entry = ctk.CTkEntry(sidebar, placeholder_text="🔎 Keyword")
-    app_instance.filter_entry.grid(row=6, column=0, padx=20, pady=(10, 5), sticky="ew")
-    
+    app_instance.query_entry = ctk.CTkEntry(sidebar, placeholder_text="🔎 Query, e.g. EventID = 4625 and time > now-2h")
+    app_instance.query_entry.grid(row=3, column=0, padx=20, pady=(10, 5), sticky="ew")
+    app_instance.query_entry.bind("<Return>", lambda e: app_instance.search_logs())
+    ctk.CTkLabel(sidebar, text="Fields: EventID Source Channel Host\nType Category Message Time\n"
+                               "Ops: = != < > ~ in (...) and or not",
+                 font=ctk.CTkFont(size=11), justify="left").grid(row=4, column=0, padx=20, pady=(0, 10), sticky="w")
+
     ctk.CTkButton(sidebar, text="🔍 Fetch Logs", command=app_instance.search_logs, height=40).grid(row=7, column=0, padx=20, pady=10, sticky="ew")
     ctk.CTkButton(sidebar, text="🔄 Reset Filters", command=app_instance.reset_filters, height=40).grid(row=8, column=0, padx=20, pady=10, sticky="ew")
-    ctk.CTkButton(sidebar, text="💾 Export to CSV", command=app_instance.save_filtered_logs, height=40).grid(row=9, column=0, padx=20, pady=10, sticky="ew")
+    ctk.CTkButton(sidebar, text="💾 Export Logs", command=app_instance.save_filtered_logs, height=40).grid(row=9, column=0, padx=20, pady=10, sticky="ew")
+    ctk.CTkButton(sidebar, text="🗄️ Rebuild Cache", command=app_instance.rebuild_cache, height=40).grid(row=10, column=0, padx=20, pady=10, sticky="ew")
     ctk.CTkButton(sidebar, text="🌓 Toggle Theme", command=toggle_theme, height=40).grid(row=12, column=0, padx=20, pady=10, sticky="ew")
 
     ctk.CTkLabel(sidebar, text="v1.1", font=ctk.CTkFont(size=12, slant="italic")).grid(row=17, column=0, pady=(10, 10))
@@ -49,6 +48,8 @@ def create_main_tabs(parent, app_instance):
     dashboard_tab = tabs.add("Dashboard")
     logs_tab = tabs.add("Logs")
     summary_tab = tabs.add("Summary")
+    alerts_tab = tabs.add("Alerts")
+    diagnostics_tab = tabs.add("Diagnostics")
 
     # --- Dashboard Tab ---
     dashboard_tab.grid_columnconfigure((0, 1, 2), weight=1)
@@ -72,8 +73,19 @@ def create_main_tabs(parent, app_instance):
 
     app_instance.logs_label = ctk.CTkLabel(logs_tab, text="Click 'Fetch Logs' to begin", font=ctk.CTkFont(size=18, weight="bold"))
     app_instance.logs_label.grid(row=0, column=0, pady=(10, 5))
-    app_instance.log_textbox = ctk.CTkTextbox(logs_tab, wrap="none", corner_radius=8, font=("Courier New", 12))
-    app_instance.log_textbox.grid(row=1, column=0, sticky="nsew", padx=10, pady=10)
+    app_instance.jump_entry = ctk.CTkEntry(logs_tab, placeholder_text="Go to row #", width=120)
+    app_instance.jump_entry.grid(row=0, column=1, padx=10, pady=(10, 5))
+    app_instance.jump_entry.bind("<Return>", lambda e: jump_to_row(app_instance))
+    app_instance.query_cancel_button = ctk.CTkButton(logs_tab, text="✖ Cancel Query", command=app_instance.cancel_query, width=120)
+    app_instance.query_cancel_button.grid(row=0, column=2, padx=(0, 10), pady=(10, 5))
+    show_query_progress(app_instance, False)
+    app_instance.log_table = VirtualLogTable(logs_tab, corner_radius=8, font=("Courier New", 12))
+    app_instance.log_table.grid(row=1, column=0, columnspan=3, sticky="nsew", padx=10, pady=10)
+    app_instance.export_progress = ctk.CTkProgressBar(logs_tab)
+    app_instance.export_progress.grid(row=2, column=0, sticky="ew", padx=10, pady=(0, 10))
+    app_instance.export_cancel_button = ctk.CTkButton(logs_tab, text="✖ Cancel Export", command=app_instance.cancel_export, width=120)
+    app_instance.export_cancel_button.grid(row=2, column=1, padx=10, pady=(0, 10))
+    show_export_progress(app_instance, False)
 
     # --- Summary Tab ---
     summary_tab.grid_columnconfigure((0, 1, 2), weight=1)
@@ -84,24 +96,108 @@ def create_main_tabs(parent, app_instance):
     app_instance.source_summary_frame.grid(row=0, column=1, padx=10, pady=10, sticky="nsew")
     app_instance.event_type_summary_frame = ctk.CTkScrollableFrame(summary_tab, label_text="Event Type Summary")
     app_instance.event_type_summary_frame.grid(row=0, column=2, padx=10, pady=10, sticky="nsew")
+    summary_tab.grid_rowconfigure(1, weight=1)
+    app_instance.template_summary_frame = ctk.CTkScrollableFrame(summary_tab, label_text="Top Message Templates")
+    app_instance.template_summary_frame.grid(row=1, column=0, columnspan=3, padx=10, pady=(0, 10), sticky="nsew")
+    app_instance.summary_label_pools = {}
+
+    # --- Alerts Tab ---
+    alerts_tab.grid_columnconfigure(0, weight=1)
+    alerts_tab.grid_rowconfigure(1, weight=1)
+    app_instance.alerts_label = ctk.CTkLabel(alerts_tab, text="No alerts", font=ctk.CTkFont(size=18, weight="bold"))
+    app_instance.alerts_label.grid(row=0, column=0, pady=(10, 5))
+    app_instance.alerts_text = ctk.CTkTextbox(alerts_tab, font=("Courier New", 12), wrap="none")
+    app_instance.alerts_text.grid(row=1, column=0, padx=10, pady=(0, 10), sticky="nsew")
+    app_instance.alerts_text.configure(state="disabled")
+    app_instance.alert_count = 0
+
+    # --- Diagnostics Tab ---
+    diagnostics_tab.grid_columnconfigure(3, weight=1)
+    diagnostics_tab.grid_rowconfigure(1, weight=1)
+    ctk.CTkButton(diagnostics_tab, text="🔥 Profile Next Fetch", command=app_instance.request_profile).grid(row=0, column=0, padx=10, pady=10)
+    ctk.CTkButton(diagnostics_tab, text="💾 Save Metrics", command=app_instance.save_metrics).grid(row=0, column=1, padx=10, pady=10)
+    ctk.CTkButton(diagnostics_tab, text="↺ Reset", command=METRICS.reset, width=80).grid(row=0, column=2, padx=10, pady=10)
+    app_instance.profile_label = ctk.CTkLabel(diagnostics_tab, text="", anchor="w")
+    app_instance.profile_label.grid(row=0, column=3, padx=10, pady=10, sticky="ew")
+    app_instance.diagnostics_text = ctk.CTkTextbox(diagnostics_tab, font=("Courier New", 12), wrap="none")
+    app_instance.diagnostics_text.grid(row=1, column=0, columnspan=4, padx=10, pady=(0, 10), sticky="nsew")
+    app_instance.diagnostics_text.configure(state="disabled")
+    app_instance.main_tabs = tabs
+
+def show_alerts(app_instance, alerts, append=False):
+    """Lists alerts newest first; 'append' adds to the list instead of replacing it."""
+    text = app_instance.alerts_text
+    text.configure(state="normal")
+    if not append:
+        text.delete("1.0", "end")
+        app_instance.alert_count = 0
+    if alerts:
+        text.insert("1.0", "".join(format_alert(alert) + "\n" for alert in reversed(alerts[-MAX_ALERT_LINES:])))
+        text.delete(f"{MAX_ALERT_LINES + 1}.0", "end")
+    text.configure(state="disabled")
+    app_instance.alert_count += len(alerts)
+    app_instance.alerts_label.configure(text=f"🚨 {app_instance.alert_count} alerts" if app_instance.alert_count else "No alerts")
+
+def create_status_bar(parent, app_instance):
+    """Creates the status bar along the bottom of the window."""
+    app_instance.status_bar = ctk.CTkLabel(parent, text="", anchor="w", font=ctk.CTkFont(size=12))
+    app_instance.status_bar.grid(row=1, column=0, columnspan=2, padx=10, pady=(0, 5), sticky="ew")
+
+def update_diagnostics(app_instance):
+    """Refreshes the status bar and, while it is shown, the Diagnostics tab."""
+    app_instance.status_bar.configure(text=METRICS.status_text())
+    if app_instance.main_tabs.get() != "Diagnostics":
+        return
+    text = METRICS.report()
+    app_instance.diagnostics_text.configure(state="normal")
+    app_instance.diagnostics_text.delete("1.0", "end")
+    app_instance.diagnostics_text.insert("1.0", text)
+    app_instance.diagnostics_text.configure(state="disabled")
 
 def toggle_theme():
     """Toggles the application's theme between light and dark mode."""
     current = ctk.get_appearance_mode()
     ctk.set_appearance_mode("Light" if current == "Dark" else "Dark")
 
-def display_logs(textbox, log_list):
-    """Populates the main textbox with log entries."""
-    textbox.configure(state="normal")
-    textbox.delete("1.0", tk.END)
-    if not log_list:
-        textbox.insert(tk.END, "No logs found matching your criteria.")
+def display_logs(log_table, log_list):
+    """Shows the log entries in the virtual log table; only visible rows are drawn."""
+    with METRICS.stage("display_logs"):
+        log_table.set_rows(log_list)
+
+def jump_to_row(app_instance):
+    """Scrolls the log table to the row number typed in the 'Go to row' entry."""
+    try:
+        row_number = int(app_instance.jump_entry.get().strip())
+    except ValueError:
+        return
+    app_instance.log_table.jump_to_row(max(0, row_number - 1))
+
+def show_query_progress(app_instance, visible):
+    """Shows or hides the cancel button of a running query."""
+    if visible:
+        app_instance.query_cancel_button.grid()
+    else:
+        app_instance.query_cancel_button.grid_remove()
+
+def update_query_progress(app_instance, matched):
+    """Reports how many events a running query has matched so far."""
+    app_instance.logs_label.configure(text=f"🔄 Fetching... {matched} entries found so far")
+
+def show_export_progress(app_instance, visible):
+    """Shows or hides the export progress bar and its cancel button."""
+    if visible:
+        app_instance.export_progress.set(0)
+        app_instance.export_progress.grid()
+        app_instance.export_cancel_button.grid()
     else:
-        for log in log_list:
-            line = f"[{log['TimeGenerated']}] {log['SourceName']} (ID {log['EventID']}): {log['Message']}\n"
-            textbox.insert(tk.END, line)
-    textbox.see("1.0") # Scroll to top
-    textbox.configure(state="disabled")
+        app_instance.export_progress.grid_remove()
+        app_instance.export_cancel_button.grid_remove()
+
+def update_export_progress(app_instance, written, total):
+    """Moves the export progress bar and reports the row count."""
+    if total:
+        app_instance.export_progress.set(written / total)
+    app_instance.logs_label.configure(text=f"💾 Exporting... {written}" + (f" / {total}" if total else "") + " rows")
 
 def update_summary_cards(app_instance, total_logs_count, counts_by_type):
     """Updates the summary card labels on the dashboard."""
@@ -110,62 +206,86 @@ def update_summary_cards(app_instance, total_logs_count, counts_by_type):
     app_instance.system_card.configure(text=f"⚙️ System: {counts_by_type.get('System', 0)}")
     app_instance.application_card.configure(text=f"🧩 Application: {counts_by_type.get('Application', 0)}")
 
-def update_summary_tab(app_instance, logs):
-    """Updates the three summary frames with data from the provided logs."""
-    frames = [app_instance.event_id_summary_frame, app_instance.source_summary_frame, app_instance.event_type_summary_frame]
-    for frame in frames:
-        for widget in frame.winfo_children():
-            widget.destroy()
-
-    if not logs:
-        return
-
-    event_ids = Counter(log["EventID"] for log in logs)
-    sources = Counter(log["SourceName"] for log in logs)
-    event_types = Counter(log["EventType"] for log in logs)
-    
-    for eid, count in event_ids.most_common(20):
-        label = ctk.CTkLabel(app_instance.event_id_summary_frame, text=f"ID {eid}: {count} events", anchor="w")
-        label.pack(fill="x", padx=5, pady=2)
+def update_summary_tab(app_instance, aggregator):
+    """Updates the summary frames in place from the running aggregates."""
+    event_id_texts = [f"ID {eid}: {count} events" for eid, count in aggregator.top("event_ids")]
+    source_texts = [f"{source}: {count} events" for source, count in aggregator.top("sources")]
+    event_type_texts = [f"{EVENT_TYPE_LABELS.get(str(etype), f'Type {etype}')}: {count} events"
+                        for etype, count in aggregator.top("event_types")]
+    template_texts = [f"{count} × ID {eid}: {_shorten(pattern, TEMPLATE_TEXT_LENGTH)}"
+                      for (eid, pattern), count in aggregator.top("templates")]
 
-    for source, count in sources.most_common(20):
-        label = ctk.CTkLabel(app_instance.source_summary_frame, text=f"{source}: {count} events", anchor="w")
-        label.pack(fill="x", padx=5, pady=2)
+    _update_label_list(app_instance, app_instance.event_id_summary_frame, event_id_texts)
+    _update_label_list(app_instance, app_instance.source_summary_frame, source_texts)
+    _update_label_list(app_instance, app_instance.event_type_summary_frame, event_type_texts)
+    _update_label_list(app_instance, app_instance.template_summary_frame, template_texts)
 
-    type_labels = {"1": "Error", "2": "Warning", "4": "Information", "8": "Success Audit", "16": "Failure Audit"}
-    for etype, count in event_types.most_common(20):
-        label_text = type_labels.get(etype, f"Type {etype}")
-        label = ctk.CTkLabel(app_instance.event_type_summary_frame, text=f"{label_text}: {count} events", anchor="w")
-        label.pack(fill="x", padx=5, pady=2)
+def _shorten(text, length):
+    return text if len(text) <= length else text[:length - 1] + "…"
 
+def _update_label_list(app_instance, frame, texts):
+    """Reuses the labels already in 'frame', creating or hiding only the difference."""
+    pool = app_instance.summary_label_pools.setdefault(str(frame), {"labels": [], "shown": 0})
+    labels = pool["labels"]
+    for i, text in enumerate(texts):
+        if i == len(labels):
+            labels.append(ctk.CTkLabel(frame, text="", anchor="w"))
+        labels[i].configure(text=text)
+        if i >= pool["shown"]:
+            labels[i].pack(fill="x", padx=5, pady=2)
+    for label in labels[len(texts):pool["shown"]]:
+        label.pack_forget()
+    pool["shown"] = len(texts)
 
-def draw_event_graph(parent_frame, logs):
-    """Draws the event log bar graph on the dashboard."""
-    for widget in parent_frame.winfo_children():
-        widget.destroy()
 
-    if not logs:
-        return
+def draw_event_graph(app_instance, aggregator):
+    """Updates the hourly bar graph on the dashboard, creating the figure only once."""
+    hourly = aggregator.hourly(24)  # Most recent 24 hours for readability
+    if getattr(app_instance, "graph_canvas", None) is None:
+        if not hourly:
+            return
+        # matplotlib is slow to import, so it is only loaded once there is a graph to draw
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        fig = Figure(figsize=(8, 4), dpi=100)
+        ax = fig.add_subplot(111)
+        ax.set_title("Event Count Over Time (Last 24 Hours)")
+        ax.set_xlabel("Time")
+        ax.set_ylabel("Number of Events")
+        canvas = FigureCanvasTkAgg(fig, master=app_instance.graph_frame)
+        canvas.get_tk_widget().pack(fill="both", expand=True, padx=5, pady=5)
+        app_instance.graph_figure = fig
+        app_instance.graph_axes = ax
+        app_instance.graph_canvas = canvas
+        app_instance.graph_bars = None
+        app_instance.graph_bins = None
 
-    timestamps = [datetime.strptime(log['TimeGenerated'], "%Y-%m-%d %H:%M:%S") for log in logs if 'TimeGenerated' in log]
-    # Group by hour
-    time_bins = [ts.strftime("%Y-%m-%d %H:00") for ts in timestamps]
-    time_counts = Counter(time_bins)
-    
-    # Sort by time and limit to most recent 24 hours for readability
-    sorted_times = sorted(time_counts.keys())[-24:]
-    counts = [time_counts[t] for t in sorted_times]
+    fig = app_instance.graph_figure
+    ax = app_instance.graph_axes
+    bins = [hour for hour, _ in hourly]
+    counts = [count for _, count in hourly]
 
-    fig = Figure(figsize=(8, 4), dpi=100)
-    ax = fig.add_subplot(111)
-    
     # Use a different color based on theme
     bar_color = "#4e73df" if ctk.get_appearance_mode() == "Dark" else "#3366cc"
-    ax.bar(sorted_times, counts, color=bar_color)
-    
     bg_color = "#2b2b2b" if ctk.get_appearance_mode() == "Dark" else "#f0f0f0"
     text_color = "white" if ctk.get_appearance_mode() == "Dark" else "black"
-    
+
+    if bins == app_instance.graph_bins:
+        # Same hours as last time: just move the bars
+        for bar, count in zip(app_instance.graph_bars, counts):
+            bar.set_height(count)
+            bar.set_color(bar_color)
+    else:
+        if app_instance.graph_bars is not None:
+            app_instance.graph_bars.remove()
+        positions = range(len(bins))
+        app_instance.graph_bars = ax.bar(positions, counts, color=bar_color)
+        ax.set_xticks(list(positions))
+        ax.set_xticklabels(bins)
+        app_instance.graph_bins = bins
+        fig.tight_layout()
+    ax.set_ylim(0, max(counts, default=0) * 1.1 or 1)
+
     fig.patch.set_facecolor(bg_color)
     ax.set_facecolor(bg_color)
     ax.xaxis.label.set_color(text_color)
@@ -174,11 +294,4 @@ def draw_event_graph(parent_frame, logs):
     ax.tick_params(axis='x', colors=text_color, rotation=45)
     ax.tick_params(axis='y', colors=text_color)
 
-    ax.set_title("Event Count Over Time (Last 24 Hours)")
-    ax.set_xlabel("Time")
-    ax.set_ylabel("Number of Events")
-    
-    fig.tight_layout()
-    canvas = FigureCanvasTkAgg(fig, master=parent_frame)
-    canvas.draw()
-    canvas.get_tk_widget().pack(fill="both", expand=True, padx=5, pady=5)
+    app_instance.graph_canvas.draw_idle()